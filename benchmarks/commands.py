@@ -0,0 +1,56 @@
+"""
+Compares encoding ELIZA commands with lxml element trees (as done before)
+and with the string templates of CommandEncoder::
+
+    $ python benchmarks/commands.py
+"""
+
+import os
+import sys
+import timeit
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, os.pardir))
+
+from lxml import etree
+import weewar
+
+NUMBER = 20000
+E = weewar.ELIZA.ELEMENT
+encoder = weewar.CommandEncoder()
+
+
+def lxml_move():
+    game = E.weewar(game='123456')
+    unit = E.unit(x='3', y='4')
+    unit.append(E.move(x='5', y='6'))
+    game.append(unit)
+    return etree.tostring(game)
+
+
+def template_move():
+    return encoder.unit(123456, (3, 4), 'move', x=5, y=6)
+
+
+def lxml_build():
+    game = E.weewar(game='123456')
+    game.append(E.build(x='3', y='4', type='Heavy Tank'))
+    return etree.tostring(game)
+
+
+def template_build():
+    return encoder.build(123456, (3, 4), 'Heavy Tank')
+
+
+def main():
+    for name, old, new in [('move', lxml_move, template_move),
+                           ('build', lxml_build, template_build)]:
+        assert old() == new()
+        t_old = timeit.timeit(old, number=NUMBER) / NUMBER * 1e6
+        t_new = timeit.timeit(new, number=NUMBER) / NUMBER * 1e6
+        print('%-6s lxml %6.2f us  template %6.2f us  (%.1fx)' % (
+            name, t_old, t_new, t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
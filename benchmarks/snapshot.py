@@ -0,0 +1,44 @@
+"""
+Compares the binary snapshot format against JSON and pickle on size and load
+time, using the mappings shipped with the tests::
+
+    $ python benchmarks/snapshot.py
+"""
+
+import json
+import os
+import pickle
+import sys
+import timeit
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, os.pardir))
+
+import weewar
+
+MAPPINGS = os.path.join(_here, os.pardir, 'tests', 'mappings')
+NUMBER = 2000
+
+FORMATS = [
+    ('json', lambda v: json.dumps(v).encode('utf-8'),
+             lambda d: json.loads(d.decode('utf-8'))),
+    ('pickle', lambda v: pickle.dumps(v, pickle.HIGHEST_PROTOCOL),
+               pickle.loads),
+    ('snapshot', weewar.dumps_snapshot, weewar.loads_snapshot),
+]
+
+
+def main():
+    for name in ('game_state', 'map_layout'):
+        values = json.load(open(os.path.join(MAPPINGS, name + '.json')))
+        print('%s:' % name)
+        for fmt, dumps, loads in FORMATS:
+            data = dumps(values)
+            assert loads(data) == values
+            secs = timeit.timeit(lambda: loads(data), number=NUMBER)
+            print('  %-10s %8d bytes %10.1f us/load' % (
+                fmt, len(data), secs / NUMBER * 1e6))
+
+
+if __name__ == '__main__':
+    main()
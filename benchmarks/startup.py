@@ -0,0 +1,70 @@
+"""
+Measures how long ``import weewar`` takes using ``python -X importtime``
+(Python 3.7+) and lists the slowest imports. Exits with status 1 if the
+median is over :data:`STARTUP_BUDGET`::
+
+    $ python benchmarks/startup.py
+"""
+
+import os
+import subprocess
+import sys
+
+_here = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(_here, os.pardir)
+RUNS = 10
+
+#: maximum time in seconds ``import weewar`` may take
+STARTUP_BUDGET = 0.1
+
+
+def import_times(statement='import weewar'):
+    """
+    Returns ``[(module, self, cumulative, depth)]`` (times in microseconds)
+    in the order reported by the interpreter.
+    """
+    proc = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True)
+    _, output = proc.communicate()
+    times = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), int(self_), int(cumulative), depth))
+    return times
+
+
+def subtree(times, module):
+    """
+    Returns the entry of ``module`` and everything it imported.
+    """
+    for end, (name, _, _, depth) in enumerate(times):
+        if name == module:
+            break
+    start = end
+    while start > 0 and times[start - 1][3] > depth:
+        start -= 1
+    return times[start:end + 1]
+
+
+def main():
+    runs = [subtree(import_times(), 'weewar') for _ in range(RUNS)]
+    totals = sorted(times[-1][2] for times in runs)
+    median = totals[len(totals) // 2] / 1000.0
+    print('import weewar: %.1f ms (median of %d runs, budget %.0f ms)' % (
+        median, RUNS, STARTUP_BUDGET * 1000))
+    print('slowest imports:')
+    for name, self_, _, _ in sorted(runs[-1], key=lambda t: -t[1])[:10]:
+        print('  %-30s %8.1f ms' % (name, self_ / 1000.0))
+    for module in ('requests', 'lxml.objectify'):
+        times = subtree(import_times('import ' + module), module)
+        print('import %s (deferred): %.1f ms' % (
+            module, times[-1][2] / 1000.0))
+    return 1 if median > STARTUP_BUDGET * 1000 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Measures response sizes and fetch times with and without compression over a
+simulated slow link, using a local stand-in for the weewar server (needs
+pytest-localserver)::
+
+    $ python benchmarks/transfer.py [kbit/s]
+"""
+
+import gzip
+import logging
+import os
+import sys
+import time
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, os.pardir))
+
+from pytest_localserver.http import WSGIServer
+import weewar
+
+MAPPINGS = os.path.join(_here, os.pardir, 'tests', 'mappings')
+NUMBER = 20
+PACKET = 1024
+
+DOCUMENTS = {
+    '/api1/gamestate/': open(
+        os.path.join(MAPPINGS, 'game_state.xml'), 'rb').read(),
+    '/api1/map/': open(
+        os.path.join(MAPPINGS, 'map_layout.xml'), 'rb').read(),
+}
+
+
+def slow_server(bandwidth, compress):
+    """
+    WSGI application which sends the stand-in documents at ``bandwidth``
+    bytes per second, gzipped if ``compress`` is set and accepted.
+    """
+    def application(environ, start_response):
+        path = environ['PATH_INFO']
+        body = [doc for prefix, doc in DOCUMENTS.items()
+                if path.startswith(prefix)][0]
+        headers = [('Content-Type', 'application/xml')]
+        if compress and 'gzip' in environ.get('HTTP_ACCEPT_ENCODING', ''):
+            body = gzip.compress(body)
+            headers.append(('Content-Encoding', 'gzip'))
+        headers.append(('Content-Length', str(len(body))))
+        start_response('200 OK', headers)
+
+        def _send():
+            for start in range(0, len(body), PACKET):
+                packet = body[start:start + PACKET]
+                time.sleep(len(packet) / float(bandwidth))
+                yield packet
+        return _send()
+    return application
+
+
+def run(bandwidth, compress):
+    server = WSGIServer(application=slow_server(bandwidth, compress))
+    server.start()
+    try:
+        api = weewar.ELIZA(limiter=weewar.RateLimiter(1000))
+        api.HOST = server.url
+        start = time.time()
+        for _ in range(NUMBER):
+            api.game_state(18682)
+            api.map_layout(8)
+        elapsed = (time.time() - start) / NUMBER
+    finally:
+        server.stop()
+    return api.traffic_stats(), elapsed
+
+
+if __name__ == '__main__':
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    kbits = float(sys.argv[1]) if len(sys.argv) > 1 else 512
+    bandwidth = kbits * 1000 / 8
+    print('simulated link: %d kbit/s' % kbits)
+    for compress in (False, True):
+        traffic, elapsed = run(bandwidth, compress)
+        print('%s: %.1f ms per game state and map' % (
+            'gzip' if compress else 'identity', elapsed * 1000))
+        for endpoint, counts in sorted(traffic.items()):
+            print('    %-16s %6d bytes on the wire, %6d decoded' % (
+                endpoint, counts['wire'] / counts['requests'],
+                counts['decoded'] / counts['requests']))
@@ -28,6 +28,9 @@ setup(
     url="http://github.com/redtoad/python-weewar/",
     license='lgpl',
     py_modules=['weewar'],
+    entry_points={
+        'console_scripts': ['weewar = weewar:main'],
+    },
     install_requires=[
         'lxml>=2.1.5',
         'requests'
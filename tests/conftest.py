@@ -0,0 +1,6 @@
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    # async def and async for are syntax errors before Python 3.5
+    collect_ignore.append('test_watcher_async.py')
@@ -3,9 +3,15 @@
 Test correct behaviour of API calls.
 """
 
+import os
+import zlib
+
+from lxml import objectify
 import pytest
 import weewar
 
+_here = os.path.dirname(os.path.abspath(__file__))
+
 
 BOGUS_USER_ID = '???'
 BOGUS_GAME_ID = '???'
@@ -32,3 +38,145 @@ def test_missing_map_raises_exception():
     """
     pytest.raises(weewar.MapNotFound, weewar.map_layout, BOGUS_MAP_ID)
 
+
+def test_rate_limiter_serves_by_priority(monkeypatch):
+    import threading
+    import time
+    now = [0.0]
+    monkeypatch.setattr(weewar, '_clock', lambda: now[0])
+    limiter = weewar.RateLimiter(20)
+    limiter.acquire(weewar.PRIORITY_CRAWL)  # occupy the first slot
+    served = []
+
+    def _request(priority, deadline=None):
+        limiter.acquire(priority, deadline)
+        served.append((priority, deadline))
+
+    def _wait_for(condition):
+        timeout = time.time() + 5.0
+        while not condition():
+            assert time.time() < timeout
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=_request, args=args) for args in [
+        (weewar.PRIORITY_CRAWL, ), (weewar.PRIORITY_POLL, ),
+        (weewar.PRIORITY_COMMAND, 20), (weewar.PRIORITY_COMMAND, 10)]]
+    for thread in threads:
+        thread.start()
+    _wait_for(lambda: len(limiter.waiting) == 4)
+    for step in range(1, 5):
+        now[0] = float(step)  # time for exactly one more request
+        _wait_for(lambda: len(served) == step)
+    for thread in threads:
+        thread.join()
+    assert served == [(weewar.PRIORITY_COMMAND, 10),
+                      (weewar.PRIORITY_COMMAND, 20),
+                      (weewar.PRIORITY_POLL, None),
+                      (weewar.PRIORITY_CRAWL, None)]
+    metrics = limiter.metrics()
+    assert metrics['crawl']['served'] == 2
+    assert metrics['command']['waiting'] == 0
+
+
+def _record_priorities(monkeypatch, api):
+    priorities = []
+
+    def _call_api(url, data=None, priority=weewar.PRIORITY_POLL,
+                  deadline=None):
+        priorities.append(priority)
+        name = 'headquarter' if 'headquarters' in url else 'game_state'
+        path = os.path.join(_here, 'mappings', '%s.xml' % name)
+        return objectify.fromstring(open(path, 'rb').read())
+    monkeypatch.setattr(api, '_call_api', _call_api)
+    return priorities
+
+
+def test_game_states_in_need_of_attention_go_first(monkeypatch):
+    api = weewar.ELIZA('ai_bot', 'secret')
+    priorities = _record_priorities(monkeypatch, api)
+    api.game_state(21885)
+    api.headquarter()
+    api.game_state(21885)
+    api.game_state(18682)
+    assert priorities == [weewar.PRIORITY_POLL, weewar.PRIORITY_POLL,
+                          weewar.PRIORITY_ATTENTION, weewar.PRIORITY_POLL]
+
+
+def test_instance_priority_keeps_commands_first(monkeypatch):
+    class _Limiter (weewar.RateLimiter):
+        def acquire(self, priority=weewar.PRIORITY_POLL, deadline=None):
+            priorities.append(priority)
+            raise weewar.ServerError
+    priorities = []
+    api = weewar.ELIZA('ai_bot', 'secret', limiter=_Limiter(1))
+    api.priority = weewar.PRIORITY_CRAWL
+    pytest.raises(weewar.ServerError, api.finish_turn, 18682)
+    pytest.raises(weewar.ServerError, api.headquarter)
+    assert priorities == [weewar.PRIORITY_COMMAND, weewar.PRIORITY_CRAWL]
+
+
+def test_adaptive_rate_limiter():
+    limiter = weewar.AdaptiveRateLimiter(
+        2.0, floor=1.0, ceiling=3.0, increase=0.5, cooldown=60)
+    for _ in range(5):
+        limiter.report(True, 0.1)
+    assert limiter.rate == 3.0
+    limiter.report(False, 0.1)
+    assert limiter.rate == 1.5
+    # requests sent before the cut do not cut again
+    limiter.report(False, 0.1)
+    limiter.report(True, 1.0)  # latency spike
+    assert limiter.rate == 1.5
+    limiter.last_cut -= 60
+    limiter.report(True, 1.0)
+    assert limiter.rate == 1.0
+    throttle = limiter.metrics()['throttle']
+    assert throttle['rate'] == 1.0
+    assert (throttle['errors'], throttle['spikes'], throttle['decreases']) == (
+        2, 2, 2)
+
+
+def test_server_errors_slow_down(httpserver, monkeypatch):
+    limiter = weewar.AdaptiveRateLimiter(10.0, floor=1.0)
+    api = weewar.ReadOnlyAPI(limiter=limiter)
+    monkeypatch.setattr(api, 'HOST', httpserver.url)
+    httpserver.serve_content('<error/>', code=500)
+    pytest.raises(weewar.ServerError, api.game, 1)
+    assert limiter.rate == 5.0
+
+
+def _gzip(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def test_responses_are_parsed_while_streaming(httpserver, monkeypatch):
+    api = weewar.ELIZA()
+    monkeypatch.setattr(api, 'HOST', httpserver.url)
+    monkeypatch.setattr(api, 'CHUNK_SIZE', 64)
+    xml = open(os.path.join(_here, 'mappings', 'map_layout.xml'), 'rb').read()
+    httpserver.serve_content(_gzip(xml),
+                             headers={'Content-Encoding': 'gzip'})
+    streamed = api.map_layout(8)
+    assert streamed == api._parse_map_layout(objectify.fromstring(xml))
+
+
+@pytest.mark.parametrize('encoding, compress', [
+    (None, lambda data: data),
+    ('gzip', _gzip),
+    ('deflate', zlib.compress),
+    ('deflate', lambda data: zlib.compress(data)[2:-4]),  # without header
+])
+def test_compressed_responses_are_counted(httpserver, monkeypatch, encoding,
+                                          compress):
+    api = weewar.ELIZA()
+    monkeypatch.setattr(api, 'HOST', httpserver.url)
+    xml = open(os.path.join(_here, 'mappings', 'game_state.xml'), 'rb').read()
+    body = compress(xml)
+    headers = {'Content-Encoding': encoding} if encoding else {}
+    httpserver.serve_content(body, headers=headers)
+    api.game_state(18682)
+    api.game_state(18682)
+    assert httpserver.requests[-1].headers['Accept-Encoding'] == 'gzip, deflate'
+    assert api.traffic_stats() == {'/api1/gamestate': {
+        'requests': 2, 'wire': 2 * len(body), 'decoded': 2 * len(xml)}}
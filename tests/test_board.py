@@ -0,0 +1,134 @@
+import copy
+import json
+import os
+import pytest
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+STATE = json.load(open(os.path.join(_here, 'mappings', 'game_state.json')))
+
+
+@pytest.fixture
+def board():
+    state = copy.deepcopy(STATE)
+    # free eviltwin's base and give them an empty airfield
+    faction = state['factions'][0]
+    faction['units'][0].update(x=2, y=9)
+    faction['terrain'].append({'x': 0, 'y': 0, 'type': 'Airfield',
+                               'finished': False})
+    return weewar.GameBoard(state, 'eviltwin')
+
+
+@pytest.mark.parametrize('position, unit, exception', [
+    ((9, 9), weewar.TROOPER, weewar.NotYourTerrain),
+    ((0, 0), weewar.TANK, weewar.WrongTerrain),
+    ((1, 10), weewar.BATTLESHIP, weewar.WrongTerrain),
+    ((1, 10), weewar.DFA, weewar.NotEnoughCredits),
+])
+def test_invalid_build(board, position, unit, exception):
+    pytest.raises(exception, board.check_build, position, unit)
+
+
+def test_build_updates_board(board):
+    board.check_build((1, 10), weewar.TANK)
+    board.apply_build((1, 10), weewar.TANK)
+    assert board.credits == 300
+    pytest.raises(weewar.CannotBuildMoreUnitsHere,
+                  board.check_build, (1, 10), weewar.TROOPER)
+
+
+def test_unit_commands(board):
+    pytest.raises(weewar.NotYourUnit, board.check_command, (2, 10), 'capture')
+    pytest.raises(weewar.FieldIsBlocked,
+                  board.check_command, (2, 9), 'move', x='3', y='9')
+    board.check_command((2, 9), 'move', x='2', y='8')
+    board.apply_result({'command': 'move', 'position': (2, 9), 'to': (2, 8)})
+    pytest.raises(weewar.NotYourUnit, board.check_command, (2, 9), 'repair')
+    board.check_command((2, 8), 'repair')
+
+
+def test_validating_api_rejects_locally(board):
+    api = weewar.ELIZA('eviltwin', 'secret', validate=True)
+    api.HOST = 'http://localhost:1'  # would fail if a request was made
+    api.boards[STATE['id']] = board
+    pytest.raises(weewar.NotYourTerrain,
+                  api.build, STATE['id'], (9, 9), weewar.TROOPER)
+    pytest.raises(weewar.NotYourUnit,
+                  api._unit_command, STATE['id'], (2, 10), 'capture')
+
+
+def test_attack_result_updates_board(board):
+    board.apply_result({'command': 'attack', 'position': (2, 9),
+                        'target': (3, 9), 'damageInflicted': 10,
+                        'damageReceived': 3, 'remainingQuantity': 4})
+    state = board.to_state()
+    mine, theirs = state['factions']
+    assert mine['units'] == [{'x': 2, 'y': 9, 'type': 'Light Artillery',
+                              'quantity': 4, 'finished': True}]
+    assert (3, 9) not in [(u['x'], u['y']) for u in theirs['units']]
+
+
+def test_capture_result_updates_board(board):
+    board.apply_result({'command': 'capture', 'position': (9, 9),
+                        'finished': True})
+    assert board.terrain[9, 9] == ('eviltwin', 'Base')
+
+
+def test_unit_result_is_parsed():
+    from lxml import objectify
+    node = objectify.fromstring(
+        '<ok><attack target="[5,7]" damageReceived="2" damageInflicted="7" '
+        'remainingQuantity="8" /></ok>')
+    result = weewar.ELIZA()._parse_unit_result(
+        node, (4, 7), 'attack', x='5', y='7')
+    assert result == {'command': 'attack', 'position': (4, 7),
+                      'target': (5, 7), 'damageReceived': 2,
+                      'damageInflicted': 7, 'remainingQuantity': 8}
+
+
+def test_board_state_roundtrip():
+    assert weewar.GameBoard(STATE, 'eviltwin').to_state() == STATE
+
+
+def test_board_state_keeps_terrain_fields():
+    state = copy.deepcopy(STATE)
+    mine, theirs = state['factions']
+    mine['terrain'][0].update(finished=True, extra='kept')
+    theirs['terrain'].append({'x': 9, 'y': 9, 'type': 'Base',
+                              'finished': True})
+    board = weewar.GameBoard(state, 'eviltwin')
+    board.apply_result({'command': 'capture', 'position': (9, 9),
+                        'finished': True})
+    mine, theirs = board.to_state()['factions']
+    assert state['factions'][0]['terrain'][0] in mine['terrain']
+    assert {'x': 9, 'y': 9, 'type': 'Base', 'finished': True} in mine['terrain']
+    assert (9, 9) not in [(t['x'], t['y']) for t in theirs['terrain']]
+
+
+def test_boards_are_only_kept_when_validating(monkeypatch):
+    api = weewar.ELIZA('eviltwin', 'secret')
+    monkeypatch.setattr(api, '_call_api', lambda *args, **kwargs: None)
+    monkeypatch.setattr(api, '_parse_game_state', lambda node: STATE)
+    assert api.board(STATE['id']) == STATE
+    assert api.boards == {}
+    api.validate = True
+    api.board(STATE['id'])
+    assert STATE['id'] in api.boards
+
+
+def test_unit_result_is_parsed_once(board, monkeypatch):
+    from lxml import objectify
+    api = weewar.ELIZA('eviltwin', 'secret', validate=True)
+    api.boards[STATE['id']] = board
+    monkeypatch.setattr(api, '_send_command', lambda *args, **kwargs:
+                        objectify.fromstring('<ok/>'))
+    parse, calls = api._parse_unit_result, []
+
+    def _parse(*args, **kwargs):
+        calls.append(args)
+        return parse(*args, **kwargs)
+    monkeypatch.setattr(api, '_parse_unit_result', _parse)
+    assert api.move(STATE['id'], (2, 9), (2, 8))['to'] == (2, 8)
+    assert len(calls) == 1
+    assert (2, 8) in board.units
@@ -0,0 +1,90 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+def _serve_map(httpserver):
+    httpserver.serve_content(
+        open(os.path.join(_here, 'mappings', 'map_layout.xml')).read())
+
+
+@pytest.fixture
+def cache_server(tmpdir):
+    path = str(tmpdir.join('cache.sock'))
+    server = weewar.CacheServer(path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    deadline = time.time() + 5
+    while not os.path.exists(path) and time.time() < deadline:
+        time.sleep(0.001)
+    yield server
+    server.shutdown()
+    thread.join()
+
+
+@pytest.mark.parametrize('backend', ['memory', 'socket'])
+def test_cached_map_layout(httpserver, monkeypatch, request, backend):
+    if backend == 'memory':
+        cache = weewar.MemoryCache()
+    else:
+        cache = weewar.SocketCache(request.getfixturevalue('cache_server').path)
+    _serve_map(httpserver)
+    first = weewar.ELIZA(cache=cache)
+    monkeypatch.setattr(first, 'HOST', httpserver.url)
+    layout = first.map_layout(8)
+    # another instance gets the result from the cache
+    httpserver.serve_content('gone', 500)
+    second = weewar.ELIZA(cache=cache)
+    monkeypatch.setattr(second, 'HOST', httpserver.url)
+    assert second.map_layout(8) == layout
+
+
+def test_unreachable_cache_is_a_miss(tmpdir):
+    cache = weewar.SocketCache(str(tmpdir.join('missing.sock')))
+    assert cache.get('key') is None
+    cache.set('key', b'value', 10)
+
+
+def test_memory_cache_expires():
+    cache = weewar.MemoryCache(size=2)
+    cache.set('a', b'1', -1)
+    cache.set('b', b'2', 10)
+    cache.set('c', b'3', 10)
+    assert cache.get('a') is None
+    assert cache.get('c') == b'3'
+
+
+def test_memory_cache_drops_least_recently_used():
+    cache = weewar.MemoryCache(size=2)
+    cache.set('a', b'1', 10)
+    cache.set('b', b'2', 10)
+    assert cache.get('a') == b'1'
+    cache.set('c', b'3', 10)
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1'
+    assert cache.get('c') == b'3'
+
+
+def test_truncated_request_ends_connection():
+    server = weewar.CacheServer('unused')
+    ours, theirs = socket.socketpair()
+    ours.sendall(weewar._CACHE_REQUEST.pack(b's', 10, 10, 1.0) + b'key')
+    ours.close()
+    server.handle(theirs)  # returns without raising
+    theirs.close()
+
+
+def test_only_sockets_are_replaced(tmpdir):
+    path = tmpdir.join('cache.sock')
+    path.write('not a socket')
+    server = weewar.CacheServer(str(path))
+    pytest.raises(socket.error, server.serve_forever)
+    assert path.read() == 'not a socket'
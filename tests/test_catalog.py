@@ -0,0 +1,72 @@
+import copy
+import gc
+import os
+import pickle
+
+import pytest
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+def _xml(name):
+    return open(os.path.join(_here, 'mappings', name + '.xml'), 'rb').read()
+
+
+def test_responses_share_records(httpserver, monkeypatch):
+    catalog = weewar.Catalog()
+    first, second = weewar.ReadOnlyAPI(catalog=catalog), weewar.ELIZA(
+        catalog=catalog)
+    for api in first, second:
+        monkeypatch.setattr(api, 'HOST', httpserver.url)
+    httpserver.serve_content(_xml('all_users'))
+    users = first.all_users()
+    again = second.all_users()
+    assert users == again
+    assert all(a is b for a, b in zip(users, again))
+    assert len(catalog) == len(users)
+
+    httpserver.serve_content(_xml('latest_map'))
+    maps = first.latest_maps()
+    assert maps[0] is second.latest_maps()[0]
+
+
+def test_strings_are_interned():
+    catalog = weewar.Catalog()
+    name = ''.join(['iron', 'camel'])
+    user = catalog.canonical({'name': name, 'games': [{'id': 1, 'name': 'x'}],
+                              'preferredPlayers': [{'id': 3, 'name': 'a'}]})
+    assert user['name'] is catalog.intern('ironcamel')
+    assert user['games'][0] is catalog.record({'id': 1, 'name': 'x'})
+
+
+def test_unused_records_are_dropped():
+    catalog = weewar.Catalog()
+    users = catalog.canonical([{'id': n, 'name': 'user%d' % n}
+                               for n in range(100)])
+    assert len(catalog) == 100
+    del users
+    gc.collect()
+    assert len(catalog) == 0
+
+
+def test_types_are_kept_apart():
+    catalog = weewar.Catalog()
+    flags = [catalog.record({'a': value}) for value in (True, 1, 1.0)]
+    assert [type(record['a']) for record in flags] == [bool, int, float]
+
+
+def test_records_are_read_only():
+    record = weewar.Catalog().record({'id': 1, 'name': 'x'})
+    with pytest.raises(TypeError):
+        record['id'] = 2
+    with pytest.raises(TypeError):
+        record.update(id=2)
+    with pytest.raises(TypeError):
+        del record['name']
+    assert record == {'id': 1, 'name': 'x'}
+    for clone in (copy.copy(record), copy.deepcopy(record),
+                  pickle.loads(pickle.dumps(record))):
+        clone['id'] = 2
+        assert clone == {'id': 2, 'name': 'x'}
@@ -0,0 +1,90 @@
+import io
+import json
+import os
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+def _run(argv, stdin=''):
+    out = io.StringIO()
+    code = weewar.main(argv, io.StringIO(stdin), out)
+    return code, [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_ids_from_stdin(httpserver):
+    httpserver.serve_content(
+        open(os.path.join(_here, 'mappings', 'game.xml')).read())
+    code, records = _run(['--host', httpserver.url, '--rate', '1000',
+                          'game'], '1 2\n3\n')
+    expected = json.load(open(os.path.join(_here, 'mappings', 'game.json')))
+    assert code == 0
+    assert sorted(r['id'] for r in records) == [1, 2, 3]
+    assert all(r['result'] == expected for r in records)
+
+
+def test_errors_are_reported(httpserver):
+    httpserver.serve_content('', 404)
+    code, records = _run(['--host', httpserver.url, 'map-layout', '7'])
+    assert code == 1
+    assert records == [{'id': 7, 'error': 'MapNotFound: 7'}]
+
+
+def test_bad_ids_are_reported(httpserver):
+    httpserver.serve_content(
+        open(os.path.join(_here, 'mappings', 'game.xml')).read())
+    code, records = _run(['--host', httpserver.url, '--rate', '1000',
+                          'game'], 'abc 1\n')
+    assert code == 1
+    records.sort(key=lambda r: str(r['id']))
+    assert records[0]['id'] == 1 and 'result' in records[0]
+    assert records[1] == {
+        'id': 'abc',
+        'error': "ValueError: invalid literal for int() with base 10: 'abc'"}
+
+
+def test_list_command_errors_are_reported(httpserver):
+    httpserver.serve_content('', 500)
+    code, records = _run(['--host', httpserver.url, 'open-games'])
+    assert code == 1
+    assert records == [{'error': 'ServerError: '}]
+
+
+def test_list_command(httpserver):
+    httpserver.serve_content(
+        open(os.path.join(_here, 'mappings', 'open_games.xml')).read())
+    code, records = _run(['--host', httpserver.url, 'open-games'])
+    expected = json.load(
+        open(os.path.join(_here, 'mappings', 'open_games.json')))
+    assert code == 0
+    assert records == expected
+
+
+def test_unit_commands_from_stdin(httpserver):
+    httpserver.serve_content('<ok><move x="5" y="6"/></ok>')
+    code, records = _run(['--host', httpserver.url, '--rate', '1000',
+                          '--username', 'ai_bot', '--key', 'secret', 'move'],
+                         '12 3 4 5 6\n\n12 5 6 7\n12 5 6 5 7\n')
+    records = dict((r.pop('record'), r) for r in records)
+    assert code == 1
+    assert records['12 3 4 5 6'] == {'result': {
+        'command': 'move', 'position': [3, 4], 'to': [5, 6]}}
+    assert records['12 5 6 7']['error'].startswith('ValueError: ')
+    assert 'result' in records['12 5 6 5 7']
+    # commands for the same game are sent in order
+    encoder = weewar.CommandEncoder()
+    assert [r.get_data() for r in httpserver.requests] == [
+        encoder.unit(12, (3, 4), 'move', x=5, y=6),
+        encoder.unit(12, (5, 6), 'move', x=5, y=7)]
+
+
+def test_unit_command_from_arguments(httpserver):
+    httpserver.serve_content('<ok/>')
+    code, records = _run(['--host', httpserver.url, '--username', 'ai_bot',
+                          '--key', 'secret', 'build', '12', '3', '4',
+                          'Heavy Tank'])
+    assert (code, records) == (0, [
+        {'record': '12 3 4 Heavy Tank', 'result': True}])
+    assert httpserver.requests[-1].get_data() == (
+        weewar.CommandEncoder().build(12, (3, 4), 'Heavy Tank'))
@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+import weewar
+
+
+@pytest.fixture
+def coordinator():
+    server = weewar.ClusterCoordinator(
+        ('127.0.0.1', 0), ['a', 'b', 'c', 'd'], rate=50, heartbeat=0.05,
+        timeout=0.3)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    server.ready.wait()
+    yield server
+    server.shutdown()
+    thread.join()
+
+
+def _worker(coordinator):
+    items = set()
+    worker = weewar.ClusterWorker(
+        coordinator.address, items.add, items.discard)
+    return worker, items
+
+
+def test_items_are_spread_over_workers(coordinator):
+    first, first_items = _worker(coordinator)
+    first.beat()
+    assert first_items == set('abcd')
+    second, second_items = _worker(coordinator)
+    second.beat()  # registers, but the items are still held by the first
+    assert not second_items
+    first.beat()  # lets go of two items
+    second.beat()
+    assert len(first_items) == len(second_items) == 2
+    assert first_items | second_items == set('abcd')
+    second.leave()
+    assert not second_items
+    first.beat()
+    assert first_items == set('abcd')
+
+
+def test_items_of_dead_worker_are_reassigned(coordinator):
+    first, first_items = _worker(coordinator)
+    second, second_items = _worker(coordinator)
+    for _ in range(2):
+        first.beat()
+        second.beat()
+    assert len(second_items) == 2
+    for _ in range(8):  # the first worker dies
+        time.sleep(0.05)
+        second.beat()
+    assert second_items == set('abcd')
+    assert coordinator.status()['lost'] == 1
+    # the dead worker comes back and has to register again
+    first.beat()
+    assert not first_items
+    assert first.worker_id is None
+
+
+def test_worker_releases_items_without_coordinator(coordinator):
+    worker, items = _worker(coordinator)
+    worker.beat()
+    assert items == set('abcd')
+    coordinator.shutdown()
+    coordinator.server.server_close()
+    worker.sock.close()
+    worker.sock = None
+    worker.last_ok = weewar._clock()
+    worker.beat()  # not long enough to give up
+    assert items == set('abcd')
+    worker.last_ok -= 1.0
+    worker.beat()
+    assert not items
+
+
+def test_shared_request_budget(coordinator):
+    limiters = [weewar.ClusterLimiter(coordinator.address) for _ in range(2)]
+    start = time.time()
+    threads = [threading.Thread(target=lambda l=l: [l.acquire()
+                                                    for _ in range(10)])
+               for l in limiters]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 20 requests at 50 per second across both clients
+    assert time.time() - start >= 19 / 50.0 - 0.01
+    metrics = coordinator.status()['limiter']
+    assert metrics['poll']['served'] == 20
+    assert limiters[0].metrics()['poll']['served'] == 10
+
+
+def test_unreachable_coordinator_falls_back(tmpdir):
+    limiter = weewar.ClusterLimiter(str(tmpdir.join('missing.sock')),
+                                    fallback=100)
+    limiter.acquire()
+    assert limiter.down_since is not None
+    assert limiter.idle() in (True, False)
+
+
+def test_unix_socket_and_api(tmpdir):
+    path = str(tmpdir.join('cluster.sock'))
+    server = weewar.ClusterCoordinator(path, [1, 2])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    server.ready.wait()
+    try:
+        games = []
+        worker = weewar.ClusterWorker(path, games.append, games.remove)
+        worker.beat()
+        assert games == [1, 2]
+        assert worker.api('ai_bot', 'secret').limiter is worker.limiter
+        assert worker.limiter.idle()
+        worker.leave()
+        assert server.status()['unassigned'] == [1, 2]
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_running_workers(coordinator):
+    first, first_items = _worker(coordinator)
+    second, second_items = _worker(coordinator)
+    first.start()
+    second.start()
+    try:
+        _wait_for(lambda: len(first_items) == len(second_items) == 2)
+        first.stop()
+        _wait_for(lambda: len(second_items) == 4)
+        assert not first_items
+    finally:
+        first.stop()
+        second.stop()
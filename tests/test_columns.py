@@ -0,0 +1,42 @@
+import copy
+import json
+import os
+import pytest
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def columns(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(weewar, '_numpy', lambda: None)
+    elif weewar._numpy() is None:
+        pytest.skip('numpy not installed')
+    state = json.load(open(os.path.join(_here, 'mappings', 'game_state.json')))
+    later = copy.deepcopy(state)
+    later['round'] += 1
+    later['factions'][0]['credits'] = 800
+    return weewar.GameColumns.from_states([state, later]), [state, later]
+
+
+def test_unit_counts(columns):
+    columns, states = columns
+    counts = columns.unit_counts(by_quantity=False)
+    assert counts[('eviltwin', 'Light Artillery')] == 2
+    assert sum(columns.unit_counts().values()) == sum(
+        unit['quantity'] for state in states
+        for faction in state['factions'] for unit in faction['units'])
+
+
+def test_base_share(columns):
+    columns, _ = columns
+    shares = columns.base_share()
+    assert sorted(shares) == [(18682, 21), (18682, 22)]
+    assert sum(shares[18682, 21].values()) == pytest.approx(1.0)
+
+
+def test_credits(columns):
+    columns, _ = columns
+    assert columns.credits() == {(18682, 'eviltwin'): [(21, 600), (22, 800)]}
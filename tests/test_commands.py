@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Encoded ELIZA commands have to match what lxml generates.
+"""
+
+from lxml import etree
+import pytest
+
+from weewar import ELIZA, CommandEncoder
+
+E = ELIZA.ELEMENT
+encoder = CommandEncoder()
+
+STRANGE = u'a<b>&"\'\r\n\t\xfc€ ]]>'
+
+
+def _game(game_id, node):
+    game = E.weewar(game=str(game_id))
+    game.append(node)
+    return etree.tostring(game)
+
+
+def _unit(position, command, **attrs):
+    unit = E.unit(x=str(position[0]), y=str(position[1]))
+    unit.append(getattr(E, command)(**attrs))
+    return unit
+
+
+@pytest.mark.parametrize('encoded, expected', [
+    (encoder.simple(12, 'finishTurn'), _game(12, E.finishTurn())),
+    (encoder.chat(12, 'Hello!'), _game(12, E.chat('Hello!'))),
+    (encoder.chat(12, STRANGE), _game(12, E.chat(STRANGE))),
+    (encoder.chat(12, ''), _game(12, E.chat(''))),
+    (encoder.build(12, (3, 4), 'Heavy Tank'),
+     _game(12, E.build(x='3', y='4', type='Heavy Tank'))),
+    (encoder.build(12, (3, 4), STRANGE),
+     _game(12, E.build(x='3', y='4', type=STRANGE))),
+    (encoder.movement_options(12, (3, 4), 'Trooper'),
+     _game(12, E.movementOptions(x='3', y='4', type='Trooper'))),
+    (encoder.attack_options(12, (3, 4), 'Jet'),
+     _game(12, E.attackOptions(x='3', y='4', type='Jet'))),
+    (encoder.attack_options(12, (3, 4), 'Jet', 1),
+     _game(12, E.attackOptions(x='3', y='4', type='Jet', moved='1'))),
+    (encoder.unit(12, (1, 2), 'move', x=3, y=4),
+     _game(12, _unit((1, 2), 'move', x='3', y='4'))),
+    (encoder.unit(12, (1, 2), 'attack', x='3', y='4'),
+     _game(12, _unit((1, 2), 'attack', x='3', y='4'))),
+    (encoder.unit(12, (1, 2), 'capture'), _game(12, _unit((1, 2), 'capture'))),
+    (encoder.unit(12, (1, 2), 'repair'), _game(12, _unit((1, 2), 'repair'))),
+])
+def test_encoded_command_matches_lxml(encoded, expected):
+    assert encoded == expected
+
+
+def test_non_ascii_text():
+    expected = b'<weewar game="12"><chat>h&#252;gel &amp; t&#228;ler</chat></weewar>'
+    assert encoder.chat(12, u'h\xfcgel & t\xe4ler') == expected
+    assert encoder.chat(12, u'h\xfcgel & t\xe4ler'.encode('utf-8')) == expected
+    assert encoder.build(12, (3, 4), u'T\xe4nk') == (
+        b'<weewar game="12"><build x="3" y="4" type="T&#228;nk"/></weewar>')
+
+
+def test_command_is_posted(httpserver, monkeypatch):
+    api = ELIZA('ai_bot', 'secret')
+    monkeypatch.setattr(api, 'HOST', httpserver.url)
+    httpserver.serve_content('<ok/>')
+    assert api.build(12, (3, 4), 'Tank')
+    assert httpserver.requests[-1].get_data() == encoder.build(12, (3, 4), 'Tank')
+    assert api.chat(12, u'gr\xfc\xdfe')
+    assert httpserver.requests[-1].get_data() == (
+        b'<weewar game="12"><chat>gr&#252;&#223;e</chat></weewar>')
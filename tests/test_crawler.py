@@ -0,0 +1,107 @@
+import json
+
+import weewar
+
+
+class FakeAPI (object):
+
+    """
+    Two users sharing the same game.
+    """
+
+    calls = []
+
+    def all_users(self):
+        return [{'id': 1, 'name': 'alice'}, {'id': 2, 'name': 'bob'}]
+
+    def user(self, name):
+        self.calls.append(('user', name))
+        return {'name': name, 'games': [{'id': 10, 'name': 'shared'}]}
+
+    def game(self, id_):
+        self.calls.append(('game', id_))
+        return {'id': id_, 'map': 5, 'players': [
+            {'username': 'alice'}, {'username': 'bob'}, {'username': 'carol'}]}
+
+    def map_layout(self, id_):
+        self.calls.append(('map', id_))
+        raise weewar.MapNotFound(id_)
+
+
+class FakeCrawler (weewar.Crawler):
+
+    def api(self):
+        return FakeAPI()
+
+
+def test_crawler_fetches_everything_once(tmpdir):
+    FakeAPI.calls = []
+    output = str(tmpdir.join('crawl.jsonl'))
+    crawler = FakeCrawler(output, str(tmpdir.join('crawl.json')), workers=3)
+    crawler.run()
+    assert sorted(FakeAPI.calls) == [
+        ('game', 10), ('map', 5),
+        ('user', 'alice'), ('user', 'bob'), ('user', 'carol')]
+    records = [json.loads(line) for line in open(output)]
+    assert len(records) == 5
+    assert [r['kind'] for r in records if 'error' in r] == ['map']
+
+
+def test_crawler_resumes_from_checkpoint(tmpdir):
+    FakeAPI.calls = []
+    checkpoint = tmpdir.join('crawl.json')
+    checkpoint.write(json.dumps({
+        'seen': {'user': ['alice', 'bob'], 'game': [10], 'map': [5]},
+        'pending': [['user', 'bob']],
+    }))
+    crawler = FakeCrawler(str(tmpdir.join('crawl.jsonl')), str(checkpoint))
+    crawler.run()
+    assert FakeAPI.calls == [('user', 'bob')]
+    assert json.loads(checkpoint.read())['pending'] == []
+
+
+def test_checkpoint_keeps_items_taken_from_queue(tmpdir):
+    checkpoint = tmpdir.join('crawl.json')
+    crawler = FakeCrawler(str(tmpdir.join('crawl.jsonl')), str(checkpoint))
+    crawler.enqueue(crawler.USER, 'alice')
+    crawler.enqueue(crawler.GAME, 10)
+    crawler.queue.get()  # taken by a worker, but not fetched yet
+    crawler.save_checkpoint()
+    assert sorted(json.loads(checkpoint.read())['pending']) == [
+        ['game', 10], ['user', 'alice']]
+
+
+def test_resume_skips_results_written_after_checkpoint(tmpdir):
+    FakeAPI.calls = []
+    output = tmpdir.join('crawl.jsonl')
+    output.write(json.dumps({'kind': 'user', 'id': 'bob', 'data': {
+        'name': 'bob', 'games': [{'id': 10, 'name': 'shared'}]}}) + '\n' +
+        '{"kind": "user", "id": "al')  # interrupted while writing alice
+    checkpoint = tmpdir.join('crawl.json')
+    checkpoint.write(json.dumps({
+        'seen': {'user': ['alice', 'bob'], 'game': [], 'map': []},
+        'pending': [['user', 'alice'], ['user', 'bob']],
+        'written': 0,
+    }))
+    FakeCrawler(str(output), str(checkpoint)).run()
+    assert sorted(FakeAPI.calls) == [
+        ('game', 10), ('map', 5), ('user', 'alice'), ('user', 'carol')]
+    records = [json.loads(line) for line in output.readlines()]
+    items = [(r['kind'], r['id']) for r in records]
+    assert len(items) == len(set(items)) == 5
+
+
+def test_checkpoint_keeps_ids_as_bitmap(tmpdir):
+    checkpoint = tmpdir.join('crawl.json')
+    crawler = FakeCrawler(str(tmpdir.join('crawl.jsonl')), str(checkpoint))
+    for id_ in range(10000):
+        crawler.enqueue(crawler.GAME, id_)
+    crawler.enqueue(crawler.USER, 'alice')
+    crawler.pending.clear()
+    crawler.save_checkpoint()
+    assert len(checkpoint.read()) < 1000  # a list of ids takes 58 kB
+    resumed = FakeCrawler(str(tmpdir.join('crawl.jsonl')), str(checkpoint))
+    resumed.load_checkpoint()
+    assert 9999 in resumed.seen['game'] and 10000 not in resumed.seen['game']
+    assert 'alice' in resumed.seen['user']
+    assert 'bob' not in resumed.seen['user']
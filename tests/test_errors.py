@@ -0,0 +1,89 @@
+import pytest
+
+import weewar
+
+
+@pytest.fixture
+def api(httpserver, monkeypatch):
+    monkeypatch.setattr(weewar.ELIZA, 'HOST', httpserver.url)
+    return weewar.ELIZA('ai_bot', 'secret', weewar.RateLimiter(1000))
+
+
+def _error(httpserver, text):
+    httpserver.serve_content('<error>%s</error>' % text)
+
+
+@pytest.mark.parametrize('text, command, exception, args', [
+    ('Not enough credits.', 'build', weewar.NotEnoughCredits, ('Tank', )),
+    ('Not your terrain.', 'build', weewar.NotYourTerrain, (3, 4)),
+    ('Blocked by a unit.', 'build', weewar.FieldIsBlocked, (3, 4)),
+    ('Blocked by a unit.', 'move', weewar.FieldIsBlocked, (5, 6)),
+    ('Not your Unit.', 'move', weewar.NotYourUnit, (3, 4)),
+    ('Not your turn.', 'move', weewar.NotYourTurn, ()),
+    ('Game not found', 'finish_turn', weewar.GameNotFound, (12, )),
+])
+def test_errors_are_typed(api, httpserver, text, command, exception, args):
+    _error(httpserver, text)
+    call = {
+        'build': lambda: api.build(12, (3, 4), 'Tank'),
+        'move': lambda: api.move(12, (3, 4), (5, 6)),
+        'finish_turn': lambda: api.finish_turn(12),
+    }[command]
+    with pytest.raises(exception) as info:
+        call()
+    assert info.value.args == args
+
+    api.raise_errors = False
+    status = call()
+    assert not status
+    assert (status.error, status.args, status.text) == (exception, args, text)
+    pytest.raises(exception, status.raise_for_status)
+
+
+def test_unknown_errors(api, httpserver):
+    _error(httpserver, 'Something else.')
+    with pytest.raises(weewar.ELIZAError) as info:
+        api.attack(12, (3, 4), (4, 4))
+    assert 'Something else.' in str(info.value)
+
+
+def test_build_returns_false_for_other_errors(api, httpserver):
+    _error(httpserver, 'Something else.')
+    assert api.build(12, (3, 4), 'Tank') is False
+    _error(httpserver, 'Game is not running.')
+    assert api.build(12, (3, 4), 'Tank') is False
+    api.raise_errors = False
+    status = api.build(12, (3, 4), 'Tank')
+    assert not status and status.error is weewar.GameNotRunning
+
+
+def test_successful_status(api, httpserver):
+    api.raise_errors = False
+    httpserver.serve_content('<ok><move x="5" y="6"/></ok>')
+    status = api.move(12, (3, 4), (5, 6))
+    assert status and status.error is None
+    assert status.result == {'command': 'move', 'position': (3, 4),
+                             'to': (5, 6)}
+
+
+def test_local_checks_return_status(api):
+    api.raise_errors = False
+    api.boards[12] = weewar.GameBoard({'factions': []}, 'ai_bot')
+    status = api.capture(12, (3, 4))
+    assert (status.error, status.args) == (weewar.NotYourUnit, (3, 4))
+
+
+@pytest.mark.parametrize('function, text', [
+    (weewar.accept_invitation, 'You have already accepted the invitation.'),
+    (weewar.decline_invitation, 'Cannot decline an invitation.'),
+    (weewar.send_reminder, 'Can not remind current player.'),
+    (weewar.surrender_game, 'Can not surrender.'),
+    (weewar.surrender_game, 'Game is not running.'),
+    (weewar.abandon_game, 'Game is not running.'),
+    (weewar.remove_game, 'Game has already been deleted.'),
+])
+def test_expected_errors_return_false(api, httpserver, function, text):
+    _error(httpserver, text)
+    assert function('ai_bot', 'secret', 12) is False
+    _error(httpserver, 'Something else.')
+    pytest.raises(weewar.ELIZAError, function, 'ai_bot', 'secret', 12)
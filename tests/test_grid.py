@@ -0,0 +1,61 @@
+import json
+import os
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+MAP_LAYOUT = json.load(
+    open(os.path.join(_here, 'mappings', 'map_layout.json')))
+
+
+def test_neighbours_are_symmetric():
+    grid = weewar.HexGrid.from_layout(MAP_LAYOUT)
+    assert len(grid) == len(MAP_LAYOUT['terrains'])
+    for field in grid.fields:
+        for other in grid.neighbours_of(field):
+            assert field in grid.neighbours_of(other)
+            assert weewar.hex_distance(field, other) == 1
+
+
+def test_distances_match_open_grid():
+    grid = weewar.HexGrid(6, 5)
+    for a in grid.fields:
+        for b in grid.fields:
+            assert grid.distance(a, b) == weewar.hex_distance(a, b)
+    table = grid.distances()
+    assert len(table) == len(grid) ** 2
+
+
+def test_distances_avoid_holes():
+    # a wall across column 2 with a gap in the last row
+    fields = [(x, y) for y in range(4) for x in range(5)
+              if x != 2 or y == 3]
+    grid = weewar.HexGrid(5, 4, fields)
+    assert grid.distance((1, 0), (3, 0)) > weewar.hex_distance((1, 0), (3, 0))
+    assert grid.distance((0, 0), (2, 0)) == weewar.UNREACHABLE
+    assert (2, 3) in grid.within((1, 3), 1)
+
+
+def test_grids_are_cached_per_revision():
+    grid = weewar.map_grid(MAP_LAYOUT)
+    assert weewar.map_grid(dict(MAP_LAYOUT)) is grid
+    assert weewar.map_grid(dict(MAP_LAYOUT, revision=3)) is not grid
+
+
+def test_layouts_without_id_are_not_cached():
+    layout = dict(MAP_LAYOUT, id=None)
+    grid = weewar.map_grid(layout)
+    assert weewar.map_grid(layout) is not grid
+    small = {'width': 2, 'height': 1, 'terrains': [
+        {'x': 0, 'y': 0, 'type': 'Plains'}, {'x': 1, 'y': 0, 'type': 'Plains'}]}
+    assert len(weewar.map_grid(small).fields) == 2
+
+
+def test_grid_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(weewar, 'MAX_GRIDS', 2)
+    first = weewar.map_grid(dict(MAP_LAYOUT, revision='a'))
+    weewar.map_grid(dict(MAP_LAYOUT, revision='b'))
+    assert weewar.map_grid(dict(MAP_LAYOUT, revision='a')) is first
+    weewar.map_grid(dict(MAP_LAYOUT, revision='c'))  # drops 'b'
+    assert len(weewar._grids) == 2
+    assert weewar.map_grid(dict(MAP_LAYOUT, revision='a')) is first
@@ -0,0 +1,69 @@
+import copy
+import json
+import os
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+def _states(count):
+    state = json.load(open(os.path.join(_here, 'mappings', 'game_state.json')))
+    states = []
+    for round in range(1, count + 1):
+        state = copy.deepcopy(state)
+        state['round'] = round
+        state['factions'][0]['credits'] += 100
+        states.append(state)
+    return states
+
+
+def test_history_replays_rounds():
+    history = weewar.GameHistory(':memory:')
+    history.KEYFRAME_INTERVAL = 4
+    states = _states(10)
+    history.add_many(states[:5])
+    for state in states[5:]:
+        history.add(state)
+    assert history.snapshots(18682) == states
+    assert history.snapshots(18682, round=7) == [states[6]]
+    assert history.rounds(18682) == list(range(1, 11))
+    assert history.latest(18682) == states[-1]
+
+
+def test_history_indexes_players(tmpdir):
+    path = str(tmpdir.join('history.db'))
+    history = weewar.GameHistory(path)
+    history.add_many(_states(3))
+    history.close()
+    history = weewar.GameHistory(path)
+    assert history.games('eviltwin') == [18682]
+    assert history.games('nobody') == []
+    # continues sequence from what is on disk
+    history.add(_states(4)[-1])
+    assert [s['round'] for s in history.snapshots(18682)] == [1, 2, 3, 4]
+
+
+def test_history_copies_states():
+    history = weewar.GameHistory(':memory:')
+    state = _states(1)[0]
+    history.add(state)
+    recorded = copy.deepcopy(state)
+    state['round'] = 2  # changed in place and added again
+    state['name'] = 'renamed'
+    history.add(state)
+    assert history.snapshots(18682) == [recorded, state]
+
+
+def test_failed_add_keeps_latest():
+    history = weewar.GameHistory(':memory:')
+    first, second = _states(2)
+    history.add(first)
+    broken = dict(second, broken=object())
+    try:
+        history.add_many([second, broken])
+    except weewar.SnapshotError:
+        pass
+    assert history.latest(18682) == first
+    history.add(second)
+    assert history.snapshots(18682) == [first, second]
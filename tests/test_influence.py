@@ -0,0 +1,77 @@
+import json
+import os
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+MAP_LAYOUT = json.load(
+    open(os.path.join(_here, 'mappings', 'map_layout.json')))
+
+
+def _state(a_units, b_units):
+    return {'factions': [
+        {'playerName': 'a', 'units': [
+            {'x': x, 'y': y, 'type': type_, 'quantity': 10}
+            for (x, y), type_ in a_units]},
+        {'playerName': 'b', 'units': [
+            {'x': x, 'y': y, 'type': type_, 'quantity': 10}
+            for (x, y), type_ in b_units]},
+    ]}
+
+
+A_UNITS = [((3, 8), 'Tank'), ((4, 8), 'Light Artillery'), ((10, 13), 'Trooper')]
+B_UNITS = [((12, 2), 'Trooper'), ((6, 8), 'Heavy Tank')]
+
+
+def _tables(imap):
+    return (dict((p, list(a)) for p, a in imap.threat.items()),
+            dict((p, list(a)) for p, a in imap.reach.items()))
+
+
+def test_threat_and_reach():
+    imap = weewar.InfluenceMap(_state(A_UNITS, B_UNITS), MAP_LAYOUT)
+    assert imap.threat_at((6, 8), 'a') >= 10
+    assert imap.danger((6, 8), 'b') == imap.threat_at((6, 8), 'a')
+    assert imap.reachable((3, 8), 'a') == 1
+    assert imap.controller((12, 2)) == 'b'
+    quiet = [f for f in imap.grid.fields
+             if not imap.danger(f, 'a') and not imap.danger(f, 'b')]
+    assert quiet and imap.controller(quiet[0]) is None
+    # units cannot move onto water or through enemy units
+    water = [t for t in MAP_LAYOUT['terrains'] if t['type'] == 'Water'][0]
+    assert imap.reachable((water['x'], water['y']), 'a') == 0
+
+
+def test_incremental_updates_match_full_computation():
+    imap = weewar.InfluenceMap(_state(A_UNITS, B_UNITS), MAP_LAYOUT)
+    imap.move((3, 8), (5, 8))
+    imap.remove((12, 2))
+    imap.add((10, 12), 'b', 'Raider')
+    imap.set_quantity((6, 8), 4)
+    expected = _state([((5, 8), 'Tank')] + A_UNITS[1:],
+                      [((6, 8), 'Heavy Tank'), ((10, 12), 'Raider')])
+    expected['factions'][1]['units'][0]['quantity'] = 4
+    assert _tables(imap) == _tables(
+        weewar.InfluenceMap(expected, MAP_LAYOUT))
+
+
+def test_attack_range():
+    # artillery which cannot move only hits fields 2 to 3 steps away
+    stats = {'Light Artillery': (0, 2, 3, 'wheels')}
+    imap = weewar.InfluenceMap(
+        _state([((4, 8), 'Light Artillery')], []), MAP_LAYOUT, stats)
+    grid = imap.grid
+    for field in grid.fields:
+        expected = 10 if 2 <= grid.distance((4, 8), field) <= 3 else 0
+        assert imap.threat_at(field, 'a') == expected
+
+
+def test_artillery_does_not_move_and_fire():
+    imap = weewar.InfluenceMap(
+        _state([((4, 8), 'Light Artillery')], []), MAP_LAYOUT)
+    grid = imap.grid
+    for field in grid.fields:
+        expected = 10 if 2 <= grid.distance((4, 8), field) <= 3 else 0
+        assert imap.threat_at(field, 'a') == expected
+    # but it can still move
+    assert len([f for f in grid.fields if imap.reachable(f, 'a')]) > 1
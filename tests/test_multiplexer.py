@@ -0,0 +1,46 @@
+import threading
+import time
+import pytest
+
+import weewar
+
+
+class FakeAPI (object):
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def move(self, game_id, from_, to):
+        if game_id == 'slow':
+            time.sleep(0.05)
+        with self.lock:
+            self.calls.append((game_id, from_, to))
+        return to
+
+    def finish_turn(self, game_id):
+        if game_id == 'broken':
+            raise weewar.NotYourTurn()
+        return True
+
+
+def test_commands_keep_order_per_game():
+    api = FakeAPI()
+    with weewar.CommandMultiplexer(api, workers=3) as mux:
+        turns = dict(
+            (game, mux.submit_turn(game, [('move', i, i + 1)
+                                          for i in range(5)]))
+            for game in ('slow', 'a', 'b'))
+        assert turns['a'].result() == [1, 2, 3, 4, 5]
+        # fast games are not held up by the slow one
+        assert not turns['slow'].done()
+        assert turns['slow'].result() == [1, 2, 3, 4, 5]
+    for game in ('slow', 'a', 'b'):
+        assert [c[1] for c in api.calls if c[0] == game] == list(range(5))
+
+
+def test_failing_command_cancels_rest_of_turn():
+    with weewar.CommandMultiplexer(FakeAPI(), workers=1) as mux:
+        turn = mux.submit_turn('broken', [
+            ('finish_turn', ), ('move', 1, 2)])
+        pytest.raises(weewar.NotYourTurn, turn.result)
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+HEADQUARTER = json.load(
+    open(os.path.join(_here, 'mappings', 'headquarter.json')))
+
+
+def _state(id_, current):
+    return {'id': id_, 'players': [
+        {'index': i, 'username': name, 'current': name == current,
+         'result': 'playing'}
+        for i, name in enumerate(['ai_bot', 'eviltwin', 'thomas419'])]}
+
+
+class FakeAPI (object):
+
+    username = 'ai_bot'
+    priority = None
+
+    def __init__(self, limiter, current=None):
+        self.limiter = limiter
+        self.current = current or {}  # game id -> current player
+        self.calls = []
+        self.tracked = []
+        self.deadlines = {}
+
+    def game_state(self, id_):
+        self.calls.append(('state', id_, self.priority))
+        return _state(id_, self.current.get(id_, 'ai_bot'))
+
+    def map_layout(self, id_):
+        self.calls.append(('map', id_, self.priority))
+        return {'id': id_}
+
+    def _track_state(self, id_, state, fetched=None):
+        self.tracked.append(id_)
+
+
+def _games():
+    running, finished = HEADQUARTER['games']
+    attention = dict(running, id=5, map=8, inNeedOfAttention=True)
+    return [running, finished, attention]
+
+
+def test_prefetches_in_spare_slots():
+    limiter = weewar.RateLimiter(1000)
+    api, fetcher = FakeAPI(limiter), FakeAPI(limiter, {18682: 'eviltwin'})
+    prefetcher = weewar.Prefetcher(api, fetcher=fetcher)
+    prefetcher.schedule(_games())
+    prefetcher.schedule(_games())  # nothing is queued twice
+    while prefetcher.step():
+        pass
+    assert fetcher.calls == [
+        ('state', 5, weewar.PRIORITY_PREFETCH),
+        ('map', 1, weewar.PRIORITY_PREFETCH),
+        ('map', 8, weewar.PRIORITY_PREFETCH),
+        ('state', 18682, weewar.PRIORITY_PREFETCH),
+    ]
+    assert prefetcher.turns == {5: 0, 18682: 2}
+    assert prefetcher.game_state(5) == _state(5, 'ai_bot')
+    assert prefetcher.map_layout(8) == {'id': 8}
+    assert api.calls == []
+    # handed out states are kept by the API like fetched ones
+    assert api.tracked == [5]
+    # states are handed out once
+    prefetcher.game_state(5)
+    assert api.calls == [('state', 5, None)]
+    # not our turn in the prefetched state, so it is outdated
+    prefetcher.game_state(18682)
+    assert api.calls[-1] == ('state', 18682, None)
+
+
+def test_games_coming_up_are_refreshed():
+    limiter = weewar.RateLimiter(1000)
+    current = {1: 'thomas419', 2: 'eviltwin'}
+    fetcher = FakeAPI(limiter, current)
+    prefetcher = weewar.Prefetcher(FakeAPI(limiter), fetcher=fetcher,
+                                   refresh=0)
+    running = HEADQUARTER['games'][0]
+    prefetcher.schedule([dict(running, id=1, map=None),
+                         dict(running, id=2, map=None)])
+    while prefetcher.step():
+        if len(fetcher.calls) == 2:
+            break
+    # we move next in game 1 (one player ahead), not in game 2
+    assert prefetcher.turns == {1: 1, 2: 2}
+    fetcher.calls = []
+    current[1] = 'ai_bot'
+    assert prefetcher.step()
+    assert fetcher.calls == [('state', 1, weewar.PRIORITY_PREFETCH)]
+    assert prefetcher.turns[1] == 0
+    # the state is ready before headquarters show the turn
+    api = prefetcher.api
+    assert prefetcher.game_state(1)['players'][0]['current']
+    assert api.calls == []
+
+
+def test_yields_to_waiting_requests():
+    limiter = weewar.RateLimiter(10)
+    fetcher = FakeAPI(limiter)
+    prefetcher = weewar.Prefetcher(FakeAPI(limiter), fetcher=fetcher)
+    prefetcher.schedule(_games())
+    limiter.acquire()  # the next slot is taken
+    assert not prefetcher.step()
+    waiting = threading.Thread(target=limiter.acquire,
+                               args=(weewar.PRIORITY_COMMAND, ))
+    waiting.start()
+    deadline = time.time() + 5
+    while not limiter.waiting and time.time() < deadline:
+        time.sleep(0.001)
+    assert not prefetcher.step()
+    waiting.join()
+    assert fetcher.calls == []
+
+
+def test_stale_states_are_fetched_again():
+    limiter = weewar.RateLimiter(1000)
+    api = FakeAPI(limiter)
+    prefetcher = weewar.Prefetcher(api, max_age=0, fetcher=FakeAPI(limiter))
+    prefetcher.turns[5] = 0
+    prefetcher.states[5] = (weewar._clock() - 1, {'id': 5, 'old': True})
+    assert prefetcher.game_state(5) == _state(5, 'ai_bot')
+
+
+def test_layouts_and_finished_games_are_dropped():
+    limiter = weewar.RateLimiter(1000)
+    prefetcher = weewar.Prefetcher(FakeAPI(limiter),
+                                   fetcher=FakeAPI(limiter))
+    prefetcher.MAX_LAYOUTS = 2
+    for map_id in (1, 2, 1, 3):
+        prefetcher.map_layout(map_id)
+    assert list(prefetcher.layouts) == [1, 3]
+    running, finished = HEADQUARTER['games']
+    prefetcher.schedule([dict(running, id=5, map=None,
+                              inNeedOfAttention=True)])
+    while prefetcher.step():
+        pass
+    assert 5 in prefetcher.states
+    prefetcher.schedule([dict(finished, id=5)])
+    assert 5 not in prefetcher.states and 5 not in prefetcher.games
+    assert 5 not in prefetcher.turns
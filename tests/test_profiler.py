@@ -0,0 +1,72 @@
+import json
+import os
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+def _api(httpserver, monkeypatch, profiler):
+    api = weewar.ELIZA('ai_bot', 'secret', profiler=profiler)
+    monkeypatch.setattr(api, 'HOST', httpserver.url)
+    return api
+
+
+def test_turn_is_traced(httpserver, monkeypatch, tmpdir):
+    profiler = weewar.Profiler()
+    api = _api(httpserver, monkeypatch, profiler)
+    xml = open(os.path.join(_here, 'mappings', 'game_state.xml'), 'rb').read()
+    httpserver.serve_content(xml)
+    with api.turn(18682):
+        api.game_state(18682)
+        with api.span('plan', units=3):
+            pass
+        httpserver.serve_content('<ok/>')
+        api.finish_turn(18682)
+
+    (thread, spans), = profiler.traces
+    paths = [path for path, start, end, args in spans]
+    assert paths == [
+        ('turn', 'call_api', 'throttle'),
+        ('turn', 'call_api', 'request'),
+        ('turn', 'call_api', 'parse'),
+        ('turn', 'call_api'),
+        ('turn', 'plan'),
+        ('turn', 'command', 'call_api', 'throttle'),
+        ('turn', 'command', 'call_api', 'request'),
+        ('turn', 'command', 'call_api', 'parse'),
+        ('turn', 'command', 'call_api'),
+        ('turn', 'command'),
+        ('turn', ),
+    ]
+
+    filename = str(tmpdir.join('trace.json'))
+    profiler.write_chrome_trace(filename)
+    events = json.load(open(filename))['traceEvents']
+    assert [e['name'] for e in events][:2] == ['turn', 'call_api']
+    assert events[0]['args'] == {'game': 18682}
+    assert all(e['ph'] == 'X' and e['dur'] >= 0 for e in events)
+
+    stacks = dict(line.rsplit(' ', 1)
+                  for line in profiler.collapsed().splitlines())
+    assert 'turn;command;call_api;request' in stacks
+    total = sum(int(value) for value in stacks.values())
+    assert abs(total - events[0]['dur']) <= len(stacks)
+
+
+def test_unsampled_traces_are_not_recorded():
+    profiler = weewar.Profiler(sample=0.5, seed=1)
+    api = weewar.ReadOnlyAPI(profiler=profiler)
+    for n in range(100):
+        with api.turn(n):
+            with api.span('plan'):
+                pass
+    assert 20 < len(profiler.traces) < 80
+    assert all(len(spans) == 2 for thread, spans in profiler.traces)
+
+
+def test_no_profiler():
+    api = weewar.ReadOnlyAPI()
+    with api.turn(1):
+        with api.span('plan'):
+            pass
@@ -0,0 +1,45 @@
+import json
+import os
+import random
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+USERS = json.load(open(os.path.join(_here, 'mappings', 'all_users.json')))
+
+
+def _check(index, users):
+    ratings = sorted((u['rating'] for u in users), reverse=True)
+    ordered = sorted(users, key=lambda u: (-u['rating'], u['id']))
+    assert len(index) == len(users)
+    assert index.top(5) == ordered[:5]
+    for user in users:
+        assert index.rank(user['id']) == ratings.index(user['rating']) + 1
+        below = sum(1 for r in ratings if r < user['rating'])
+        assert index.percentile(user['id']) == 100.0 * below / len(users)
+    assert index.between(1500, 1800) == [
+        u for u in ordered if 1500 <= u['rating'] <= 1800]
+    assert index.count_between(1500, 1800) == len(index.between(1500, 1800))
+
+
+def test_fixture():
+    index = weewar.RankingIndex(USERS)
+    _check(index, USERS)
+    assert index.rank(1909) == 3
+
+
+def test_successive_snapshots():
+    rnd = random.Random(7)
+    users = [{'id': n, 'name': 'user%d' % n, 'rating': rnd.randint(1000, 2000)}
+             for n in range(500)]
+    index = weewar.RankingIndex(users)
+    for _ in range(20):
+        users = [dict(u, rating=u['rating'] + rnd.randint(-20, 20))
+                 if rnd.random() < 0.05 else u
+                 for u in users if rnd.random() > 0.02]
+        users += [{'id': 1000 + rnd.randint(0, 10 ** 6), 'name': 'new',
+                   'rating': 1500} for _ in range(5)]
+        users = list(dict((u['id'], u) for u in users).values())
+        counts = index.update(users)
+        assert counts['changed'] > 0
+        _check(index, users)
@@ -0,0 +1,126 @@
+import json
+import os
+import pytest
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+MAP_LAYOUT = json.load(
+    open(os.path.join(_here, 'mappings', 'map_layout.json')))
+GAME_STATE = json.load(
+    open(os.path.join(_here, 'mappings', 'game_state.json')))
+
+
+def rush(api, game_id, player):
+    """
+    Moves every unit towards the closest enemy, attacks whatever is in reach
+    and builds troopers.
+    """
+    state = api.game_state(game_id)
+    for faction in state['factions']:
+        if faction['playerName'] != player:
+            continue
+        for terrain in faction['terrain']:
+            try:
+                api.build(game_id, (terrain['x'], terrain['y']),
+                          weewar.TROOPER)
+            except (weewar.FieldIsBlocked, weewar.NotEnoughCredits):
+                pass
+        for unit in faction['units']:
+            position = (unit['x'], unit['y'])
+            enemies = [(u['x'], u['y']) for f in api.game_state(game_id)[
+                'factions'] if f['playerName'] != player for u in f['units']]
+            if not enemies or unit['finished']:
+                continue
+            closest = lambda field: min(
+                weewar.hex_distance(field, enemy) for enemy in enemies)
+            options = api.move_options(game_id, position, unit['type'])
+            if options and min(map(closest, options)) < closest(position):
+                position = min(options, key=closest)
+                api.move(game_id, (unit['x'], unit['y']), position)
+            for enemy in enemies:
+                if weewar.hex_distance(position, enemy) == 1:
+                    api.attack(game_id, position, enemy)
+                    break
+
+
+@pytest.fixture
+def api():
+    return weewar.Simulator()
+
+
+def test_new_game(api):
+    game_id = api.new_game(MAP_LAYOUT, ['a', 'b'])
+    state = api.game_state(game_id)
+    assert set(state) <= set(GAME_STATE)
+    assert set(state['factions'][0]) <= set(GAME_STATE['factions'][0]) | set(
+        ['units', 'terrain'])
+    a, b = state['factions']
+    assert sorted((u['x'], u['y']) for u in a['units']) == [(12, 2), (19, 3)]
+    assert sorted((t['x'], t['y']) for t in b['terrain']) == [(3, 8), (10, 13)]
+    assert a['current'] and a['credits'] == 300
+
+
+def test_commands_are_checked(api):
+    game_id = api.new_game(MAP_LAYOUT, ['a', 'b'])
+    pytest.raises(weewar.NotYourUnit, api.move, game_id, (3, 8), (4, 8))
+    pytest.raises(weewar.FieldIsBlocked, api.build, game_id, (12, 2),
+                  weewar.TROOPER)
+    pytest.raises(weewar.ELIZAError, api.move, game_id, (12, 2), (4, 8))
+    pytest.raises(weewar.ELIZAError, api.attack, game_id, (12, 2), (3, 8))
+    pytest.raises(weewar.GameNotFound, api.game_state, 999)
+
+
+def test_finish_turn(api):
+    game_id = api.new_game(MAP_LAYOUT, ['a', 'b'])
+    to = api.move_options(game_id, (12, 2))[0]
+    api.move(game_id, (12, 2), to)
+    pytest.raises(weewar.ELIZAError, api.move, game_id, to,
+                  api.move_options(game_id, to)[0])
+    assert api.finish_turn(game_id)
+    assert api.finish_turn(game_id)
+    state = api.game_state(game_id)
+    assert state['round'] == 2
+    # two bases for 100 credits each
+    assert [f['credits'] for f in state['factions']] == [500, 500]
+
+
+def test_games_are_deterministic():
+    first = weewar.simulate(MAP_LAYOUT, [rush, rush], [1, 2], workers=0,
+                            max_rounds=30)
+    again = weewar.simulate(MAP_LAYOUT, [rush, rush], [1, 2], workers=2,
+                            max_rounds=30)
+    assert first == again
+    assert all(state['state'] == 'finished' for state in first)
+
+
+def test_passive_games_end():
+    state = weewar.play_game(MAP_LAYOUT, [lambda *args: None] * 2)
+    assert state['state'] == 'finished'
+    assert state['round'] == 100
+
+
+def test_game_without_players_ends(api):
+    game_id = api.new_game(MAP_LAYOUT, ['a', 'b'])
+    game = api.games[game_id]
+    game.units.clear()
+    for position, (owner, type_) in list(game.terrain.items()):
+        game.terrain[position] = (None, type_)
+    assert api.finish_turn(game_id)
+    assert api.game_state(game_id)['state'] == 'finished'
+
+
+def test_artillery_does_not_fire_after_moving(api):
+    game_id = api.new_game(MAP_LAYOUT, ['a', 'b'])
+    game = api.games[game_id]
+    game.units[(12, 2)]['type'] = weewar.LIGHT_ARTILLERY
+    to = api.move_options(game_id, (12, 2))[0]
+    target = next(field for field in game.grid.fields
+                  if game.grid.distance(to, field) == 2
+                  and field not in game.units)
+    game.units[target] = {'x': target[0], 'y': target[1], 'quantity': 10,
+                          'type': weewar.TROOPER, 'finished': False,
+                          'owner': 'b'}
+    api.move(game_id, (12, 2), to)
+    error = pytest.raises(weewar.ELIZAError, api.attack, game_id, to, target)
+    assert 'already moved' in str(error.value)
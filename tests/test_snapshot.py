@@ -0,0 +1,54 @@
+import json
+import os
+import pytest
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.mark.parametrize('name', ['game_state', 'map_layout', 'user', 'game'])
+def test_snapshot_roundtrip(name):
+    values = json.load(open(os.path.join(_here, 'mappings', name + '.json')))
+    data = weewar.dumps_snapshot(values)
+    assert weewar.loads_snapshot(data) == values
+
+
+def test_snapshot_file_roundtrip(tmpdir):
+    values = json.load(open(os.path.join(_here, 'mappings', 'game_state.json')))
+    path = str(tmpdir.join('state.snap'))
+    weewar.write_snapshot(path, values)
+    assert weewar.read_snapshot(path) == values
+
+
+def test_snapshot_records_with_missing_keys():
+    values = [{'x': 1, 'y': 2, 'type': 'Base', 'startFaction': 0},
+              {'x': 3, 'y': 4, 'type': 'Plains'}]
+    assert weewar.loads_snapshot(weewar.dumps_snapshot(values)) == values
+
+
+@pytest.mark.parametrize('values', [
+    [{}], [{}, {}], {'x': [{}]}, [{}, {'a': 1}], {u'a': u'b\xfc'},
+    {'a': 2 ** 70}, [-2 ** 63, 2 ** 63 - 1, 2 ** 63, -2 ** 63 - 1],
+    [{'x': 2 ** 70}, {'x': 1}],
+])
+def test_snapshot_edge_cases(values):
+    assert weewar.loads_snapshot(weewar.dumps_snapshot(values)) == values
+
+
+def test_snapshot_tuples_become_lists():
+    values = {'position': (3, 4), 'path': [(1, 2), (2, 2)]}
+    assert weewar.loads_snapshot(weewar.dumps_snapshot(values)) == {
+        'position': [3, 4], 'path': [[1, 2], [2, 2]]}
+
+
+def test_snapshot_dict_subclasses_are_records():
+    class Row (dict):
+        pass
+    rows = [{'x': 1, 'type': 'Base'}, {'x': 2, 'type': 'Plains'}]
+    assert (weewar.dumps_snapshot([Row(row) for row in rows]) ==
+            weewar.dumps_snapshot(rows))
+
+
+def test_invalid_snapshot_raises_exception():
+    pytest.raises(weewar.SnapshotError, weewar.loads_snapshot, b'<game/>')
@@ -0,0 +1,27 @@
+"""
+Importing weewar has to stay cheap for short-lived scripts. The import time
+itself is measured by ``benchmarks/startup.py``.
+"""
+
+import os
+import subprocess
+import sys
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+DEFERRED_MODULES = ['requests', 'lxml', 'sqlite3', 'numpy']
+
+
+def _run(code):
+    output = subprocess.check_output(
+        [sys.executable, '-c', code], cwd=_root, universal_newlines=True)
+    return output.strip()
+
+
+def test_import_does_not_load_heavy_dependencies():
+    loaded = _run(
+        'import sys, weewar; '
+        'print(",".join(m for m in %r if m in sys.modules))'
+        % DEFERRED_MODULES)
+    assert loaded == ''
+
@@ -0,0 +1,98 @@
+import copy
+import json
+import os
+
+import weewar
+
+_here = os.path.dirname(os.path.abspath(__file__))
+HEADQUARTER = json.load(
+    open(os.path.join(_here, 'mappings', 'headquarter.json')))
+
+
+class FakeAPI (object):
+
+    def __init__(self, *snapshots, **rounds):
+        self.snapshots = list(snapshots)
+        self.rounds = rounds.get('rounds', [])
+
+    def headquarter(self):
+        return self.snapshots.pop(0)
+
+    def game_state(self, game_id):
+        return {'id': game_id, 'round': self.rounds.pop(0)}
+
+
+def _changed():
+    hq = copy.deepcopy(HEADQUARTER)
+    first, second = hq['games']
+    first.update(inNeedOfAttention=True, state='finished')
+    hq['games'].append({'id': 5, 'factionState': 'invited'})
+    return hq
+
+
+def test_events():
+    watcher = weewar.HeadquarterWatcher(
+        FakeAPI(HEADQUARTER, HEADQUARTER, _changed()), min_interval=1,
+        max_interval=4, backoff=2)
+    events = watcher.queue()
+    # first poll reports what needs attention already
+    assert [(e['type'], e['game']) for e in watcher.poll()] == [
+        ('attention', 21885)]
+    assert watcher.poll() == []
+    assert watcher.interval == 2
+    watcher.poll()
+    assert watcher.interval == 1
+    received = [events.get_nowait() for _ in range(events.qsize())]
+    assert sorted((e['type'], e['game']) for e in received) == [
+        ('attention', 18682), ('attention', 21885), ('finished', 18682),
+        ('invitation', 5)]
+
+
+def _single(needed):
+    game = dict(HEADQUARTER['games'][0], inNeedOfAttention=needed)
+    return {'needAttention': int(needed), 'games': [game]}
+
+
+def test_round_events():
+    waiting, attention = _single(False), _single(True)
+    watcher = weewar.HeadquarterWatcher(
+        FakeAPI(attention, waiting, attention, waiting, attention,
+                rounds=[3, 4, 4]),
+        rounds=True)
+    # the round is only known from the first game state on
+    assert [e['type'] for e in watcher.poll()] == ['attention']
+    assert watcher.poll() == []
+    events = watcher.poll()
+    assert [(e['type'], e.get('round')) for e in events] == [
+        ('attention', None), ('round', 4)]
+    assert events[1]['game'] == 18682
+    watcher.poll()
+    assert [e['type'] for e in watcher.poll()] == ['attention']
+
+
+def test_failing_callback():
+    watcher = weewar.HeadquarterWatcher(FakeAPI(HEADQUARTER, _changed()))
+    received = []
+
+    def _fail(event):
+        raise ValueError(event['type'])
+    watcher.subscribe(_fail)
+    watcher.subscribe(received.append)
+    watcher.poll()
+    watcher.poll()
+    assert len(received) == 4
+    assert watcher.errors == 4
+    assert watcher.games[5]['factionState'] == 'invited'
+
+
+def test_stop_is_not_an_event():
+    watcher = weewar.HeadquarterWatcher(
+        FakeAPI(*[HEADQUARTER] * 10), min_interval=0.01)
+    received = []
+    watcher.subscribe(received.append)
+    events = watcher.queue()
+    watcher.start()
+    assert events.get(timeout=5)['type'] == 'attention'
+    watcher.stop()
+    assert None not in received
+    assert events.get(timeout=5) is None
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+import weewar
+
+from .test_watcher import FakeAPI, HEADQUARTER, _changed
+
+
+def _collect(watcher):
+    async def _collect():
+        received = []
+        events = watcher.events()
+        watcher.start()
+        async for event in events:
+            received.append(event['type'])
+            if len(received) == 4:
+                watcher.stop(wait=False)
+        return sorted(received)
+    return _collect()
+
+
+def test_async_iteration():
+    watcher = weewar.HeadquarterWatcher(
+        FakeAPI(HEADQUARTER, _changed()), min_interval=0.01)
+    assert asyncio.run(_collect(watcher)) == [
+        'attention', 'attention', 'finished', 'invitation']
+
+
+def test_async_iteration_without_running_loop_lookup(monkeypatch):
+    # Python 3.5 and 3.6 have no asyncio.get_running_loop
+    monkeypatch.delattr(asyncio, 'get_running_loop')
+    watcher = weewar.HeadquarterWatcher(
+        FakeAPI(HEADQUARTER, _changed()), min_interval=0.01)
+    loop = asyncio.new_event_loop()
+    try:
+        received = loop.run_until_complete(_collect(watcher))
+    finally:
+        loop.close()
+    assert received == ['attention', 'attention', 'finished', 'invitation']
+
+
+def test_async_iteration_needs_python_3_5(monkeypatch):
+    monkeypatch.setattr(weewar, '_ASYNC_ITERATION', False)
+    watcher = weewar.HeadquarterWatcher(FakeAPI())
+    pytest.raises(RuntimeError, watcher.events)
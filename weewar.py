@@ -1,14 +1,155 @@
 
-from datetime import datetime, timedelta, time
-from lxml import objectify
-from lxml.etree import tostring
-import requests
+from array import array
+import binascii
+import bisect
+from collections import OrderedDict, deque
+import heapq
+import importlib
+from itertools import count, repeat
+import json
+import mmap
+from operator import itemgetter
+import os
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+import random
+import socket
+import stat
+import struct
+import sys
+import threading
+import time
+import weakref
+import zlib
 
 
 __version__ = '0.4'
 
+try:
+    _text_type = unicode
+    _integer_types = (int, long)
+except NameError: # Python 3
+    _text_type = str
+    _integer_types = (int, )
+_string_types = (str, _text_type)
 
-class ReadOnlyAPI (object):
+
+def _to_text(value):
+    """
+    Converts ``value`` to text. Byte strings are taken to be UTF-8.
+    """
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return _text_type(value)
+
+
+class _LazyModule (object):
+
+    """
+    Stands in for a module which is only imported on first attribute access.
+    This keeps ``import weewar`` cheap for short-lived scripts.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+etree = _LazyModule('lxml.etree')
+objectify = _LazyModule('lxml.objectify')
+futures = _LazyModule('concurrent.futures')
+requests = _LazyModule('requests')
+sqlite3 = _LazyModule('sqlite3')
+
+
+#: Request priorities (lower values are served first)
+PRIORITY_COMMAND = 0    #: ELIZA commands
+PRIORITY_ATTENTION = 1  #: game states of games in need of attention
+PRIORITY_POLL = 2       #: regular polling (games, headquarters)
+PRIORITY_CRAWL = 3      #: background crawls (users, maps)
+PRIORITY_PREFETCH = 4   #: prefetching when nothing else is waiting
+
+PRIORITY_NAMES = {
+    PRIORITY_COMMAND: 'command',
+    PRIORITY_ATTENTION: 'attention',
+    PRIORITY_POLL: 'poll',
+    PRIORITY_CRAWL: 'crawl',
+    PRIORITY_PREFETCH: 'prefetch',
+}
+
+
+class _Decompressor (object):
+
+    """
+    Incremental decoder for ``gzip`` and ``deflate`` content encodings. Some
+    servers send ``deflate`` without the zlib header, which is detected from
+    the first bytes.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.decoder = None
+        if encoding != 'deflate':
+            self.decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        if self.decoder is None:
+            try:
+                self.decoder = zlib.decompressobj()
+                return self.decoder.decompress(data)
+            except zlib.error:
+                self.decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self.decoder.decompress(data)
+
+    def flush(self):
+        if self.decoder is None:
+            return b''
+        return self.decoder.flush()
+
+
+class _ProfilingMixin (object):
+
+    """
+    Profiling hooks of :class:`ReadOnlyAPI` and :class:`Simulator`. Classes
+    using it set :attr:`profiler` (a :class:`Profiler` or ``None``).
+    """
+
+    profiler = None
+
+    def span(self, name, **args):
+        """
+        Context manager which records a section named ``name`` (e.g. the
+        planning of a bot) in the traces of :attr:`profiler`, if there is
+        one. ``args`` are stored with the section.
+        """
+        if self.profiler is None:
+            return _NULL_SPAN
+        return self.profiler.span(name, **args)
+
+    def turn(self, game_id):
+        """
+        Context manager which records everything done within as one trace
+        (see :class:`Profiler`)::
+
+            >>> with api.turn(game_id):
+            ...     state = api.game_state(game_id)
+            ...     with api.span('plan'):
+            ...         commands = plan(state)
+            ...     for command in commands:
+            ...         command()
+
+        """
+        return self.span('turn', game=game_id)
+
+
+class ReadOnlyAPI (_ProfilingMixin):
     
     """
     Read-only API 
@@ -29,8 +170,16 @@ class ReadOnlyAPI (object):
 
     REQUESTS_PER_SECOND = 2.0   #: max requests per second
     HOST = 'http://weewar.com'
+    #: use this priority for all calls except commands (see ``PRIORITY_*``)
+    priority = None
+
+    #: seconds results are kept in the cache
+    GAME_TTL = 60
+    USER_TTL = 5 * 60
+    MAP_TTL = 24 * 60 * 60
 
-    def __init__(self, username=None, key=None):
+    def __init__(self, username=None, key=None, limiter=None, cache=None,
+                 catalog=None, profiler=None):
         """
         Initialise API (with user credentials for authenticated calls).
 
@@ -38,45 +187,156 @@ class ReadOnlyAPI (object):
         :type username: str
         :param key: Matching API key (from http://weewar.com/apiToken)
         :type key: str
+        :param limiter: Rate limiter to share with other API instances (a new
+            one is created from :attr:`REQUESTS_PER_SECOND` if omitted).
+        :type limiter: :class:`RateLimiter`
+        :param cache: Cache for games, users and map layouts, e.g.
+            :class:`MemoryCache` or :class:`SocketCache`.
+        :param catalog: :class:`Catalog` to share players, maps and strings
+            of games, users and maps with other API instances.
+        :param profiler: :class:`Profiler` recording traces of API calls.
         """
         self.username = username
         self.key = key
-        self.last_call = datetime(1970, 1, 1)
-        self.throttle = timedelta(seconds=1/self.REQUESTS_PER_SECOND)
-
-    def _call_api(self, url, **data):
+        if limiter is None:
+            limiter = RateLimiter(self.REQUESTS_PER_SECOND)
+        self.limiter = limiter
+        self.cache = cache
+        self.catalog = catalog
+        self.profiler = profiler
+        self.traffic_lock = threading.Lock()
+        self.traffic = {}  # endpoint -> [requests, wire bytes, decoded bytes]
+
+    def _call_api(self, url, data=None, priority=PRIORITY_POLL,
+                  deadline=None):
         """
-        Calls the weewar API with authentication (if specified)
+        Calls the weewar API with authentication (if specified). If ``data``
+        is given, it is POSTed as request body. ``priority`` and ``deadline``
+        decide the order in which waiting calls are made (see
+        :class:`RateLimiter`).
         """
         headers = {
             'Content-Type': 'application/xml',
             'Accept': 'application/xml',
+            'Accept-Encoding': 'gzip, deflate',
             'User-Agent': 'python-weewar/%s' % __version__,
         }
-        if data:
-            req = requests.post(
-                self.HOST + url, data,
-                auth=(self.username, self.key), headers=headers)
-        else:
-            req = requests.get(self.HOST + url, headers=headers)
-
         # Be nice and wait for some time
         # before submitting the next request
-        wait = datetime.now() - self.last_call
-        if wait < self.throttle:
-            time.sleep(wait)  # Wait for it!
-        self.last_call = datetime.now()
-
-        if req.status_code == 401:
-            raise AuthenticationError
-        elif req.status_code == 404:
-            raise NotFound
-        elif req.status_code == 500:
-            raise ServerError
-
-        content = req.content
-        parsed = objectify.fromstring(content)
-        return parsed
+        if self.priority is not None and priority != PRIORITY_COMMAND:
+            priority = self.priority
+        with self.span('call_api', url=url):
+            with self.span('throttle'):
+                self.limiter.acquire(priority, deadline)
+            with self.span('request'):
+                req = self._request(url, data, headers)
+            try:
+                if req.status_code == 401:
+                    raise AuthenticationError
+                elif req.status_code == 404:
+                    raise NotFound
+                elif req.status_code == 500:
+                    raise ServerError
+                with self.span('parse'):
+                    return self._parse_response(req, url)
+            finally:
+                req.close()
+
+    def _request(self, url, data, headers):
+        """
+        Sends the request (without reading the body yet) and reports its
+        outcome to the rate limiter.
+        """
+        start = _clock()
+        try:
+            if data:
+                req = requests.post(
+                    self.HOST + url, data, auth=(self.username, self.key),
+                    headers=headers, stream=True)
+            else:
+                req = requests.get(self.HOST + url, headers=headers,
+                                   stream=True)
+        except requests.RequestException:
+            self.limiter.report(False, _clock() - start)
+            raise
+        self.limiter.report(
+            req.status_code < 500 and req.status_code != 429,
+            _clock() - start)
+        return req
+
+    #: bytes read from the connection at a time
+    CHUNK_SIZE = 16384
+
+    def _parse_response(self, req, url):
+        """
+        Parses the body of a streamed response while it is being received
+        (and decompressed), without keeping the complete document in memory.
+        """
+        parser = objectify.makeparser(remove_blank_text=True)
+        encoding = req.headers.get('Content-Encoding', '').strip().lower()
+        decoder = _Decompressor(encoding) if encoding in (
+            'gzip', 'x-gzip', 'deflate') else None
+        wire = decoded = 0
+        while True:
+            chunk = req.raw.read(self.CHUNK_SIZE, decode_content=False)
+            if not chunk:
+                break
+            wire += len(chunk)
+            if decoder is not None:
+                chunk = decoder.decompress(chunk)
+            decoded += len(chunk)
+            parser.feed(chunk)
+        if decoder is not None:
+            chunk = decoder.flush()
+            decoded += len(chunk)
+            parser.feed(chunk)
+        self._count_traffic(url, wire, decoded)
+        return parser.close()
+
+    def _count_traffic(self, url, wire, decoded):
+        endpoint = '/'.join(url.split('/')[:3])
+        with self.traffic_lock:
+            counts = self.traffic.setdefault(endpoint, [0, 0, 0])
+            counts[0] += 1
+            counts[1] += wire
+            counts[2] += decoded
+
+    def traffic_stats(self):
+        """
+        Returns the number of responses and their size as received
+        (``wire``) and after decompression (``decoded``) per endpoint::
+
+            {'/api1/gamestate': {'requests': 3, 'wire': 4410,
+                                 'decoded': 31245}, ...}
+
+        """
+        with self.traffic_lock:
+            return dict(
+                (endpoint, {'requests': requests_, 'wire': wire,
+                            'decoded': decoded})
+                for endpoint, (requests_, wire, decoded)
+                in self.traffic.items())
+
+    def _fetch(self, url, parse, ttl, priority=PRIORITY_POLL):
+        """
+        Calls the API and parses the result. If there is a cache, results are
+        taken from and stored there (in snapshot format) for ``ttl`` seconds.
+        """
+        if self.cache is None:
+            values = parse(self._call_api(url, priority=priority))
+            return self._canonical(values)
+        key = self.HOST + url
+        data = self.cache.get(key)
+        if data is not None:
+            return self._canonical(loads_snapshot(data))
+        values = parse(self._call_api(url, priority=priority))
+        self.cache.set(key, dumps_snapshot(values), ttl)
+        return self._canonical(values)
+
+    def _canonical(self, values):
+        if self.catalog is None:
+            return values
+        return self.catalog.canonical(values)
 
     @staticmethod
     def _parse_attrs(node, **attrs):
@@ -117,8 +377,8 @@ class ReadOnlyAPI (object):
         participating players.
         """
         try:
-            root = self._call_api(self.URL_GAME % id_)
-            return self._parse_game(root)
+            return self._fetch(
+                self.URL_GAME % id_, self._parse_game, self.GAME_TTL)
         except NotFound:
             raise GameNotFound(id_)
 
@@ -138,9 +398,10 @@ class ReadOnlyAPI (object):
         Returns a list of all users who have been online in the last 7 days,
         including their current ranking.
         """
-        root = self._call_api(self.URL_ALL_USERS)
-        return [self._parse_attrs(node, id=int, name=str, rating=int)
-                for node in root.findall('user')]
+        root = self._call_api(self.URL_ALL_USERS, priority=PRIORITY_CRAWL)
+        return self._canonical([
+            self._parse_attrs(node, id=int, name=str, rating=int)
+            for node in root.findall('user')])
 
     URL_USER = '/api1/user/%s'
 
@@ -151,8 +412,8 @@ class ReadOnlyAPI (object):
         participating in.
         """
         try:
-            root = self._call_api(self.URL_USER % username)
-            return self._parse_user(root)
+            return self._fetch(self.URL_USER % username, self._parse_user,
+                               self.USER_TTL, PRIORITY_CRAWL)
         except NotFound:
             raise UserNotFound(username)
 
@@ -163,8 +424,9 @@ class ReadOnlyAPI (object):
         Returns the latest published maps including urls for previews, images,
         and other details.
         """
-        root = self._call_api(self.URL_LATEST_MAPS)
-        return [self._parse_map(map) for map in root.findall('map')]
+        root = self._call_api(self.URL_LATEST_MAPS, priority=PRIORITY_CRAWL)
+        return self._canonical(
+            [self._parse_map(map) for map in root.findall('map')])
 
     URL_HEADQUARTER = '/api1/headquarters'
 
@@ -177,7 +439,7 @@ class ReadOnlyAPI (object):
         this game.
         """
         root = self._call_api(self.URL_HEADQUARTER)
-        need_attention = root.inNeedOfAttention
+        need_attention = root.inNeedOfAttention.pyval
         def _parse(node):
             game = dict((child.tag, child.pyval) 
                 for child in node.iterchildren())
@@ -250,12 +512,13 @@ class ReadOnlyAPI (object):
                         pass
             return attrs
         values['players'] = [
-            dict(username=player, 
+            dict(username=player.pyval,
                  **_attrs(player, {'index' : int, 'result' : str}, 
                           {'current' : bool}))
             for player in node.players.iterchildren()
         ]
-        values['disabledUnitTypes'] = node.disabledUnitTypes.findall('type')
+        values['disabledUnitTypes'] = [
+            child.pyval for child in node.disabledUnitTypes.findall('type')]
         return values
 
     def _parse_map(self, node):
@@ -379,6 +642,169 @@ class AuthenticationError(Exception):
     """
 
 
+class RateLimiter (object):
+
+    """
+    Spaces out API calls so that no more than ``rate`` requests per second
+    are made. A limiter can be shared between threads and API instances.
+
+    Waiting requests are served by priority (see ``PRIORITY_*``) and, within
+    the same priority, by deadline (earliest first) and order of arrival.
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.lock = threading.Condition()
+        self.next_slot = 0.0
+        self.waiting = []  # heap of (priority, deadline, seq)
+        self.counter = count()
+        self.stats = {}  # priority -> [waiting, served, total wait, max wait]
+
+    def acquire(self, priority=PRIORITY_POLL, deadline=None):
+        """
+        Blocks until the next request may be made. Returns the number of
+        seconds spent waiting.
+
+        :param priority: One of the ``PRIORITY_*`` values.
+        :param deadline: Time (see :func:`time.monotonic`) by which the
+            request should be made.
+        """
+        start = _clock()
+        with self.lock:
+            entry = (priority, deadline if deadline is not None else _INF,
+                     next(self.counter))
+            heapq.heappush(self.waiting, entry)
+            stats = self.stats.setdefault(priority, [0, 0, 0.0, 0.0])
+            stats[0] += 1
+            while True:
+                now = _clock()
+                if self.waiting[0] is not entry:
+                    self.lock.wait()
+                elif now < self.next_slot:
+                    self.lock.wait(self.next_slot - now)  # Wait for it!
+                else:
+                    break
+            heapq.heappop(self.waiting)
+            self.next_slot = max(now, self.next_slot) + 1.0 / self.rate
+            self.lock.notify_all()
+            wait = now - start
+            stats[0] -= 1
+            stats[1] += 1
+            stats[2] += wait
+            stats[3] = max(stats[3], wait)
+        return wait
+
+    def idle(self):
+        """
+        Returns ``True`` if a request could be made right away without
+        holding up another one.
+        """
+        with self.lock:
+            return not self.waiting and _clock() >= self.next_slot
+
+    def report(self, ok, latency):
+        """
+        Called with the outcome of each request (``ok`` is false for server
+        errors and failed connections) and its latency in seconds. A fixed
+        rate ignores it.
+        """
+
+    def metrics(self):
+        """
+        Returns queue depth and wait times per priority class::
+
+            {'command': {'waiting': 0, 'served': 12, 'avg_wait': 0.1,
+                         'max_wait': 0.5}, ...}
+
+        """
+        with self.lock:
+            return dict(
+                (PRIORITY_NAMES.get(priority, priority), {
+                    'waiting': waiting,
+                    'served': served,
+                    'avg_wait': total / served if served else 0.0,
+                    'max_wait': max_wait,
+                })
+                for priority, (waiting, served, total, max_wait)
+                in self.stats.items())
+
+
+class AdaptiveRateLimiter (RateLimiter):
+
+    """
+    Rate limiter which finds the rate the server tolerates (additive
+    increase, multiplicative decrease). Every healthy response raises the
+    rate by ``increase`` requests per second up to ``ceiling``. A server
+    error, a failed connection or a response slower than ``spike`` times
+    the average latency (or slower than ``max_latency``) multiplies the
+    rate with ``decrease``, but not below ``floor``. Requests which were
+    already under way when the rate was cut do not cut it again, so only
+    one decrease happens per ``cooldown`` seconds::
+
+        >>> limiter = AdaptiveRateLimiter(2.0, floor=0.5, ceiling=10.0)
+        >>> api = ELIZA('ai_bot', '...', limiter=limiter)
+
+    """
+
+    def __init__(self, rate, floor=0.5, ceiling=10.0, increase=0.1,
+                 decrease=0.5, spike=3.0, max_latency=None, cooldown=1.0):
+        super(AdaptiveRateLimiter, self).__init__(rate)
+        self.floor = float(floor)
+        self.ceiling = float(ceiling)
+        self.rate = min(max(self.rate, self.floor), self.ceiling)
+        self.increase = increase
+        self.decrease = decrease
+        self.spike = spike
+        self.max_latency = max_latency
+        self.cooldown = cooldown
+        self.latency = None  # moving average of healthy responses
+        self.last_cut = None
+        self.counts = {'increases': 0, 'decreases': 0, 'errors': 0,
+                       'spikes': 0}
+
+    def report(self, ok, latency):
+        with self.lock:
+            spike = ok and (
+                (self.max_latency is not None and latency > self.max_latency)
+                or (self.latency is not None and
+                    latency > self.spike * self.latency))
+            if not ok or spike:
+                self.counts['errors' if not ok else 'spikes'] += 1
+                now = _clock()
+                if self.last_cut is None or now - self.last_cut >= self.cooldown:
+                    self.last_cut = now
+                    self.rate = max(self.floor, self.rate * self.decrease)
+                    self.counts['decreases'] += 1
+                    self.lock.notify_all()
+            else:
+                self.rate = min(self.ceiling, self.rate + self.increase)
+                self.counts['increases'] += 1
+            if ok and not spike:
+                self.latency = latency if self.latency is None else (
+                    0.8 * self.latency + 0.2 * latency)
+
+    def metrics(self):
+        """
+        Adds the state of the controller to :meth:`RateLimiter.metrics` as
+        ``'throttle'``::
+
+            {'throttle': {'rate': 3.2, 'floor': 0.5, 'ceiling': 10.0,
+                          'latency': 0.21, 'increases': 40, 'decreases': 1,
+                          'errors': 1, 'spikes': 0}, ...}
+
+        """
+        metrics = super(AdaptiveRateLimiter, self).metrics()
+        with self.lock:
+            throttle = dict(self.counts, rate=self.rate, floor=self.floor,
+                            ceiling=self.ceiling, latency=self.latency)
+        metrics['throttle'] = throttle
+        return metrics
+
+
+_INF = float('inf')
+_clock = getattr(time, 'monotonic', time.time)
+
+
 TROOPER = 'Trooper'
 RAISER = 'Raider'
 HEAVY_TROOPER = 'Heavy Trooper'
@@ -400,6 +826,328 @@ SUBMARINE = 'Submarine'
 DFA = 'DFA' 
 BERSERKER = 'Berserker'
 
+#: unit prices in credits
+UNIT_COSTS = {
+    TROOPER: 75, HEAVY_TROOPER: 150, RAISER: 200, TANK: 300, HEAVY_TANK: 600,
+    LIGHT_ARTILLERY: 200, HEAVY_ARTILLERY: 600, ASSAULT_ARTILLERY: 450,
+    ANTI_AIRCRAFT: 300, BERSERKER: 900, DFA: 1200, HOVERCRAFT: 300,
+    JET: 800, HELICOPTER: 600, BOMBER: 900,
+    SPEEDBOAT: 200, DESTROYER: 1100, BATTLESHIP: 2000, SUBMARINE: 1000,
+}
+
+#: mobility, minimum and maximum attack range and movement class of each unit
+#: (movement costs per class are in :data:`MOVEMENT_COSTS`)
+UNIT_STATS = {
+    TROOPER: (9, 1, 1, 'foot'),
+    HEAVY_TROOPER: (6, 1, 1, 'foot'),
+    RAISER: (12, 1, 1, 'wheels'),
+    TANK: (7, 1, 1, 'tracks'),
+    HEAVY_TANK: (6, 1, 1, 'tracks'),
+    LIGHT_ARTILLERY: (6, 2, 3, 'wheels'),
+    HEAVY_ARTILLERY: (5, 3, 4, 'tracks'),
+    ASSAULT_ARTILLERY: (6, 1, 2, 'tracks'),
+    ANTI_AIRCRAFT: (6, 1, 3, 'tracks'),
+    BERSERKER: (6, 1, 1, 'tracks'),
+    DFA: (6, 3, 5, 'tracks'),
+    HOVERCRAFT: (12, 1, 1, 'hover'),
+    JET: (18, 1, 1, 'air'),
+    HELICOPTER: (15, 1, 1, 'air'),
+    BOMBER: (12, 1, 1, 'air'),
+    SPEEDBOAT: (18, 1, 1, 'sea'),
+    DESTROYER: (12, 1, 1, 'sea'),
+    BATTLESHIP: (8, 2, 4, 'sea'),
+    SUBMARINE: (9, 1, 1, 'sea'),
+}
+
+#: units which cannot move and attack in the same turn
+STATIONARY_ATTACKERS = frozenset([
+    LIGHT_ARTILLERY, HEAVY_ARTILLERY, DFA, BATTLESHIP])
+
+#: movement points needed to enter a terrain by movement class; terrains
+#: missing from a class cannot be entered (``None`` holds the default)
+MOVEMENT_COSTS = {
+    'foot': {None: 3, 'Woods': 4, 'Mountains': 6, 'Swamp': 4, 'Desert': 4,
+             'Water': None, 'Base': 2, 'Harbor': 2, 'Airfield': 2},
+    'wheels': {None: 3, 'Woods': 6, 'Mountains': None, 'Swamp': 6,
+               'Desert': 4, 'Water': None, 'Base': 2, 'Harbor': 2,
+               'Airfield': 2},
+    'tracks': {None: 3, 'Woods': 5, 'Mountains': None, 'Swamp': 5,
+               'Desert': 3, 'Water': None, 'Base': 2, 'Harbor': 2,
+               'Airfield': 2},
+    'hover': {None: 3, 'Woods': None, 'Mountains': None, 'Water': 3,
+              'Swamp': 3},
+    'air': {None: 3},
+    'sea': {None: None, 'Water': 3, 'Harbor': 3},
+}
+
+#: units which can be built on each type of terrain
+BUILDABLE_UNITS = {
+    'Base': set([TROOPER, HEAVY_TROOPER, RAISER, TANK, HEAVY_TANK,
+                 LIGHT_ARTILLERY, HEAVY_ARTILLERY, ASSAULT_ARTILLERY,
+                 ANTI_AIRCRAFT, BERSERKER, DFA, HOVERCRAFT]),
+    'Airfield': set([JET, HELICOPTER, BOMBER]),
+    'Harbor': set([SPEEDBOAT, DESTROYER, BATTLESHIP, SUBMARINE, HOVERCRAFT]),
+}
+
+
+class GameBoard (object):
+
+    """
+    Local copy of a game state from the point of view of one player. It is
+    used to reject ELIZA commands which are bound to fail before they are
+    sent, raising the same exceptions the server response would.
+
+    Only what is certain is checked: terrain ownership, occupied fields,
+    units already built on a field this turn and available credits.
+    """
+
+    def __init__(self, state, player):
+        """
+        :param state: Game state as returned by :meth:`ELIZA.game_state`.
+        :param player: Name of the player issuing the commands.
+        """
+        self.state = state
+        self.game_id = state.get('id')
+        self.player = player
+        self.credits = None
+        self.terrain = {}  # (x, y) -> (owner, type)
+        self.units = {}  # (x, y) -> unit dict including owner
+        self.built = set()  # fields on which a unit was built this turn
+        for faction in state.get('factions', []):
+            owner = faction.get('playerName')
+            if owner == player:
+                self.credits = faction.get('credits')
+            for terrain in faction.get('terrain', []):
+                self.terrain[terrain['x'], terrain['y']] = (
+                    owner, terrain.get('type'))
+            for unit in faction.get('units', []):
+                unit = dict(unit, owner=owner)
+                self.units[unit['x'], unit['y']] = unit
+
+    def check_build(self, position, type_):
+        x, y = position
+        owner, terrain = self.terrain.get((x, y), (None, None))
+        if owner != self.player:
+            raise NotYourTerrain(x, y)
+        if terrain in BUILDABLE_UNITS and type_ not in BUILDABLE_UNITS[terrain]:
+            raise WrongTerrain(x, y)
+        if (x, y) in self.built:
+            raise CannotBuildMoreUnitsHere(x, y)
+        if (x, y) in self.units:
+            raise FieldIsBlocked(x, y)
+        cost = UNIT_COSTS.get(type_)
+        if self.credits is not None and cost is not None and cost > self.credits:
+            raise NotEnoughCredits(type_)
+
+    def apply_build(self, position, type_):
+        x, y = position
+        if self.credits is not None:
+            self.credits -= UNIT_COSTS.get(type_, 0)
+        self.built.add((x, y))
+        self.units[x, y] = {'x': x, 'y': y, 'type': type_, 'quantity': 10,
+                            'finished': True, 'owner': self.player}
+
+    def check_unit(self, position):
+        x, y = position
+        unit = self.units.get((x, y))
+        if unit is None or unit['owner'] != self.player:
+            raise NotYourUnit(x, y)
+        return unit
+
+    def check_move(self, from_, to):
+        self.check_unit(from_)
+        if tuple(to) in self.units:
+            raise FieldIsBlocked(*to)
+
+    def apply_move(self, from_, to):
+        x, y = to
+        unit = self.units.pop(tuple(from_))
+        unit.update(x=x, y=y)
+        self.units[x, y] = unit
+
+    def check_command(self, position, command, **kwargs):
+        """
+        Checks a unit command (see :meth:`ELIZA._unit_command`).
+        """
+        if command == 'move':
+            self.check_move(position, (int(kwargs['x']), int(kwargs['y'])))
+        else:
+            self.check_unit(position)
+
+    def apply_result(self, result):
+        """
+        Updates board with the outcome of a unit command (see
+        :meth:`ELIZA._parse_unit_result`).
+        """
+        command, position = result['command'], result['position']
+        if command == 'move':
+            self.apply_move(position, result['to'])
+        elif command == 'attack':
+            unit = self.units.get(position)
+            if unit is not None:
+                if 'remainingQuantity' in result:
+                    unit['quantity'] = result['remainingQuantity']
+                elif 'damageReceived' in result:
+                    unit['quantity'] -= result['damageReceived']
+                unit['finished'] = True
+                self._remove_destroyed(position)
+            target = self.units.get(result.get('target'))
+            if target is not None and 'damageInflicted' in result:
+                target['quantity'] -= result['damageInflicted']
+                self._remove_destroyed(result['target'])
+        elif command == 'capture':
+            if result.get('finished'):
+                _, type_ = self.terrain.get(position, (None, 'Base'))
+                self.terrain[position] = (self.player, type_)
+            if position in self.units:
+                self.units[position]['finished'] = True
+        elif command == 'repair':
+            if position in self.units:
+                self.units[position]['finished'] = True
+
+    def _remove_destroyed(self, position):
+        if self.units[position].get('quantity', 1) <= 0:
+            del self.units[position]
+
+    def to_state(self):
+        """
+        Returns board in the format of :meth:`ELIZA.game_state`.
+        """
+        state = dict(self.state)
+        # terrain as in the original state (capture progress and all)
+        fields = {}
+        for faction in state.get('factions', []):
+            for terrain in faction.get('terrain', []):
+                fields[terrain['x'], terrain['y']] = terrain
+        factions = []
+        for faction in state.get('factions', []):
+            faction = dict(faction)
+            owner = faction.get('playerName')
+            if owner == self.player and self.credits is not None:
+                faction['credits'] = self.credits
+            faction['units'] = [
+                dict((key, val) for key, val in unit.items() if key != 'owner')
+                for unit in self.units.values()
+                if unit['owner'] == owner]
+            faction['terrain'] = [
+                dict(fields.get((x, y), {'finished': False}),
+                     x=x, y=y, type=type_)
+                for (x, y), (terrain_owner, type_) in self.terrain.items()
+                if terrain_owner == owner]
+            factions.append(faction)
+        state['factions'] = factions
+        return state
+
+
+class _ElementMaker (object):
+
+    """
+    Creates the :class:`lxml.objectify.ElementMaker` for ELIZA commands when
+    it is first used.
+    """
+
+    maker = None
+
+    def __get__(self, instance, owner):
+        if self.maker is None:
+            self.maker = objectify.ElementMaker(annotate=False, nsmap={})
+        return self.maker
+
+
+class CommandEncoder (object):
+
+    """
+    Serialises ELIZA commands by filling in pre-compiled string templates.
+    The result is byte for byte what :func:`lxml.etree.tostring` returns for
+    the same command built with :attr:`ELIZA.ELEMENT`, but without creating an
+    element tree for every command::
+
+        >>> CommandEncoder().unit(123, (1, 2), 'move', x=3, y=4)
+        b'<weewar game="123"><unit x="1" y="2"><move x="3" y="4"/></unit></weewar>'
+
+    """
+
+    GAME = '<weewar game="%s">%s</weewar>'
+    SIMPLE = '<%s/>'
+    CHAT = '<chat>%s</chat>'
+    BUILD = '<build x="%s" y="%s" type="%s"/>'
+    MOVEMENT_OPTIONS = '<movementOptions x="%s" y="%s" type="%s"/>'
+    ATTACK_OPTIONS = '<attackOptions x="%s" y="%s" type="%s"/>'
+    ATTACK_OPTIONS_MOVED = '<attackOptions x="%s" y="%s" type="%s" moved="%s"/>'
+    UNIT = '<unit x="%s" y="%s">%s</unit>'
+
+    # same escaping as libxml2 (in this order, so "&" is only escaped once)
+    TEXT_ESCAPES = (
+        ('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'), ('\r', '&#13;'),
+    )
+    ATTR_ESCAPES = TEXT_ESCAPES + (
+        ('"', '&quot;'), ('\n', '&#10;'), ('\t', '&#9;'),
+    )
+
+    @staticmethod
+    def _escape(value, escapes):
+        value = _to_text(value)
+        for char, escaped in escapes:
+            if char in value:
+                value = value.replace(char, escaped)
+        return value
+
+    @classmethod
+    def attr(cls, value):
+        """
+        Escapes an attribute value. Integers are passed through as they never
+        need escaping.
+        """
+        if type(value) is int:
+            return str(value)
+        return cls._escape(value, cls.ATTR_ESCAPES)
+
+    def _game(self, game_id, command):
+        body = self.GAME % (self.attr(game_id), command)
+        return body.encode('ascii', 'xmlcharrefreplace')
+
+    def simple(self, game_id, cmd):
+        """
+        Command without attributes, e.g. ``finishTurn``.
+        """
+        return self._game(game_id, self.SIMPLE % cmd)
+
+    def chat(self, game_id, msg):
+        return self._game(
+            game_id, self.CHAT % self._escape(msg, self.TEXT_ESCAPES))
+
+    def build(self, game_id, position, type_):
+        x, y = position
+        attr = self.attr
+        return self._game(game_id, self.BUILD % (attr(x), attr(y), attr(type_)))
+
+    def movement_options(self, game_id, position, type_):
+        x, y = position
+        attr = self.attr
+        return self._game(game_id, self.MOVEMENT_OPTIONS % (
+            attr(x), attr(y), attr(type_)))
+
+    def attack_options(self, game_id, position, type_, moved=None):
+        x, y = position
+        attr = self.attr
+        if moved is None:
+            command = self.ATTACK_OPTIONS % (attr(x), attr(y), attr(type_))
+        else:
+            command = self.ATTACK_OPTIONS_MOVED % (
+                attr(x), attr(y), attr(type_), attr(moved))
+        return self._game(game_id, command)
+
+    def unit(self, game_id, position, command, **attrs):
+        """
+        Command for the unit at ``position``, e.g. ``move`` or ``capture``.
+        Attributes are written in the order they are passed in.
+        """
+        x, y = position
+        attr = self.attr
+        inner = '<%s%s/>' % (command, ''.join(
+            ' %s="%s"' % (name, attr(val)) for name, val in attrs.items()))
+        return self._game(game_id, self.UNIT % (attr(x), attr(y), inner))
+
 
 class ELIZA (ReadOnlyAPI):
 
@@ -417,22 +1165,102 @@ class ELIZA (ReadOnlyAPI):
     > be fixed accordingly.
     
     Documentation is available at http://weewar.wikispaces.com/api.
+
+    With ``validate=True`` each fetched game state is kept as
+    :class:`GameBoard` and commands for that game are checked against it
+    before they are sent. Commands which would certainly fail raise the
+    usual exceptions without a request to the server. Successful commands
+    update the board, so it stays current for the rest of the turn.
+
+    With :attr:`raise_errors` off, commands return a :class:`CommandStatus`
+    instead of raising exceptions for errors, which is cheaper when many
+    commands are sent in bulk.
     """
 
+    raise_errors = True  #: raise errors of commands (or return them)
+
+    def __init__(self, username=None, key=None, limiter=None, cache=None,
+                 validate=False, catalog=None, profiler=None):
+        """
+        Initialise API. See :meth:`ReadOnlyAPI.__init__`.
+
+        :param validate: Check commands against local game boards first.
+        :type validate: bool
+        """
+        super(ELIZA, self).__init__(
+            username, key, limiter, cache, catalog, profiler)
+        self.validate = validate
+        self.boards = {}  # game id -> GameBoard
+        self.deadlines = {}  # game id -> deadline of current turn
+        self.attention = set()  # ids of games in need of attention
+
+    def headquarter(self):
+        """
+        See :meth:`ReadOnlyAPI.headquarter`. Also remembers which games are
+        in need of attention (see :meth:`game_state`).
+        """
+        hq = super(ELIZA, self).headquarter()
+        for game in hq['games']:
+            if game['inNeedOfAttention']:
+                self.attention.add(game['id'])
+            else:
+                self.attention.discard(game['id'])
+        return hq
+
     URL_GAME_STATE = '/api1/gamestate/%s'
 
     def game_state(self, id_):
         """
         Offers more information about the state of a game - an extended
-        version of :meth:`game`.
+        version of :meth:`game`. States of games which :meth:`headquarter`
+        (or an earlier state) showed in need of attention are fetched at
+        :data:`PRIORITY_ATTENTION`, all others at :data:`PRIORITY_POLL`.
         """
+        if id_ in self.attention:
+            priority = PRIORITY_ATTENTION
+        else:
+            priority = PRIORITY_POLL
         try:
-            root = self._call_api(self.URL_GAME_STATE % id_)
-            return self._parse_game_state(root)
+            root = self._call_api(
+                self.URL_GAME_STATE % id_, priority=priority,
+                deadline=self.deadlines.get(id_))
+            state = self._parse_game_state(root)
         except NotFound:
             raise GameNotFound(id_)
         except Unauthorised:
             raise NotYourGame(id_)
+        self._track_state(id_, state)
+        return state
+
+    def _track_state(self, id_, state, fetched=None):
+        """
+        Keeps the board (with ``validate``) and the deadline of the current
+        turn for a game state fetched at time ``fetched`` (now by default).
+        """
+        if self.validate:
+            self.boards[id_] = GameBoard(state, self.username)
+        if not self._is_my_turn(state):
+            self.attention.discard(id_)
+            return
+        self.attention.add(id_)
+        if id_ not in self.deadlines:
+            self.set_deadline(id_, state.get('pace'), fetched)
+
+    def _is_my_turn(self, state):
+        return any(player.get('current') and
+                   player.get('username') == self.username
+                   for player in state.get('players', []))
+
+    def set_deadline(self, game_id, pace, since=None):
+        """
+        Sets the time left (in seconds) to finish the current turn of a game,
+        counted from ``since`` (now by default). Requests for games with
+        closer deadlines are sent first. This is done automatically from the
+        game's ``pace`` when :meth:`game_state` shows that it is your turn.
+        """
+        if pace:
+            self.deadlines[game_id] = (
+                since if since is not None else _clock()) + pace
 
     def _parse_game_state(self, node):
         """
@@ -538,11 +1366,17 @@ class ELIZA (ReadOnlyAPI):
         Complete map layout.
         """
         try:
-            root = self._call_api(self.URL_MAP_LAYOUT % id_)
-            return self._parse_map_layout(root)
+            return self._fetch(self.URL_MAP_LAYOUT % id_,
+                               self._parse_map_layout, self.MAP_TTL)
         except NotFound:
             raise MapNotFound(id_)
 
+    def map_grid(self, id_):
+        """
+        Neighbour and distance tables for a map (see :class:`HexGrid`).
+        """
+        return map_grid(self.map_layout(id_))
+
     def _parse_map_layout(self, node):
         """
         Returns a simple dict for a game state node.
@@ -587,23 +1421,61 @@ class ELIZA (ReadOnlyAPI):
         return values
 
     URL_ELIZA_COMMANDS = '/api1/eliza'
-    ELEMENT = objectify.ElementMaker(annotate=False, nsmap={})
+    ELEMENT = _ElementMaker()
+
+    COMMANDS = CommandEncoder()
 
     def _game_command(self, game_id, node):
+        """
+        Sends command element ``node`` for a game.
+        """
         game = self.ELEMENT.weewar(game=str(game_id))
         game.append(node)
-        #print tostring(game, pretty_print=True)
-        node = self._call_api(self.URL_ELIZA_COMMANDS, tostring(game))
+        #print etree.tostring(game, pretty_print=True)
+        return self._send_command(game_id, etree.tostring(game))
+
+    def _send_command(self, game_id, body, **context):
+        """
+        Sends an encoded command (see :class:`CommandEncoder`) and checks the
+        response for errors (see :func:`decode_error`, ``context`` describes
+        the command). Errors are raised, or returned as
+        :class:`CommandStatus` if :attr:`raise_errors` is off.
+        """
+        with self.span('command', game=game_id):
+            node = self._call_api(
+                self.URL_ELIZA_COMMANDS, body, PRIORITY_COMMAND,
+                self.deadlines.get(game_id))
         if node.tag == 'error':
-            if node.text == 'Game not found':
-                raise GameNotFound(game_id)
-            elif node.text == 'Not your turn.':
-                raise NotYourTurn
-            else:
-                raise ELIZAError(node)
+            error, args = decode_error(node, game_id=game_id, **context)
+            if self.raise_errors:
+                raise error(*args)
+            return CommandStatus(False, node, error, args)
         # otherwise return parsed XML node
         return node
 
+    def _result(self, node, result):
+        """
+        Returns ``result`` of a successful command (as :class:`CommandStatus`
+        if :attr:`raise_errors` is off).
+        """
+        if self.raise_errors:
+            return result
+        return CommandStatus(True, node, result=result)
+
+    def _check(self, check, *args, **kwargs):
+        """
+        Runs a check of the local board (see :attr:`validate`). Returns
+        a failed :class:`CommandStatus` if it fails and :attr:`raise_errors`
+        is off.
+        """
+        if self.raise_errors:
+            check(*args, **kwargs)
+            return None
+        try:
+            check(*args, **kwargs)
+        except _ERROR_TYPES as e:
+            return CommandStatus(False, None, type(e), e.args)
+
     #{ simple game commands
     FINISH_TURN = 'finishTurn'
     ACCEPT_INVITATION = 'acceptInvitation'
@@ -618,50 +1490,65 @@ class ELIZA (ReadOnlyAPI):
         Send a simple command to the API. A simple command usually consists of 
         only one element.
         """
-        node = getattr(self.ELEMENT, cmd)()
-        return self._game_command(game_id, node)
+        node = self._send_command(game_id, self.COMMANDS.simple(game_id, cmd))
+        if cmd == self.FINISH_TURN and node.__class__ is not CommandStatus:
+            # board is outdated once the other players have moved
+            self.boards.pop(game_id, None)
+            self.deadlines.pop(game_id, None)
+            self.attention.discard(game_id)
+        return node
+
+    def finish_turn(self, game_id):
+        """
+        Finishes turn in game.
+        """
+        node = self._simple_game_command(game_id, self.FINISH_TURN)
+        if node.__class__ is CommandStatus:
+            return node
+        return self._result(node, node.tag == 'ok')
 
     def chat(self, game_id, msg):
         """
         Sends a (preferably polite) message.
         """
-        node = self._game_command(game_id, self.ELEMENT.chat(msg))
-        return True
+        node = self._send_command(game_id, self.COMMANDS.chat(game_id, msg))
+        if node.__class__ is CommandStatus:
+            return node
+        return self._result(node, True)
 
     def build(self, game_id, position, type_):
         """
-        Builds a unit are a specific location of the map.
+        Builds a unit are a specific location of the map. Errors other than
+        the build errors (e.g. :class:`NotEnoughCredits`),
+        :class:`GameNotFound` and :class:`NotYourTurn` return ``False``.
         """
-        x, y = position
+        board = self.boards.get(game_id)
+        if board is not None:
+            failed = self._check(board.check_build, position, type_)
+            if failed is not None:
+                return failed
         try:
-            node = self._game_command(game_id, self.ELEMENT.build(
-                    x=str(x), y=str(y), type_=str(type_)))
-            return node.tag == 'ok'
-        except ELIZAError as e:
-            if e.node.text == 'Not enough credits.':
-                raise NotEnoughCredits(type_)
-            if e.node.text == 'Not your terrain.':
-                raise NotYourTerrain(x, y)
-            elif e.node.text == ('Cannot build any more units in this turn on '
-                               'this coordinate.'):
-                raise CannotBuildMoreUnitsHere(x, y)
-            elif e.node.text == 'This Terrain cannot build the requested unit.':
-                raise WrongTerrain(x, y)
-            elif e.node.text == 'Blocked by a unit.':
-                raise FieldIsBlocked(x, y)
-            # otherwise
+            node = self._send_command(
+                game_id, self.COMMANDS.build(game_id, position, type_),
+                position=position, target=position, type=type_)
+        except ELIZAError:
             return False
-        
+        if node.__class__ is CommandStatus:
+            return node
+        if board is not None and node.tag == 'ok':
+            board.apply_build(position, type_)
+        return self._result(node, node.tag == 'ok')
+
     def move_options(self, game_id, position, type_):
         """
         Requests unit movement options. This is pretty much like what you get 
         when you select a unit in a regular game.
         """
-        x, y = position
         try:
-            options = self.ELEMENT.movementOptions(x=str(x), y=str(y), 
-                                                 type=str(type_))
-            node = self._game_command(game_id, options)
+            node = self._send_command(
+                game_id, self.COMMANDS.movement_options(game_id, position, type_))
+            if node.__class__ is CommandStatus:
+                return []
             coords = map(lambda node: self._parse_attrs(node, x=int, y=int), 
                          node.findall('coordinate'))
             return [(c.get('x'), c.get('y')) for c in coords]
@@ -674,14 +1561,10 @@ class ELIZA (ReadOnlyAPI):
         describes the number of turns a unit has already moved. This is helpful 
         for Jets and Battleships.
         """
-        x, y = position
         try:
-            options = self.ELEMENT.attackOptions(
-                x=str(x), y=str(y), type=str(type_))
-            if moved is not None:
-                options.set('moved', str(moved))
-            node = self._game_command(game_id, options)
-            return node.tag == 'ok'
+            node = self._send_command(game_id, self.COMMANDS.attack_options(
+                game_id, position, type_, moved))
+            return node.__class__ is not CommandStatus and node.tag == 'ok'
         except ELIZAError:
             return False
         
@@ -689,16 +1572,119 @@ class ELIZA (ReadOnlyAPI):
         """
         Send a command to a unit at position (x, y).
         """
-        x, y = position
-        try:
-            unit = self.ELEMENT.unit(x=str(x), y=str(y))
-            unit.append(getattr(self.ELEMENT, command)(**kwargs))
-            return self._game_command(game_id, unit)
-        except ELIZAError as e:
-            if e.node.text == 'Not your Unit.':
-                raise NotYourUnit(x, y)
-            # otherwise simply re-raise
-            raise
+        return self._send_unit_command(game_id, position, command, **kwargs)[0]
+
+    def _send_unit_command(self, game_id, position, command, **kwargs):
+        """
+        Sends a unit command and returns the response node (or failed
+        :class:`CommandStatus`) and the parsed outcome (see
+        :meth:`_parse_unit_result`) if it succeeded.
+        """
+        board = self.boards.get(game_id)
+        if board is not None:
+            failed = self._check(board.check_command, position, command,
+                                 **kwargs)
+            if failed is not None:
+                return failed, None
+        target = position
+        if 'x' in kwargs and 'y' in kwargs:
+            target = (int(kwargs['x']), int(kwargs['y']))
+        node = self._send_command(
+            game_id, self.COMMANDS.unit(game_id, position, command, **kwargs),
+            position=position, target=target)
+        if node.__class__ is CommandStatus or node.tag != 'ok':
+            return node, None
+        result = self._parse_unit_result(node, position, command, **kwargs)
+        if board is not None:
+            board.apply_result(result)
+        return node, result
+
+    def _parse_unit_result(self, node, position, command, **kwargs):
+        """
+        Returns a simple dict describing the outcome of a unit command.
+        Example XML (for an attack)::
+
+            <ok>
+                <attack target="[5,7]" damageReceived="2" damageInflicted="7"
+                        remainingQuantity="8" />
+            </ok>
+
+        The result always contains ``command`` and ``position`` (of the unit
+        before the command). Depending on the command there is also
+
+        - ``move``: ``to``
+        - ``attack``: ``target``, ``damageInflicted``, ``damageReceived`` and
+          ``remainingQuantity``
+        - ``capture``: ``finished`` (``True`` if the base was taken)
+        """
+        result = {'command': command, 'position': tuple(position)}
+        if 'x' in kwargs and 'y' in kwargs:
+            target = (int(kwargs['x']), int(kwargs['y']))
+            result['to' if command == 'move' else 'target'] = target
+        child = node.find(command)
+        if child is not None:
+            result.update(self._parse_attrs(
+                child, damageInflicted=int, damageReceived=int,
+                remainingQuantity=int))
+            if command == 'capture':
+                result.update(self._parse_attrs(child, finished=bool))
+        return result
+
+    def move(self, game_id, from_, to):
+        """
+        Moves unit at ``from_`` to ``to`` and returns the outcome (see
+        :meth:`_parse_unit_result`).
+        """
+        node, result = self._send_unit_command(
+            game_id, from_, 'move', x=to[0], y=to[1])
+        if node.__class__ is CommandStatus:
+            return node
+        return self._result(node, result)
+
+    def attack(self, game_id, from_, target):
+        """
+        Attacks ``target`` with unit at ``from_`` and returns the outcome
+        including the damage dealt and taken.
+        """
+        x, y = target
+        node, result = self._send_unit_command(
+            game_id, from_, 'attack', x=x, y=y)
+        if node.__class__ is CommandStatus:
+            return node
+        return self._result(node, result)
+
+    def capture(self, game_id, at):
+        """
+        Captures base with unit at ``at`` and returns the outcome.
+        """
+        node, result = self._send_unit_command(game_id, at, 'capture')
+        if node.__class__ is CommandStatus:
+            return node
+        return self._result(node, result)
+
+    def repair(self, game_id, at):
+        """
+        Repairs unit at ``at`` and returns the outcome.
+        """
+        node, result = self._send_unit_command(game_id, at, 'repair')
+        if node.__class__ is CommandStatus:
+            return node
+        return self._result(node, result)
+
+    def board(self, game_id):
+        """
+        Returns the current local state of a game (in the format of
+        :meth:`game_state`) with all command results applied, fetching the
+        game state only if there is no board for it yet. Boards are only
+        kept with ``validate``; otherwise the game state is fetched.
+        """
+        board = self.boards.get(game_id)
+        if board is None:
+            state = self.game_state(game_id)  # keeps the board
+            board = self.boards.get(game_id)
+            if board is None:
+                return state
+        return board.to_state()
     
 
 class UserNotFound (Exception):
@@ -726,7 +1712,7 @@ class ELIZAError (Exception):
     def __init__(self, node):
         self.node = node
     def __str__(self):
-        return tostring(self.node)
+        return etree.tostring(self.node, encoding='unicode')
 
 
 class NotYourGame (Exception):
@@ -777,49 +1763,3593 @@ class FieldIsBlocked (Exception):
     """
 
 
-def game(game_id):
+class InvitationAlreadyAccepted (ELIZAError):
     """
-    Returns the status of a game and gives information about the participating
-    players.
-
-    :param game_id: Unique ID of weewar game.
-    :type game_id: int
-    :rtype: dict
+    You have already accepted the invitation.
     """
-    return ReadOnlyAPI().game(game_id)
-    
 
-def open_games():
-    """
-    Returns all currently available open games as a list of IDs.
 
-    :rtype: [int]
+class CannotDeclineInvitation (ELIZAError):
     """
-    return ReadOnlyAPI().open_games()
-    
-
-def all_users():
+    Cannot decline an invitation.
     """
-    Returns a list of all users who have been online in the last 7 days,
-    including their current ranking.
 
-    :rtype: dict
-    """
-    return ReadOnlyAPI().all_users()
-    
 
-def user(username):
+class CannotRemind (ELIZAError):
+    """
+    Can not remind current player.
     """
-    Returns detailed information about a single user, including everything that
-    is visible on the profile page and the games the user is participating in.
 
-    :param username: Unique username of weewar player.
-    :rtype: dict
+
+class CannotSurrender (ELIZAError):
+    """
+    Can not surrender.
     """
-    return ReadOnlyAPI().user(username)
 
 
-def latest_maps():
+class GameNotRunning (ELIZAError):
+    """
+    Game is not running.
+    """
+
+
+class GameAlreadyDeleted (ELIZAError):
+    """
+    Game has already been deleted.
+    """
+
+
+#: ELIZA error messages, the exceptions they stand for and the details of the
+#: command (see :func:`decode_error`) passed to them
+ELIZA_ERRORS = {
+    'Game not found': (GameNotFound, ('game_id', )),
+    'Not your turn.': (NotYourTurn, ()),
+    'Not enough credits.': (NotEnoughCredits, ('type', )),
+    'Not your terrain.': (NotYourTerrain, ('position', )),
+    'Cannot build any more units in this turn on this coordinate.': (
+        CannotBuildMoreUnitsHere, ('position', )),
+    'This Terrain cannot build the requested unit.': (
+        WrongTerrain, ('position', )),
+    'Blocked by a unit.': (FieldIsBlocked, ('target', )),
+    'Not your Unit.': (NotYourUnit, ('position', )),
+    'You have already accepted the invitation.': (
+        InvitationAlreadyAccepted, ('node', )),
+    'Cannot decline an invitation.': (CannotDeclineInvitation, ('node', )),
+    'Can not remind current player.': (CannotRemind, ('node', )),
+    'Can not surrender.': (CannotSurrender, ('node', )),
+    'Game is not running.': (GameNotRunning, ('node', )),
+    'Game has already been deleted.': (GameAlreadyDeleted, ('node', )),
+}
+
+_ERROR_TYPES = tuple(set(
+    [ELIZAError] + [error for error, details in ELIZA_ERRORS.values()]))
+
+
+def decode_error(node, **context):
+    """
+    Looks up the exception for an ELIZA ``<error>`` node in
+    :data:`ELIZA_ERRORS` and returns it with its arguments. ``context``
+    holds the details of the command (``game_id``, ``position`` and
+    ``target`` as ``(x, y)``, unit ``type``). Unknown errors, or known ones
+    without the details needed, are returned as :class:`ELIZAError`::
+
+        >>> error, args = decode_error(node, position=(3, 4))
+        >>> raise error(*args)
+        Traceback (most recent call last):
+        NotYourUnit: (3, 4)
+
+    """
+    entry = ELIZA_ERRORS.get(node.text)
+    if entry is None:
+        return ELIZAError, (node, )
+    error, details = entry
+    args = []
+    for detail in details:
+        if detail == 'node':
+            args.append(node)
+        elif detail not in context:
+            return ELIZAError, (node, )
+        elif detail in ('position', 'target'):
+            args.extend(context[detail])
+        else:
+            args.append(context[detail])
+    return error, tuple(args)
+
+
+class CommandStatus (object):
+
+    """
+    Outcome of an ELIZA command if :attr:`ELIZA.raise_errors` is off. It is
+    true if the command succeeded; ``result`` then holds what the command
+    would have returned. Otherwise ``error`` and ``args`` describe the
+    exception which would have been raised::
+
+        >>> api.raise_errors = False
+        >>> status = api.move(game_id, (3, 4), (4, 4))
+        >>> if not status and status.error is FieldIsBlocked:
+        ...     ...
+        >>> status.raise_for_status()
+
+    """
+
+    __slots__ = ('ok', 'node', 'error', 'args', 'result')
+
+    def __init__(self, ok, node=None, error=None, args=(), result=None):
+        self.ok = ok
+        self.node = node
+        self.error = error
+        self.args = args
+        self.result = result
+
+    def __bool__(self):
+        return self.ok
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        if self.ok:
+            return '<CommandStatus ok %r>' % (self.result, )
+        return '<CommandStatus %s%r>' % (self.error.__name__, self.args)
+
+    @property
+    def text(self):
+        """
+        Error message of the server (if any).
+        """
+        if self.node is not None and self.node.tag == 'error':
+            return self.node.text
+
+    def exception(self):
+        if self.error is not None:
+            return self.error(*self.args)
+
+    def raise_for_status(self):
+        if self.error is not None:
+            raise self.exception()
+
+
+class SnapshotError (Exception):
+    """
+    The data is not a valid (or supported) snapshot.
+    """
+
+
+#{ compact binary snapshots
+SNAPSHOT_MAGIC = b'WWSS'
+SNAPSHOT_VERSION = 1
+
+_SNAPSHOT_HEADER = struct.Struct('<4sBI')
+_UINT = struct.Struct('<I')
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+
+# smallest struct codes for integer columns (and string table indices)
+_INT_CODES = [('b', -2 ** 7, 2 ** 7 - 1), ('h', -2 ** 15, 2 ** 15 - 1),
+              ('i', -2 ** 31, 2 ** 31 - 1)]
+_INDEX_CODES = [('B', 0, 2 ** 8 - 1), ('H', 0, 2 ** 16 - 1),
+                ('I', 0, 2 ** 32 - 1)]
+
+
+def _smallest_code(values, codes):
+    low, high = min(values), max(values)
+    for code, min_, max_ in codes:
+        if low >= min_ and high <= max_:
+            return code
+    return None
+
+
+class _SnapshotWriter (object):
+
+    """
+    Encodes parsed API results (dicts, lists and scalars). Lists of flat dicts
+    like units or terrains are stored column by column, all strings end up in
+    a shared string table.
+    """
+
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+        self.parts = []
+
+    def string(self, value):
+        try:
+            return self.index[value]
+        except KeyError:
+            self.index[value] = idx = len(self.strings)
+            self.strings.append(value)
+            return idx
+
+    def value(self, val):
+        out = self.parts.append
+        if val is None:
+            out(b'N')
+        elif val is True:
+            out(b'T')
+        elif val is False:
+            out(b'F')
+        elif isinstance(val, _integer_types):
+            if -2 ** 63 <= val < 2 ** 63:
+                out(b'i' + _INT.pack(val))
+            else:  # beyond 64 bits: decimal digits in the string table
+                out(b'I' + _UINT.pack(self.string(str(val))))
+        elif isinstance(val, float):
+            out(b'f' + _FLOAT.pack(val))
+        elif isinstance(val, _string_types):
+            out(b's' + _UINT.pack(self.string(val)))
+        elif isinstance(val, dict):
+            out(b'd' + _UINT.pack(len(val)))
+            for key, item in val.items():
+                out(_UINT.pack(self.string(key)))
+                self.value(item)
+        elif isinstance(val, (list, tuple)):
+            if not self.records(val):
+                out(b'l' + _UINT.pack(len(val)))
+                for item in val:
+                    self.value(item)
+        else:
+            raise SnapshotError('Cannot store value %r' % (val, ))
+
+    def column(self, values):
+        """
+        Returns ``(kind, code, values)`` for a record column or ``None`` if
+        the values cannot be stored in a fixed width column.
+        """
+        if all(type(val) is bool for val in values):
+            return b'v', '?', values
+        if all(type(val) is int for val in values):
+            code = _smallest_code(values, _INT_CODES)
+            return (b'v', code, values) if code else None
+        if all(isinstance(val, _string_types) for val in values):
+            values = [self.string(val) for val in values]
+            return b's', _smallest_code(values, _INDEX_CODES), values
+        return None
+
+    def records(self, rows):
+        """
+        Stores a list of flat dicts as record array. Returns ``False`` if the
+        list is not suited for this.
+        """
+        if not rows or not all(isinstance(row, dict) for row in rows):
+            return False
+        keys = []
+        for row in rows:
+            keys.extend(key for key in row if key not in keys)
+        if not keys or len(keys) > 16:
+            # without columns the number of rows would be lost
+            return False
+        columns = []
+        for key in keys:
+            column = self.column([row[key] for row in rows if key in row])
+            if column is None:
+                return False
+            columns.append(column)
+
+        out = self.parts.append
+        out(b'r' + _UINT.pack(len(rows)) + struct.pack('<B', len(keys)))
+        masks = [sum(1 << bit for bit, key in enumerate(keys) if key in row)
+                 for row in rows]
+        full = (1 << len(keys)) - 1
+        if all(mask == full for mask in masks):
+            out(b'\x00')
+        else:
+            out(b'\x01' + struct.pack('<%dH' % len(masks), *masks))
+        for key, (kind, code, values) in zip(keys, columns):
+            if len(values) < len(rows):
+                # pad missing fields so that all columns have the same length
+                found = iter(values)
+                values = [next(found) if key in row else 0 for row in rows]
+            out(_UINT.pack(self.string(key)) + kind + code.encode('ascii'))
+            out(struct.pack('<%d%s' % (len(values), code), *values))
+        return True
+
+    def getvalue(self):
+        table = [_SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(self.strings))]
+        for string in self.strings:
+            data = _to_text(string).encode('utf-8')
+            table.append(_UINT.pack(len(data)) + data)
+        return b''.join(table + self.parts)
+
+
+class _SnapshotReader (object):
+
+    """
+    Decodes a snapshot straight from a buffer (bytes or mmap).
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        try:
+            magic, version, count = _SNAPSHOT_HEADER.unpack_from(buf, 0)
+        except struct.error:
+            raise SnapshotError('Truncated snapshot header.')
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError('Not a snapshot.')
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotError('Unsupported snapshot version %d.' % version)
+        self.pos = _SNAPSHOT_HEADER.size
+        self.strings = []
+        for _ in range(count):
+            size = self.uint()
+            self.strings.append(buf[self.pos:self.pos + size].decode('utf-8'))
+            self.pos += size
+
+    def uint(self):
+        val, = _UINT.unpack_from(self.buf, self.pos)
+        self.pos += _UINT.size
+        return val
+
+    def array(self, code, count):
+        fmt = struct.Struct('<%d%s' % (count, code))
+        values = fmt.unpack_from(self.buf, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def value(self):
+        tag = self.buf[self.pos:self.pos + 1]
+        self.pos += 1
+        if tag == b'N':
+            return None
+        elif tag == b'T':
+            return True
+        elif tag == b'F':
+            return False
+        elif tag == b'i':
+            val, = _INT.unpack_from(self.buf, self.pos)
+            self.pos += _INT.size
+            return val
+        elif tag == b'f':
+            val, = _FLOAT.unpack_from(self.buf, self.pos)
+            self.pos += _FLOAT.size
+            return val
+        elif tag == b's':
+            return self.strings[self.uint()]
+        elif tag == b'I':
+            return int(self.strings[self.uint()])
+        elif tag == b'd':
+            values = {}
+            for _ in range(self.uint()):
+                key = self.strings[self.uint()]
+                values[key] = self.value()
+            return values
+        elif tag == b'l':
+            return [self.value() for _ in range(self.uint())]
+        elif tag == b'r':
+            return self.records()
+        raise SnapshotError('Unknown tag %r at offset %d.' % (tag, self.pos - 1))
+
+    def records(self):
+        count = self.uint()
+        nkeys = ord(self.buf[self.pos:self.pos + 1])
+        has_masks = self.buf[self.pos + 1:self.pos + 2] == b'\x01'
+        self.pos += 2
+        masks = self.array('H', count) if has_masks else None
+        keys, columns = [], []
+        for _ in range(nkeys):
+            keys.append(self.strings[self.uint()])
+            kind = self.buf[self.pos:self.pos + 1]
+            code = self.buf[self.pos + 1:self.pos + 2].decode('ascii')
+            self.pos += 2
+            values = self.array(code, count)
+            if kind == b's':
+                values = [self.strings[idx] for idx in values]
+            columns.append(values)
+        if masks is None:
+            return [dict(zip(keys, values)) for values in zip(*columns)]
+        # rows sharing the same set of keys are built the same way
+        layouts = {}
+        rows = []
+        for mask, values in zip(masks, zip(*columns)):
+            try:
+                present, pick = layouts[mask]
+            except KeyError:
+                bits = [bit for bit in range(nkeys) if mask & (1 << bit)]
+                present = [keys[bit] for bit in bits]
+                if len(bits) > 1:
+                    pick = itemgetter(*bits)
+                else:
+                    pick = lambda values, bits=bits: [values[bit] for bit in bits]
+                layouts[mask] = present, pick
+            rows.append(dict(zip(present, pick(values))))
+        return rows
+
+
+def dumps_snapshot(values):
+    """
+    Serialises a parsed API result (e.g. the return value of
+    :meth:`ELIZA.game_state` or :meth:`ELIZA.map_layout`) into the compact
+    binary snapshot format. Like JSON, tuples are stored as lists and come
+    back as lists.
+
+    :rtype: bytes
+    """
+    writer = _SnapshotWriter()
+    writer.value(values)
+    return writer.getvalue()
+
+
+def loads_snapshot(data):
+    """
+    Restores a value serialised with :func:`dumps_snapshot`. ``data`` can be
+    a byte string or a memory map.
+    """
+    return _SnapshotReader(data).value()
+
+
+def write_snapshot(filename, values):
+    """
+    Writes snapshot of ``values`` to file.
+    """
+    with open(filename, 'wb') as fp:
+        fp.write(dumps_snapshot(values))
+
+
+def read_snapshot(filename):
+    """
+    Reads a snapshot file via a read-only memory map, so that the contents
+    are decoded without reading the whole file into memory first.
+    """
+    with open(filename, 'rb') as fp:
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return loads_snapshot(buf)
+        finally:
+            buf.close()
+
+
+#{ game history
+class GameHistory (object):
+
+    """
+    Append-only store of observed game states (as returned by
+    :meth:`ELIZA.game_state`) backed by SQLite.
+
+    Only the top-level fields which changed since the previous snapshot of
+    the same game are stored. Every :attr:`KEYFRAME_INTERVAL` snapshots a
+    complete state is written so that reading a round never has to replay
+    more than that many deltas::
+
+        >>> history = GameHistory('history.db')
+        >>> history.add(api.game_state(18682))
+        >>> for state in history.snapshots(18682):
+        ...     print state['round']
+
+    Snapshots are indexed by game, round and player.
+    """
+
+    KEYFRAME_INTERVAL = 20  #: store complete state every n snapshots
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS snapshots (
+            game INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            round INTEGER,
+            observed REAL NOT NULL,
+            keyframe INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (game, seq)
+        );
+        CREATE INDEX IF NOT EXISTS snapshots_round ON snapshots (game, round);
+        CREATE TABLE IF NOT EXISTS players (
+            player TEXT NOT NULL,
+            game INTEGER NOT NULL,
+            PRIMARY KEY (player, game)
+        );
+    '''
+
+    def __init__(self, filename):
+        """
+        Opens (or creates) history database.
+
+        :param filename: Path to SQLite database (or ``':memory:'``).
+        :type filename: str
+        """
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(self.SCHEMA)
+        self.lock = threading.Lock()
+        self._latest = {}  # game id -> (seq, state)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, state, observed=None):
+        """
+        Records a game state. Returns the sequence number of the snapshot
+        within its game.
+        """
+        return self.add_many([state], observed)[0]
+
+    def add_many(self, states, observed=None):
+        """
+        Records a number of game states in one transaction. This is a lot
+        faster than calling :meth:`add` for each of them.
+        """
+        if observed is None:
+            observed = time.time()
+        rows, players, seqs = [], set(), []
+        latest = {}  # game id -> (seq, state) of this batch
+        with self.lock:
+            for state in states:
+                game_id = state['id']
+                if game_id in latest:
+                    seq, previous = latest[game_id]
+                else:
+                    seq, previous = self._last_snapshot(game_id)
+                seq += 1
+                keyframe = previous is None or seq % self.KEYFRAME_INTERVAL == 0
+                if keyframe:
+                    data = state
+                else:
+                    data = {
+                        'set': dict((key, val) for key, val in state.items()
+                                    if previous.get(key, _MISSING) != val),
+                        'del': [key for key in previous if key not in state],
+                    }
+                encoded = dumps_snapshot(data)
+                rows.append((game_id, seq, state.get('round'), observed,
+                             int(keyframe), encoded))
+                players.update((name, game_id) for name in _player_names(state))
+                # keep the stored form, so later changes to the caller's
+                # state do not end up in the next delta
+                latest[game_id] = seq, self._apply(
+                    previous, keyframe, loads_snapshot(encoded))
+                seqs.append(seq)
+            with self.db:
+                self.db.executemany(
+                    'INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?)', rows)
+                self.db.executemany(
+                    'INSERT OR IGNORE INTO players VALUES (?, ?)', players)
+            self._latest.update(latest)
+        return seqs
+
+    @staticmethod
+    def _apply(state, keyframe, data):
+        """
+        Returns the state following ``state`` after a stored snapshot.
+        """
+        if keyframe:
+            return data
+        state = dict(state)
+        state.update(data['set'])
+        for key in data['del']:
+            del state[key]
+        return state
+
+    def _last_snapshot(self, game_id):
+        """
+        Returns ``(seq, state)`` of the latest snapshot of a game or
+        ``(0, None)`` if there is none.
+        """
+        try:
+            return self._latest[game_id]
+        except KeyError:
+            row = self.db.execute(
+                'SELECT MAX(seq) FROM snapshots WHERE game = ?',
+                (game_id, )).fetchone()
+            if row[0] is None:
+                return 0, None
+            for seq, _, state in self._replay(game_id, row[0], row[0]):
+                return seq, state
+
+    def _replay(self, game_id, first, last):
+        """
+        Yields ``(seq, observed, state)`` for snapshots ``first`` to ``last``
+        (inclusive) starting from the nearest preceding keyframe.
+        """
+        start, = self.db.execute(
+            'SELECT MAX(seq) FROM snapshots '
+            'WHERE game = ? AND seq <= ? AND keyframe = 1',
+            (game_id, first)).fetchone()
+        cursor = self.db.execute(
+            'SELECT seq, observed, keyframe, data FROM snapshots '
+            'WHERE game = ? AND seq BETWEEN ? AND ? ORDER BY seq',
+            (game_id, start, last))
+        state = None
+        for seq, observed, keyframe, data in cursor:
+            state = self._apply(state, keyframe, loads_snapshot(bytes(data)))
+            if seq >= first:
+                yield seq, observed, state
+
+    def snapshots(self, game_id, round=None):
+        """
+        Returns all recorded states of a game in the order they were observed
+        (optionally only those of a specific round).
+        """
+        query = 'SELECT MIN(seq), MAX(seq) FROM snapshots WHERE game = ?'
+        args = (game_id, )
+        if round is not None:
+            query += ' AND round = ?'
+            args += (round, )
+        with self.lock:
+            first, last = self.db.execute(query, args).fetchone()
+            if first is None:
+                return []
+            return [state for _, _, state in self._replay(game_id, first, last)
+                    if round is None or state.get('round') == round]
+
+    def latest(self, game_id):
+        """
+        Returns the most recently recorded state of a game (or ``None``).
+        """
+        with self.lock:
+            return self._last_snapshot(game_id)[1]
+
+    def rounds(self, game_id):
+        """
+        Returns the list of rounds recorded for a game.
+        """
+        with self.lock:
+            return [row[0] for row in self.db.execute(
+                'SELECT DISTINCT round FROM snapshots WHERE game = ? '
+                'ORDER BY round', (game_id, ))]
+
+    def games(self, player=None):
+        """
+        Returns the IDs of all recorded games (optionally only those of a
+        specific player).
+        """
+        with self.lock:
+            if player is None:
+                cursor = self.db.execute(
+                    'SELECT DISTINCT game FROM snapshots ORDER BY game')
+            else:
+                cursor = self.db.execute(
+                    'SELECT game FROM players WHERE player = ? ORDER BY game',
+                    (player, ))
+            return [row[0] for row in cursor]
+
+
+_MISSING = object()
+
+
+def _player_names(state):
+    """
+    Returns all player names found in a game state.
+    """
+    names = set(player['username'] for player in state.get('players', [])
+                if 'username' in player)
+    names.update(faction['playerName'] for faction in state.get('factions', [])
+                 if 'playerName' in faction)
+    return names
+
+
+#{ crawling
+class _IdSet (object):
+
+    """
+    Set of ids which stays small for long crawls: non-negative integer ids
+    (games, maps) are kept as bits in a :class:`bytearray`, all others (user
+    names) in a set.
+    """
+
+    MAX_BIT = 1 << 30  #: larger ids go into the set
+
+    def __init__(self, ids=()):
+        self.bits = bytearray()
+        self.other = set()
+        for id_ in ids:
+            self.add(id_)
+
+    def _bit(self, id_):
+        if (isinstance(id_, int) and not isinstance(id_, bool) and
+                0 <= id_ < self.MAX_BIT):
+            return id_ >> 3, 1 << (id_ & 7)
+        return None, None
+
+    def __contains__(self, id_):
+        byte, mask = self._bit(id_)
+        if byte is None:
+            return id_ in self.other
+        return byte < len(self.bits) and bool(self.bits[byte] & mask)
+
+    def add(self, id_):
+        byte, mask = self._bit(id_)
+        if byte is None:
+            self.other.add(id_)
+            return
+        if byte >= len(self.bits):
+            self.bits.extend(bytearray(max(byte + 1, 2 * len(self.bits)) -
+                                       len(self.bits)))
+        self.bits[byte] |= mask
+
+    def dump(self):
+        """
+        Returns a JSON-serialisable form (the bitmap is compressed).
+        """
+        bits = binascii.b2a_base64(zlib.compress(bytes(self.bits)))
+        return {'bits': bits.decode('ascii').strip(),
+                'ids': list(self.other)}
+
+    @classmethod
+    def load(cls, data):
+        """
+        Restores a set from :meth:`dump` or from a plain list of ids.
+        """
+        if isinstance(data, list):
+            return cls(data)
+        ids = cls(data['ids'])
+        ids.bits = bytearray(zlib.decompress(
+            binascii.a2b_base64(data['bits'].encode('ascii'))))
+        return ids
+
+
+class Crawler (object):
+
+    """
+    Crawls the graph of users, games and maps starting at
+    :meth:`ReadOnlyAPI.all_users`. Every user, game and map is fetched only
+    once and each result is written to ``output`` as one JSON line as soon as
+    it arrives::
+
+        >>> crawler = Crawler('crawl.jsonl', checkpoint='crawl.json')
+        >>> crawler.run()
+
+    All workers share one :class:`RateLimiter`. If a checkpoint file is
+    given, the state of the crawl is saved there regularly and an interrupted
+    crawl picks up where it left off. Results written after the last
+    checkpoint are not fetched again.
+
+    Seen game and map ids are kept as bitmaps, so memory and checkpoints stay
+    small; only user names are stored one by one.
+    """
+
+    USER, GAME, MAP = 'user', 'game', 'map'
+    CHECKPOINT_INTERVAL = 100  #: save checkpoint every n results
+
+    def __init__(self, output, checkpoint=None, workers=4, maps=True,
+                 limiter=None):
+        """
+        :param output: JSONL file results are appended to.
+        :param checkpoint: File to save the crawl state in.
+        :param workers: Number of worker threads.
+        :param maps: Also fetch the map layout of every game.
+        :param limiter: Rate limiter shared by all workers.
+        """
+        self.output = output
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.maps = maps
+        if limiter is None:
+            limiter = RateLimiter(ReadOnlyAPI.REQUESTS_PER_SECOND)
+        self.limiter = limiter
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.seen = dict((kind, _IdSet())
+                         for kind in (self.USER, self.GAME, self.MAP))
+        self.pending = set()  # queued or in flight, saved in checkpoints
+        self.done = 0
+        self.written = 0  # size of output, saved in checkpoints
+
+    def api(self):
+        api = ELIZA(limiter=self.limiter)
+        api.priority = PRIORITY_CRAWL
+        return api
+
+    def enqueue(self, kind, id_):
+        """
+        Adds item to queue unless it has been seen before.
+        """
+        with self.lock:
+            if id_ in self.seen[kind]:
+                return
+            self.seen[kind].add(id_)
+            self.pending.add((kind, id_))
+        self.queue.put((kind, id_))
+
+    def run(self):
+        """
+        Runs crawl until all reachable users, games and maps are fetched.
+        """
+        resumed = self.load_checkpoint()
+        if os.path.exists(self.output):
+            self.written = os.path.getsize(self.output)
+        with open(self.output, 'a') as self._out:
+            if not resumed:
+                for user in self.api().all_users():
+                    self.enqueue(self.USER, user['name'])
+            threads = [threading.Thread(target=self._work)
+                       for _ in range(self.workers)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            self.queue.join()
+            for thread in threads:
+                self.queue.put(None)
+            for thread in threads:
+                thread.join()
+        self.save_checkpoint()
+
+    def _work(self):
+        api = self.api()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            try:
+                self.fetch(api, *item)
+            finally:
+                with self.lock:
+                    self.done += 1
+                    save = self.done % self.CHECKPOINT_INTERVAL == 0
+                if save:
+                    self.save_checkpoint()
+                self.queue.task_done()
+
+    def fetch(self, api, kind, id_):
+        """
+        Fetches a single item, writes it to the output and queues everything
+        it refers to.
+        """
+        try:
+            if kind == self.USER:
+                data = api.user(id_)
+            elif kind == self.GAME:
+                data = api.game(id_)
+            else:
+                data = api.map_layout(id_)
+            self.follow(kind, data)
+            record = {'kind': kind, 'id': id_, 'data': data}
+        except Exception as e:
+            record = {'kind': kind, 'id': id_,
+                      'error': '%s: %s' % (type(e).__name__, e)}
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            self._out.write(line)
+            self._out.flush()
+            self.written += len(line)
+            self.pending.discard((kind, id_))
+
+    def follow(self, kind, data):
+        """
+        Queues everything a fetched item refers to.
+        """
+        if kind == self.USER:
+            for game in data['games']:
+                self.enqueue(self.GAME, game['id'])
+        elif kind == self.GAME:
+            for player in data['players']:
+                self.enqueue(self.USER, player['username'])
+            if self.maps and 'map' in data:
+                self.enqueue(self.MAP, data['map'])
+
+    def save_checkpoint(self):
+        """
+        Saves seen and pending items and the size of the output to the
+        checkpoint file.
+        """
+        if self.checkpoint is None:
+            return
+        with self.lock:
+            state = {
+                'seen': dict((kind, ids.dump())
+                             for kind, ids in self.seen.items()),
+                'pending': [list(item) for item in self.pending],
+                'written': self.written,
+            }
+            tmp = self.checkpoint + '.tmp'
+            with open(tmp, 'w') as fp:
+                json.dump(state, fp)
+            os.rename(tmp, self.checkpoint)
+
+    def load_checkpoint(self):
+        """
+        Restores state from checkpoint file. Returns ``True`` if there was
+        one.
+        """
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return False
+        with open(self.checkpoint) as fp:
+            state = json.load(fp)
+        for kind, ids in state['seen'].items():
+            self.seen[kind] = _IdSet.load(ids)
+        records = self._written_since(state.get('written', 0))
+        for record in records:
+            self.seen[record['kind']].add(record['id'])
+        done = set((record['kind'], record['id']) for record in records)
+        for kind, id_ in state['pending']:
+            if (kind, id_) not in done:
+                self.pending.add((kind, id_))
+                self.queue.put((kind, id_))
+        for record in records:
+            if 'data' in record:
+                self.follow(record['kind'], record['data'])
+        return True
+
+    def _written_since(self, offset):
+        """
+        Returns the results written to the output after ``offset``. An
+        incomplete last line (of an interrupted write) is cut off.
+        """
+        if not os.path.exists(self.output):
+            return []
+        records = []
+        with open(self.output, 'rb+') as fp:
+            fp.seek(offset)
+            end = offset
+            for line in iter(fp.readline, b''):
+                if not line.endswith(b'\n'):
+                    break
+                end += len(line)
+                records.append(json.loads(line.decode('utf-8')))
+            fp.truncate(end)
+        return records
+
+
+#{ columnar statistics
+class GameColumns (object):
+
+    """
+    Column store for units, terrains and factions of many game states (as
+    returned by :meth:`ELIZA.game_state`). Each column is an :mod:`array`;
+    strings (unit and terrain types, player names) are stored as indices into
+    :attr:`strings`::
+
+        >>> columns = GameColumns.from_states(history.snapshots(18682))
+        >>> columns.unit_counts()
+        {('eviltwin', 'Trooper'): 40, ...}
+
+    Aggregations use NumPy if it is installed and fall back to plain Python
+    otherwise.
+    """
+
+    TABLES = {
+        'units': ('game', 'round', 'player', 'type', 'x', 'y', 'quantity',
+                  'finished'),
+        'terrains': ('game', 'round', 'player', 'type', 'x', 'y'),
+        'factions': ('game', 'round', 'player', 'credits'),
+    }
+    STRING_FIELDS = ('player', 'type')
+
+    def __init__(self):
+        self.strings = []
+        self._index = {}
+        self.tables = dict(
+            (table, dict((field, array('i')) for field in fields))
+            for table, fields in self.TABLES.items())
+
+    @classmethod
+    def from_states(cls, states):
+        columns = cls()
+        for state in states:
+            columns.add(state)
+        return columns
+
+    def __len__(self):
+        return len(self.tables['factions']['game'])
+
+    def string(self, value):
+        try:
+            return self._index[value]
+        except KeyError:
+            self._index[value] = idx = len(self.strings)
+            self.strings.append(value)
+            return idx
+
+    def add(self, state):
+        """
+        Appends units, terrains and factions of a game state. Credits are
+        only known for your own faction and stored as -1 otherwise.
+        """
+        game, round = state.get('id', -1), state.get('round', -1)
+        units, terrains = self.tables['units'], self.tables['terrains']
+        factions = self.tables['factions']
+        for faction in state.get('factions', []):
+            player = self.string(faction.get('playerName'))
+            for field, val in (('game', game), ('round', round),
+                               ('player', player),
+                               ('credits', faction.get('credits', -1))):
+                factions[field].append(val)
+            for unit in faction.get('units', []):
+                for field, val in (
+                        ('game', game), ('round', round), ('player', player),
+                        ('type', self.string(unit.get('type'))),
+                        ('x', unit['x']), ('y', unit['y']),
+                        ('quantity', unit.get('quantity', 0)),
+                        ('finished', int(unit.get('finished', False)))):
+                    units[field].append(val)
+            for terrain in faction.get('terrain', []):
+                for field, val in (
+                        ('game', game), ('round', round), ('player', player),
+                        ('type', self.string(terrain.get('type'))),
+                        ('x', terrain['x']), ('y', terrain['y'])):
+                    terrains[field].append(val)
+
+    def to_numpy(self, table):
+        """
+        Returns a table as NumPy structured array.
+        """
+        import numpy
+        columns = self.tables[table]
+        fields = self.TABLES[table]
+        size = len(columns[fields[0]])
+        result = numpy.zeros(size, dtype=[(field, 'i4') for field in fields])
+        for field in fields:
+            result[field] = numpy.frombuffer(
+                columns[field], dtype='i%d' % columns[field].itemsize)
+        return result
+
+    def group_sum(self, table, by, value=None, where=None):
+        """
+        Sums up column ``value`` (or counts rows if omitted) grouped by the
+        fields in ``by``. ``where`` can restrict rows to specific field
+        values, e.g. ``{'type': 'Base'}``.
+
+        :rtype: {tuple: int}
+        """
+        columns = self.tables[table]
+        keys = [columns[field] for field in by]
+        weights = columns[value] if value is not None else None
+        conditions = []
+        for field, val in (where or {}).items():
+            if field in self.STRING_FIELDS:
+                if val not in self._index:
+                    return {}
+                val = self._index[val]
+            conditions.append((columns[field], val))
+        numpy = _numpy()
+        if numpy is not None:
+            sums = self._group_sum_numpy(numpy, keys, weights, conditions)
+        else:
+            sums = self._group_sum_python(keys, weights, conditions)
+        decode = [field in self.STRING_FIELDS for field in by]
+        return dict(
+            (tuple(self.strings[k] if string else k
+                   for k, string in zip(key, decode)), total)
+            for key, total in sums)
+
+    @staticmethod
+    def _group_sum_numpy(numpy, keys, weights, conditions):
+        as_array = lambda col: numpy.frombuffer(
+            col, dtype='i%d' % col.itemsize)
+        mask = numpy.ones(len(keys[0]), dtype=bool)
+        for col, val in conditions:
+            mask &= as_array(col) == val
+        keys = [as_array(col)[mask].astype(numpy.int64) for col in keys]
+        if not len(keys[0]):
+            return []
+        # combine key columns into one integer per row (mixed radix) so
+        # that grouping is a plain one-dimensional unique
+        lows = [int(col.min()) for col in keys]
+        sizes = [int(col.max()) - low + 1 for col, low in zip(keys, lows)]
+        combined = numpy.zeros(len(keys[0]), dtype=numpy.int64)
+        for col, low, size in zip(keys, lows, sizes):
+            combined = combined * size + (col - low)
+        groups, inverse = numpy.unique(combined, return_inverse=True)
+        if weights is not None:
+            weights = as_array(weights)[mask]
+        totals = numpy.bincount(inverse.ravel(), weights, len(groups))
+        decoded = []
+        for size, low in reversed(list(zip(sizes, lows))):
+            decoded.append((groups % size + low).tolist())
+            groups = groups // size
+        return zip(zip(*reversed(decoded)),
+                   [int(total) for total in totals.tolist()])
+
+    @staticmethod
+    def _group_sum_python(keys, weights, conditions):
+        if weights is None:
+            weights = repeat(1)
+        sums = {}
+        for row, (key, weight) in enumerate(zip(zip(*keys), weights)):
+            if all(col[row] == val for col, val in conditions):
+                sums[key] = sums.get(key, 0) + weight
+        return sums.items()
+
+    def unit_counts(self, by_quantity=True):
+        """
+        Returns number of units (or sum of their quantities) per player and
+        unit type.
+
+        :rtype: {(player, type): int}
+        """
+        return self.group_sum('units', ('player', 'type'),
+                              'quantity' if by_quantity else None)
+
+    def base_share(self):
+        """
+        Returns the share of bases each player owned per game and round.
+
+        :rtype: {(game, round): {player: float}}
+        """
+        counts = self.group_sum('terrains', ('game', 'round', 'player'),
+                                where={'type': 'Base'})
+        totals = {}
+        for (game, round, _), count in counts.items():
+            totals[game, round] = totals.get((game, round), 0) + count
+        shares = {}
+        for (game, round, player), count in counts.items():
+            shares.setdefault((game, round), {})[player] = (
+                float(count) / totals[game, round])
+        return shares
+
+    def credits(self):
+        """
+        Returns credits per game and player over rounds (only for factions
+        where they are known).
+
+        :rtype: {(game, player): [(round, credits), ...]}
+        """
+        factions = self.tables['factions']
+        result = {}
+        for game, round, player, credits in zip(
+                factions['game'], factions['round'], factions['player'],
+                factions['credits']):
+            if credits >= 0:
+                result.setdefault((game, self.strings[player]), []).append(
+                    (round, credits))
+        for series in result.values():
+            series.sort()
+        return result
+
+
+def _numpy():
+    """
+    Returns the numpy module if it is available.
+    """
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+#{ multiplexing
+class CommandMultiplexer (object):
+
+    """
+    Sends ELIZA commands for many games at once. Commands for the same game
+    are executed strictly in the order they were submitted, while games take
+    turns in round-robin order so that a game with many (or slow) commands
+    does not hold up the others. All requests go through the rate limiter
+    of ``api``::
+
+        >>> with CommandMultiplexer(ELIZA('ai_bot', '...')) as mux:
+        ...     turns = [mux.submit_turn(game_id, [
+        ...         ('move', (1, 2), (3, 4)),
+        ...         ('finish_turn', ),
+        ...     ]) for game_id in games]
+        ...     results = [turn.result() for turn in turns]
+
+    A command is the name of an :class:`ELIZA` method followed by its
+    arguments (without the game id).
+    """
+
+    def __init__(self, api, workers=4):
+        self.api = api
+        self.lock = threading.Condition()
+        self.pending = {}  # game id -> deque of (future, method, args)
+        self.ready = deque()  # games waiting for a worker
+        self.scheduled = set()  # games either ready or being worked on
+        self.closed = False
+        self.threads = [threading.Thread(target=self._work)
+                        for _ in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def submit(self, game_id, method, *args):
+        """
+        Queues a single command. Returns a :class:`concurrent.futures.Future`
+        for its result.
+        """
+        future = futures.Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('Multiplexer has been shut down.')
+            self.pending.setdefault(game_id, deque()).append(
+                (future, method, args))
+            if game_id not in self.scheduled:
+                self.scheduled.add(game_id)
+                self.ready.append(game_id)
+                self.lock.notify()
+        return future
+
+    def submit_turn(self, game_id, commands):
+        """
+        Queues a sequence of commands for one game. Returns a future for the
+        list of their results. If a command fails, the remaining commands
+        are cancelled and the future raises the exception.
+        """
+        turn = futures.Future()
+        parts = [self.submit(game_id, *command) for command in commands]
+        if not parts:
+            turn.set_result([])
+            return turn
+        remaining = [len(parts)]
+        lock = threading.RLock()  # cancelling runs callbacks in this thread
+
+        def _done(part):
+            with lock:
+                if turn.done():
+                    return
+                if part.cancelled() or part.exception() is not None:
+                    turn.set_exception(
+                        part.exception() if not part.cancelled()
+                        else futures.CancelledError())
+                    for other in parts:
+                        other.cancel()
+                    return
+                remaining[0] -= 1
+                if not remaining[0]:
+                    turn.set_result([p.result() for p in parts])
+
+        for part in parts:
+            part.add_done_callback(_done)
+        return turn
+
+    def _work(self):
+        while True:
+            with self.lock:
+                while not self.ready and not self.closed:
+                    self.lock.wait()
+                if not self.ready:
+                    return
+                game_id = self.ready.popleft()
+                future, method, args = self.pending[game_id].popleft()
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = getattr(self.api, method)(game_id, *args)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            with self.lock:
+                if self.pending[game_id]:
+                    # back of the line so that other games get their turn
+                    self.ready.append(game_id)
+                    self.lock.notify()
+                else:
+                    del self.pending[game_id]
+                    self.scheduled.discard(game_id)
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting commands. Commands already queued are still sent.
+        """
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+
+#{ caching
+class MemoryCache (object):
+
+    """
+    Simple in-process cache for API results (see ``cache`` argument of
+    :class:`ReadOnlyAPI`). Keys are strings, values are byte strings. Once
+    ``size`` entries are stored, the least recently used one is dropped.
+    """
+
+    def __init__(self, size=10000):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expires, value), LRU first
+
+    def get(self, key):
+        with self.lock:
+            expires, value = self.entries.get(key, (0, None))
+            if expires < time.time():
+                self.entries.pop(key, None)
+                return None
+            self._touch(key)
+            return value
+
+    def _touch(self, key):
+        try:
+            self.entries.move_to_end(key)
+        except AttributeError:  # Python 2
+            self.entries[key] = self.entries.pop(key)
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            if key in self.entries:
+                self._touch(key)
+            elif len(self.entries) >= self.size:
+                self.entries.popitem(last=False)
+            self.entries[key] = (time.time() + ttl, value)
+
+
+# cache protocol: request = header + key + value, response = header + value
+_CACHE_REQUEST = struct.Struct('<cIId')  # op, key size, value size, ttl
+_CACHE_RESPONSE = struct.Struct('<cI')  # status, value size
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError('Connection closed.')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _remove_socket(path):
+    """
+    Removes a Unix socket left behind at ``path``. Other files are left
+    alone (binding to their path fails).
+    """
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except OSError:  # not there
+        pass
+
+
+class CacheServer (object):
+
+    """
+    Cache daemon listening on a Unix socket, so that several processes on
+    one host share the API results fetched by any of them::
+
+        $ python -c "import weewar; weewar.CacheServer('/tmp/weewar.sock').serve_forever()"
+
+    Use :class:`SocketCache` to connect to it.
+    """
+
+    def __init__(self, path, cache=None):
+        self.path = path
+        self.cache = cache if cache is not None else MemoryCache()
+        self.server = None
+
+    def handle(self, sock):
+        """
+        Answers requests on one connection until it is closed.
+        """
+        while True:
+            try:
+                if not self._answer(sock):
+                    return
+            except (EOFError, UnicodeDecodeError, socket.error):
+                return
+
+    def _answer(self, sock):
+        """
+        Answers one request. Returns ``False`` for unknown requests.
+        """
+        header = _recv_exactly(sock, _CACHE_REQUEST.size)
+        op, key_size, value_size, ttl = _CACHE_REQUEST.unpack(header)
+        key = _recv_exactly(sock, key_size).decode('utf-8')
+        value = _recv_exactly(sock, value_size)
+        if op == b'g':
+            value = self.cache.get(key)
+            if value is None:
+                sock.sendall(_CACHE_RESPONSE.pack(b'm', 0))
+            else:
+                sock.sendall(_CACHE_RESPONSE.pack(b'h', len(value)) + value)
+        elif op == b's':
+            self.cache.set(key, value, ttl)
+            sock.sendall(_CACHE_RESPONSE.pack(b'k', 0))
+        else:
+            return False
+        return True
+
+    def serve_forever(self):
+        try:
+            import socketserver
+        except ImportError: # Python 2
+            import SocketServer as socketserver
+        cache_server = self
+
+        class Handler (socketserver.BaseRequestHandler):
+            def handle(self):
+                cache_server.handle(self.request)
+
+        _remove_socket(self.path)
+        self.server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self.server.daemon_threads = True
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.unlink(self.path)
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class SocketCache (object):
+
+    """
+    Client for :class:`CacheServer`. Each thread uses its own connection. If
+    the daemon cannot be reached, every lookup is a miss and API calls go to
+    the server as usual.
+    """
+
+    RETRY_INTERVAL = 10.0  #: seconds to wait before reconnecting
+
+    def __init__(self, path, timeout=1.0):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+        self.down_since = None
+
+    def _request(self, op, key, value=b'', ttl=0.0):
+        if (self.down_since is not None and
+                _clock() - self.down_since < self.RETRY_INTERVAL):
+            return None, None
+        sock = getattr(self.local, 'sock', None)
+        try:
+            if sock is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+                self.local.sock = sock
+            key = key.encode('utf-8')
+            sock.sendall(_CACHE_REQUEST.pack(op, len(key), len(value), ttl) +
+                         key + value)
+            status, size = _CACHE_RESPONSE.unpack(
+                _recv_exactly(sock, _CACHE_RESPONSE.size))
+            self.down_since = None
+            return status, _recv_exactly(sock, size)
+        except (EOFError, socket.error):
+            if sock is not None:
+                sock.close()
+            self.local.sock = None
+            self.down_since = _clock()
+            return None, None
+
+    def get(self, key):
+        status, value = self._request(b'g', key)
+        return value if status == b'h' else None
+
+    def set(self, key, value, ttl):
+        self._request(b's', key, value, ttl)
+
+
+#{ watching headquarters
+_STOPPED = object()  # ends the iterator of HeadquarterWatcher.events()
+
+
+class HeadquarterWatcher (object):
+
+    """
+    Polls :meth:`ReadOnlyAPI.headquarter` in the background and reports
+    changes as events. Polling speeds up to ``min_interval`` while things
+    happen and slows down to ``max_interval`` while nothing changes.
+
+    Events are dicts with ``type`` (one of the ``EVENT_*`` values), ``game``
+    (the game id), ``data`` (the current game entry) and ``previous`` (the
+    entry before the change, if any). They can be received as callbacks, from
+    a thread-safe queue or with ``async for``::
+
+        >>> watcher = HeadquarterWatcher(ReadOnlyAPI('eviltwin', '...'))
+        >>> events = watcher.queue()
+        >>> watcher.start()
+        >>> event = events.get()
+        >>> if event['type'] == HeadquarterWatcher.EVENT_ATTENTION:
+        ...     play(event['game'])
+
+    Headquarter entries do not tell the round of a game. With
+    ``rounds=True`` the game state is fetched whenever a running game comes
+    to need attention (which happens once a round) and
+    :data:`EVENT_ROUND` is reported with the new ``round`` if it advanced.
+    """
+
+    EVENT_ATTENTION = 'attention'  #: game needs attention
+    EVENT_INVITATION = 'invitation'  #: invited to a new game
+    EVENT_FINISHED = 'finished'  #: game has finished
+    EVENT_ROUND = 'round'  #: game advanced to the next round
+
+    def __init__(self, api, min_interval=10.0, max_interval=300.0,
+                 backoff=1.5, rounds=False):
+        self.api = api
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.rounds = rounds
+        self.interval = min_interval
+        self.games = None  # game id -> entry of last poll
+        self.known_rounds = {}  # game id -> round of last game state
+        self.callbacks = []
+        self.closers = []  # called when the watcher stops
+        self.errors = 0  # exceptions raised by callbacks
+        self.last_error = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def subscribe(self, callback):
+        """
+        Calls ``callback(event)`` for each event (from the polling thread).
+        Exceptions raised by callbacks are counted in :attr:`errors` and do
+        not keep other callbacks from receiving the event.
+        """
+        with self.lock:
+            self.callbacks.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.callbacks.remove(callback)
+
+    def queue(self):
+        """
+        Returns a :class:`queue.Queue` which receives all events. ``None`` is
+        put into it when the watcher stops.
+        """
+        events = queue.Queue()
+        self.subscribe(events.put)
+        with self.lock:
+            self.closers.append(lambda: events.put(None))
+        return events
+
+    def events(self):
+        """
+        Returns an asynchronous iterator over events for use in a coroutine
+        (``async for event in watcher.events()``). It ends when the watcher
+        stops. Needs Python 3.5 or later; use :meth:`queue` or
+        :meth:`subscribe` on older versions.
+        """
+        if not _ASYNC_ITERATION:
+            raise RuntimeError('async for needs Python 3.5 or later.')
+        return _AsyncEvents(self)
+
+    def _emit(self, event):
+        with self.lock:
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+
+    def diff(self, games):
+        """
+        Returns the events between the last poll and ``games``.
+        """
+        events = []
+        current = dict((game['id'], game) for game in games)
+        previous = self.games if self.games is not None else {}
+        for id_, game in current.items():
+            old = previous.get(id_, {})
+            _event = lambda type_: events.append(
+                {'type': type_, 'game': id_, 'data': game,
+                 'previous': old or None})
+            if (game.get('factionState') == 'invited' and
+                    old.get('factionState') != 'invited'):
+                _event(self.EVENT_INVITATION)
+            if game.get('inNeedOfAttention') and not old.get('inNeedOfAttention'):
+                _event(self.EVENT_ATTENTION)
+            if game.get('state') == 'finished' and old and \
+                    old.get('state') != 'finished':
+                _event(self.EVENT_FINISHED)
+        return events
+
+    def _round_events(self, events, rounds):
+        """
+        Fetches the game states of running games which came to need
+        attention. New rounds are stored in ``rounds``.
+        """
+        found = []
+        for event in events:
+            game = event['data']
+            if (event['type'] != self.EVENT_ATTENTION or
+                    game.get('state', 'running') != 'running'):
+                continue
+            round_ = self.api.game_state(event['game']).get('round')
+            known = self.known_rounds.get(event['game'])
+            rounds[event['game']] = round_
+            if known is not None and round_ is not None and round_ > known:
+                found.append({'type': self.EVENT_ROUND, 'game': event['game'],
+                              'data': game, 'previous': event['previous'],
+                              'round': round_})
+        return found
+
+    def poll(self):
+        """
+        Fetches headquarters once, emits events and adjusts the polling
+        interval. Returns the events. The state of this poll is only kept
+        once all events were handed out, so if fetching fails, the events
+        are reported again by the next poll.
+        """
+        games = self.api.headquarter()['games']
+        events = self.diff(games)
+        rounds = {}
+        if self.rounds:
+            events.extend(self._round_events(events, rounds))
+        for event in events:
+            self._emit(event)
+        self.games = dict((game['id'], game) for game in games)
+        self.known_rounds.update(rounds)
+        if events:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return events
+
+    def run(self):
+        """
+        Polls until :meth:`stop` is called. Errors are retried at the
+        slowest interval.
+        """
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+            except Exception:
+                self.interval = self.max_interval
+            self.stopped.wait(self.interval)
+        with self.lock:
+            closers = list(self.closers)
+        for closer in closers:
+            closer()
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, wait=True):
+        self.stopped.set()
+        if wait and self.thread is not None:
+            self.thread.join()
+
+
+_ASYNC_ITERATION = sys.version_info >= (3, 5)
+
+
+class _AsyncEvents (object):
+
+    """
+    Asynchronous iterator over the events of a :class:`HeadquarterWatcher`.
+    Events are buffered from creation on; the event loop is the one running
+    when the first event is awaited.
+    """
+
+    def __init__(self, watcher):
+        self.lock = threading.Lock()
+        self.loop = None
+        self.buffer = deque()
+        self.waiter = None
+        self.watcher = watcher
+        watcher.subscribe(self._put)
+        with watcher.lock:
+            watcher.closers.append(self._close)
+
+    def _put(self, event):
+        # called from the polling thread
+        with self.lock:
+            if self.loop is None:
+                self.buffer.append(event)
+                return
+            loop = self.loop
+        loop.call_soon_threadsafe(self._push, event)
+
+    def _close(self):
+        self._put(_STOPPED)
+
+    def _push(self, event):
+        if self.waiter is not None and not self.waiter.done():
+            self._deliver(self.waiter, event)
+            self.waiter = None
+        else:
+            self.buffer.append(event)
+
+    def _deliver(self, future, event):
+        if event is _STOPPED:
+            self.watcher.unsubscribe(self._put)
+            with self.watcher.lock:
+                self.watcher.closers.remove(self._close)
+            future.set_exception(StopAsyncIteration())
+        else:
+            future.set_result(event)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        import asyncio
+        if self.loop is None:
+            # get_running_loop is new in Python 3.7
+            get_loop = getattr(asyncio, 'get_running_loop',
+                               asyncio.get_event_loop)
+            with self.lock:
+                self.loop = get_loop()
+        future = asyncio.Future(loop=self.loop)
+        if self.buffer:
+            self._deliver(future, self.buffer.popleft())
+        else:
+            self.waiter = future
+        return future
+
+
+#{ hex grids
+#: Neighbour offsets in "odd-r" coordinates (odd rows are shifted right) for
+#: even and odd rows.
+HEX_DIRECTIONS = (
+    ((1, 0), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1)),
+    ((1, 0), (1, -1), (0, -1), (-1, 0), (0, 1), (1, 1)),
+)
+
+#: Distance stored for fields which cannot be reached.
+UNREACHABLE = 0xffff
+
+
+def hex_distance(a, b):
+    """
+    Number of steps between fields ``a`` and ``b`` (as ``(x, y)``) on an
+    unobstructed hex grid.
+    """
+    (x1, y1), (x2, y2) = a, b
+    q1, q2 = x1 - (y1 - (y1 & 1)) // 2, x2 - (y2 - (y2 & 1)) // 2
+    dq, dr = q1 - q2, y1 - y2
+    return (abs(dq) + abs(dr) + abs(dq + dr)) // 2
+
+
+class HexGrid (object):
+
+    """
+    Adjacency and distance tables for the fields of a map. Fields are
+    numbered (see :meth:`index`), neighbours are stored in compressed sparse
+    row form (the neighbours of field ``i`` are
+    ``neighbours[offsets[i]:offsets[i + 1]]``) and distances (in steps,
+    avoiding holes in the map) are computed by breadth-first search the first
+    time a field is asked for::
+
+        >>> grid = HexGrid.from_layout(api.map_layout(8))
+        >>> grid.distance((3, 8), (12, 2))
+        12
+        >>> grid.neighbours_of((3, 8))
+        [(4, 8), (3, 7), (2, 7), (2, 8), (2, 9), (3, 9)]
+
+    Use :func:`map_grid` to share grids between callers.
+    """
+
+    def __init__(self, width, height, fields=None):
+        self.width = width
+        self.height = height
+        if fields is None:
+            fields = [(x, y) for y in range(height) for x in range(width)]
+        self.fields = sorted(set(fields), key=lambda f: (f[1], f[0]))
+        #: field index for each position (-1 for holes), row by row
+        self.lookup = array('i', repeat(-1, width * height))
+        for i, (x, y) in enumerate(self.fields):
+            self.lookup[y * width + x] = i
+        self.offsets = array('i', [0])
+        self.neighbours = array('i')
+        for x, y in self.fields:
+            for dx, dy in HEX_DIRECTIONS[y & 1]:
+                j = self.index((x + dx, y + dy))
+                if j >= 0:
+                    self.neighbours.append(j)
+            self.offsets.append(len(self.neighbours))
+        self._rows = [None] * len(self.fields)
+
+    @classmethod
+    def from_layout(cls, layout):
+        """
+        Grid for a map as returned by :meth:`ELIZA.map_layout`.
+        """
+        return cls(layout['width'], layout['height'],
+                   [(t['x'], t['y']) for t in layout['terrains']])
+
+    def __len__(self):
+        return len(self.fields)
+
+    def index(self, position):
+        """
+        Index of field at ``(x, y)`` or ``-1`` if there is none.
+        """
+        x, y = position
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.lookup[y * self.width + x]
+        return -1
+
+    def neighbours_of(self, position):
+        i = self.index(position)
+        if i < 0:
+            return []
+        return [self.fields[j] for j in
+                self.neighbours[self.offsets[i]:self.offsets[i + 1]]]
+
+    def row(self, i):
+        """
+        Distances from field ``i`` to all fields (as an ``array('H')``).
+        """
+        row = self._rows[i]
+        if row is None:
+            row = array('H', repeat(UNREACHABLE, len(self.fields)))
+            offsets, neighbours = self.offsets, self.neighbours
+            row[i] = 0
+            frontier = [i]
+            step = 0
+            while frontier:
+                step += 1
+                next_frontier = []
+                for k in frontier:
+                    for j in neighbours[offsets[k]:offsets[k + 1]]:
+                        if row[j] == UNREACHABLE:
+                            row[j] = step
+                            next_frontier.append(j)
+                frontier = next_frontier
+            self._rows[i] = row
+        return row
+
+    def distance(self, a, b):
+        """
+        Steps from field ``a`` to field ``b`` (as ``(x, y)``) or
+        :data:`UNREACHABLE`.
+        """
+        i, j = self.index(a), self.index(b)
+        if i < 0 or j < 0:
+            return UNREACHABLE
+        return self.row(i)[j]
+
+    def distances(self):
+        """
+        Computes the distances between all fields. Returns them as a flat
+        ``array('H')`` (distance from ``i`` to ``j`` at ``i * len(grid) + j``).
+        """
+        table = array('H')
+        for i in range(len(self.fields)):
+            table.extend(self.row(i))
+        return table
+
+    def within(self, position, steps):
+        """
+        Fields reachable from ``position`` in at most ``steps`` steps.
+        """
+        i = self.index(position)
+        if i < 0:
+            return []
+        row = self.row(i)
+        return [self.fields[j] for j, d in enumerate(row) if d <= steps]
+
+
+_grids = OrderedDict()  # (map id, revision) -> HexGrid, LRU first
+_grids_lock = threading.Lock()
+MAX_GRIDS = 64  #: grids kept by :func:`map_grid`
+
+
+def map_grid(layout):
+    """
+    Returns the :class:`HexGrid` for a map layout. Grids are built once per
+    map id and revision and shared afterwards (the :data:`MAX_GRIDS` most
+    recently used ones). Layouts without id are not cached.
+    """
+    if layout.get('id') is None:
+        return HexGrid.from_layout(layout)
+    key = (layout['id'], layout.get('revision'))
+    with _grids_lock:
+        grid = _grids.pop(key, None)
+        if grid is not None:
+            _grids[key] = grid  # most recently used
+    if grid is None:
+        grid = HexGrid.from_layout(layout)
+        with _grids_lock:
+            grid = _grids.setdefault(key, grid)
+            while len(_grids) > MAX_GRIDS:
+                _grids.popitem(last=False)
+    return grid
+
+
+#{ influence maps
+def _search_moves(grid, terrain, units, i, mobility, kind):
+    """
+    Cost-limited search for the moves of the unit on field ``i``. ``terrain``
+    holds the terrain type and ``units`` the unit (a sequence starting with
+    its owner) of each field index. Returns the movement points needed for
+    each field reached (including those occupied by own units) and the set of
+    all fields looked at.
+    """
+    player = units[i][0]
+    costs = MOVEMENT_COSTS.get(kind, {None: None})
+    default = costs.get(None)
+    offsets, neighbours = grid.offsets, grid.neighbours
+    spent = {i: 0}
+    heap = [(0, i)]
+    touched = set([i])
+    while heap:
+        points, k = heapq.heappop(heap)
+        if points > spent[k]:
+            continue
+        for j in neighbours[offsets[k]:offsets[k + 1]]:
+            touched.add(j)
+            occupant = units.get(j)
+            if occupant is not None and occupant[0] != player:
+                continue
+            cost = costs.get(terrain[j], default)
+            if cost is None or points + cost > mobility:
+                continue
+            if points + cost < spent.get(j, mobility + 1):
+                spent[j] = points + cost
+                heapq.heappush(heap, (points + cost, j))
+    return spent, touched
+
+
+class InfluenceMap (object):
+
+    """
+    Which fields each player's units can reach and attack next turn, computed
+    from a game state and the map layout using :data:`UNIT_STATS` and
+    :data:`MOVEMENT_COSTS`. Units move around enemy units (but through their
+    own) and may attack from any field they can stop on, except for
+    :data:`STATIONARY_ATTACKERS` which only attack from where they stand::
+
+        >>> imap = InfluenceMap(api.game_state(18682), api.map_layout(8))
+        >>> if not imap.danger((4, 7), 'eviltwin'):
+        ...     api.move(18682, (3, 8), (4, 7))
+        ...     imap.move((3, 8), (4, 7))
+
+    For every player :attr:`threat` holds the summed quantity of units which
+    can attack a field and :attr:`reach` the number of units which can move
+    there, both as arrays indexed like the fields of :attr:`grid`. After a
+    unit moves, is built or is destroyed only the units whose movement could
+    have changed are recomputed (see :meth:`move`, :meth:`add` and
+    :meth:`remove`).
+    """
+
+    def __init__(self, state, layout, stats=None):
+        self.grid = grid = map_grid(layout)
+        self.stats = UNIT_STATS if stats is None else stats
+        self.terrain = [None] * len(grid)
+        for terrain in layout['terrains']:
+            self.terrain[grid.index((terrain['x'], terrain['y']))] = \
+                terrain['type']
+        self.players = [f.get('playerName') for f in state.get('factions', [])]
+        self.threat = dict(
+            (player, array('i', repeat(0, len(grid))))
+            for player in self.players)
+        self.reach = dict(
+            (player, array('i', repeat(0, len(grid))))
+            for player in self.players)
+        self.units = {}  # field -> (player, type, quantity)
+        self.contributions = {}  # field -> (reach, threat, touched)
+        for faction in state.get('factions', []):
+            for unit in faction.get('units', []):
+                i = grid.index((unit['x'], unit['y']))
+                if i >= 0:
+                    self.units[i] = (faction.get('playerName'), unit['type'],
+                                     unit.get('quantity', 10))
+        for i in self.units:
+            self._add_contribution(i)
+
+    def _movement(self, i):
+        """
+        Returns the fields unit ``i`` can stop on, the fields it can attack
+        and all fields whose occupation affects its movement.
+        """
+        player, type_, quantity = self.units[i]
+        mobility, low, high, kind = self.stats.get(type_, (0, 1, 1, None))
+        spent, touched = _search_moves(
+            self.grid, self.terrain, self.units, i, mobility, kind)
+        stops = [k for k in spent if k == i or k not in self.units]
+        targets = set()
+        for k in stops if type_ not in STATIONARY_ATTACKERS else [i]:
+            row = self.grid.row(k)
+            targets.update(j for j, d in enumerate(row) if low <= d <= high)
+        return stops, targets, touched
+
+    def _add_contribution(self, i, sign=1):
+        if sign > 0:
+            self.contributions[i] = self._movement(i)
+            stops, targets, touched = self.contributions[i]
+        else:
+            stops, targets, touched = self.contributions.pop(i)
+        player, type_, quantity = self.units[i]
+        reach, threat = self.reach[player], self.threat[player]
+        for k in stops:
+            reach[k] += sign
+        for k in targets:
+            threat[k] += sign * quantity
+
+    def _update(self, changed, apply):
+        """
+        Recomputes every unit affected by a change of the occupation of
+        fields ``changed`` around ``apply()``.
+        """
+        affected = [i for i, (stops, targets, touched)
+                    in self.contributions.items()
+                    if any(k in touched for k in changed)]
+        for i in affected:
+            self._add_contribution(i, -1)
+        for i in apply(affected):
+            self._add_contribution(i)
+
+    def _field(self, position):
+        i = self.grid.index(position)
+        if i < 0:
+            raise ValueError('no such field: %r' % (position, ))
+        return i
+
+    def move(self, from_, to):
+        """
+        Updates the map after the unit at ``from_`` moved to ``to``.
+        """
+        i, j = self._field(from_), self._field(to)
+
+        def apply(affected):
+            self.units[j] = self.units.pop(i)
+            return [j if k == i else k for k in affected]
+        self._update((i, j), apply)
+
+    def add(self, position, player, type_, quantity=10):
+        """
+        Updates the map after a unit was built.
+        """
+        i = self._field(position)
+        if player not in self.threat:
+            self.players.append(player)
+            self.threat[player] = array('i', repeat(0, len(self.grid)))
+            self.reach[player] = array('i', repeat(0, len(self.grid)))
+
+        def apply(affected):
+            self.units[i] = (player, type_, quantity)
+            return affected + [i]
+        self._update((i, ), apply)
+
+    def remove(self, position):
+        """
+        Updates the map after the unit at ``position`` was destroyed.
+        """
+        i = self._field(position)
+
+        def apply(affected):
+            del self.units[i]
+            return [k for k in affected if k != i]
+        self._update((i, ), apply)
+
+    def set_quantity(self, position, quantity):
+        """
+        Updates the map after the unit at ``position`` was damaged or
+        repaired.
+        """
+        i = self._field(position)
+        self._add_contribution(i, -1)
+        player, type_, _ = self.units[i]
+        self.units[i] = (player, type_, quantity)
+        self._add_contribution(i)
+
+    def threat_at(self, position, player):
+        """
+        Summed quantity of ``player``'s units which can attack ``position``.
+        """
+        return self.threat[player][self._field(position)]
+
+    def danger(self, position, player):
+        """
+        Summed quantity of enemy units (of all players but ``player``) which
+        can attack ``position``.
+        """
+        i = self._field(position)
+        return sum(threat[i] for other, threat in self.threat.items()
+                   if other != player)
+
+    def reachable(self, position, player):
+        """
+        Number of ``player``'s units which can move to ``position``.
+        """
+        return self.reach[player][self._field(position)]
+
+    def controller(self, position):
+        """
+        Player with the strongest threat on ``position`` or ``None`` if no
+        single player has one.
+        """
+        i = self._field(position)
+        ranked = sorted((threat[i], player)
+                        for player, threat in self.threat.items())
+        if not ranked or ranked[-1][0] == 0 or (
+                len(ranked) > 1 and ranked[-2][0] == ranked[-1][0]):
+            return None
+        return ranked[-1][1]
+
+
+#{ simulation
+def _eliza_error(text):
+    """
+    Creates the :class:`ELIZAError` the server would send for ``text``.
+    """
+    node = objectify.fromstring('<error>%s</error>' % text)
+    return ELIZAError(node)
+
+
+class SimulatedGame (GameBoard):
+
+    """
+    A game played locally from the start positions of a map layout (as
+    returned by :meth:`ELIZA.map_layout`). Commands are issued for the
+    current player and raise the same exceptions as :class:`ELIZA`. The
+    outcome of fights is decided by a random number generator seeded with
+    ``seed``, so a game replays identically from the same seed and commands.
+
+    The rules are simplified: units move according to :data:`UNIT_STATS`
+    and :data:`MOVEMENT_COSTS`, may attack (or capture or repair) once per
+    turn and move before but not after that. Units in
+    :data:`STATIONARY_ATTACKERS` only attack if they have not moved. Each unit of an attacker's
+    quantity rolls :attr:`SHOTS` dice which hit with :meth:`hit_chance`;
+    every :attr:`SHOTS` hits destroy one unit of quantity. Defenders which
+    survive strike back if the attacker is within their range. A player
+    without units and bases is out; the last one left wins.
+    """
+
+    #: units which can capture bases
+    CAPTURING_UNITS = set([TROOPER, HEAVY_TROOPER])
+    SHOTS = 6
+    HIT_CHANCE = 0.5
+
+    def __init__(self, layout, players, seed=None, game_id=None,
+                 initial_credits=None, credits_per_base=None,
+                 max_rounds=None):
+        """
+        :param players: Player names in turn order. Start positions of
+            faction ``n`` go to ``players[n]``.
+        :param max_rounds: End the game as a draw after this many rounds.
+        """
+        self.players = list(players)
+        self.random = random.Random(seed)
+        self.grid = map_grid(layout)
+        self.max_rounds = max_rounds
+        if initial_credits is None:
+            initial_credits = layout.get('initialCredits', 0)
+        if credits_per_base is None:
+            credits_per_base = layout.get('perBaseCredits', 100)
+        self.credits_per_base = credits_per_base
+        GameBoard.__init__(self, {
+            'id': game_id, 'name': layout.get('name'), 'round': 1,
+            'state': 'running', 'pendingInvites': False, 'pace': None,
+            'type': 'Basic', 'rated': False,
+            'players': [{'index': n, 'current': n == 0, 'username': player}
+                        for n, player in enumerate(self.players)],
+            'disabledUnitTypes': [], 'map': layout.get('id'),
+            'creditsPerBase': credits_per_base,
+            'initialCredits': initial_credits,
+            'factions': [{'current': n == 0, 'credits': initial_credits,
+                          'playerId': n, 'playerName': player,
+                          'state': 'playing'}
+                         for n, player in enumerate(self.players)],
+        }, self.players[0])
+        self.wallet = dict((player, initial_credits) for player in self.players)
+        self.credits = initial_credits
+        self.moved = set()  # fields of units which moved this turn
+        self.types = [None] * len(self.grid)
+        for terrain in layout['terrains']:
+            x, y = position = terrain['x'], terrain['y']
+            self.types[self.grid.index(position)] = terrain['type']
+            owner = self._player(terrain.get('startFaction'))
+            self.terrain[position] = (owner, terrain['type'])
+            unit_owner = self._player(terrain.get('startUnitOwner'))
+            if terrain.get('startUnit') and unit_owner is not None:
+                self.units[position] = {
+                    'x': x, 'y': y, 'type': terrain['startUnit'],
+                    'quantity': 10, 'finished': False, 'owner': unit_owner}
+
+    def _player(self, index):
+        if index is not None and 0 <= int(index) < len(self.players):
+            return self.players[int(index)]
+
+    def _ready(self, position):
+        unit = self.check_unit(position)
+        if unit.get('finished'):
+            raise _eliza_error('Unit has already finished.')
+        return unit
+
+    def _stats(self, unit):
+        return UNIT_STATS.get(unit['type'], (0, 1, 1, None))
+
+    def moves(self, position):
+        """
+        Fields the unit at ``position`` can move to.
+        """
+        mobility, low, high, kind = self._stats(self.units[position])
+        units = dict((self.grid.index(field), (unit['owner'], ))
+                     for field, unit in self.units.items())
+        spent, touched = _search_moves(
+            self.grid, self.types, units, self.grid.index(position),
+            mobility, kind)
+        return [self.grid.fields[k] for k in spent if k not in units]
+
+    def build(self, position, type_):
+        position = tuple(position)
+        self.check_build(position, type_)
+        self.apply_build(position, type_)
+        return True
+
+    def move(self, from_, to):
+        from_, to = tuple(from_), tuple(to)
+        self.check_move(from_, to)
+        self._ready(from_)
+        if from_ in self.moved:
+            raise _eliza_error('Unit has already moved.')
+        if to not in self.moves(from_):
+            raise _eliza_error('Unit cannot move there.')
+        result = {'command': 'move', 'position': from_, 'to': to}
+        self.apply_result(result)
+        self.moved.add(to)
+        return result
+
+    def hit_chance(self, attacker, defender):
+        """
+        Probability of each die of ``attacker`` to hit ``defender``.
+        """
+        return self.HIT_CHANCE
+
+    def _damage(self, attacker, defender):
+        chance = self.hit_chance(attacker, defender)
+        rolls = attacker['quantity'] * self.SHOTS
+        hits = sum(1 for _ in range(rolls) if self.random.random() < chance)
+        return min(hits // self.SHOTS, defender['quantity'])
+
+    def attack(self, from_, target):
+        from_, target = tuple(from_), tuple(target)
+        unit = self._ready(from_)
+        if unit['type'] in STATIONARY_ATTACKERS and from_ in self.moved:
+            raise _eliza_error('Unit has already moved.')
+        defender = self.units.get(target)
+        if defender is None or defender['owner'] == self.player:
+            raise _eliza_error('Invalid target.')
+        distance = self.grid.distance(from_, target)
+        _, low, high, _ = self._stats(unit)
+        if not low <= distance <= high:
+            raise _eliza_error('Target is out of range.')
+        inflicted = self._damage(unit, defender)
+        received = 0
+        _, low, high, _ = self._stats(defender)
+        if inflicted < defender['quantity'] and low <= distance <= high:
+            received = self._damage(
+                dict(defender, quantity=defender['quantity'] - inflicted),
+                unit)
+        result = {'command': 'attack', 'position': from_, 'target': target,
+                  'damageInflicted': inflicted, 'damageReceived': received,
+                  'remainingQuantity': unit['quantity'] - received}
+        self.apply_result(result)
+        self._check_players()
+        return result
+
+    def capture(self, position):
+        position = tuple(position)
+        unit = self._ready(position)
+        owner, type_ = self.terrain.get(position, (None, None))
+        if (unit['type'] not in self.CAPTURING_UNITS or
+                type_ not in BUILDABLE_UNITS or owner == self.player):
+            raise _eliza_error('Unit cannot capture this terrain.')
+        result = {'command': 'capture', 'position': position,
+                  'finished': True}
+        self.apply_result(result)
+        self._check_players()
+        return result
+
+    def repair(self, position):
+        position = tuple(position)
+        unit = self._ready(position)
+        if position in self.moved:
+            raise _eliza_error('Unit has already moved.')
+        owner, type_ = self.terrain.get(position, (None, None))
+        bonus = 2 if owner == self.player and type_ in BUILDABLE_UNITS else 1
+        unit['quantity'] = min(10, unit['quantity'] + bonus)
+        result = {'command': 'repair', 'position': position}
+        self.apply_result(result)
+        return result
+
+    def finish_turn(self):
+        if self.state['state'] == 'finished':
+            raise NotYourTurn
+        self.wallet[self.player] = self.credits
+        for unit in self.units.values():
+            unit['finished'] = False
+        self.built.clear()
+        self.moved.clear()
+        alive = self._alive()
+        if not alive.intersection(self.players):
+            self._finish(None)  # nobody left to move
+            return True
+        index = self.players.index(self.player)
+        while True:
+            index = (index + 1) % len(self.players)
+            if index == 0:
+                if self.max_rounds and self.state['round'] >= self.max_rounds:
+                    self._finish(None)
+                    return True
+                self.state['round'] += 1
+            if self.players[index] in alive:
+                break
+        self.player = player = self.players[index]
+        bases = sum(1 for owner, type_ in self.terrain.values()
+                    if owner == player and type_ in BUILDABLE_UNITS)
+        self.wallet[player] += bases * self.credits_per_base
+        self.credits = self.wallet[player]
+        for entry in self.state['players'] + self.state['factions']:
+            entry['current'] = player in (entry.get('username'),
+                                          entry.get('playerName'))
+        return True
+
+    def _alive(self):
+        alive = set(unit['owner'] for unit in self.units.values())
+        alive.update(owner for owner, type_ in self.terrain.values()
+                     if type_ in BUILDABLE_UNITS)
+        return alive
+
+    def _check_players(self):
+        alive = self._alive()
+        for faction in self.state['factions']:
+            if faction['playerName'] not in alive:
+                faction.update(state='finished', result='defeat')
+        remaining = [player for player in self.players if player in alive]
+        if len(remaining) == 1:
+            self._finish(remaining[0])
+
+    def _finish(self, winner):
+        self.state['state'] = 'finished'
+        for entry in self.state['players'] + self.state['factions']:
+            name = entry.get('username', entry.get('playerName'))
+            if name == winner:
+                entry['result'] = 'victory'
+            elif winner is None:
+                entry.setdefault('result', 'draw')
+            else:
+                entry.setdefault('result', 'defeat')
+            if 'playerName' in entry:
+                entry['state'] = 'finished'
+
+    def to_state(self):
+        self.wallet[self.player] = self.credits
+        state = GameBoard.to_state(self)
+        state['players'] = [dict(player) for player in state['players']]
+        for faction in state['factions']:
+            faction['credits'] = self.wallet[faction['playerName']]
+        return state
+
+
+class Simulator (_ProfilingMixin):
+
+    """
+    Stands in for :class:`ELIZA` with games played locally (see
+    :class:`SimulatedGame`). Bots written against ELIZA's commands can play
+    against each other without requests to the server::
+
+        >>> api = Simulator()
+        >>> game_id = api.new_game(layout, ['ai_one', 'ai_two'], seed=1)
+        >>> api.move(game_id, (3, 8), (4, 7))
+        {'command': 'move', 'position': (3, 8), 'to': (4, 7)}
+        >>> api.finish_turn(game_id)
+        True
+
+    Commands always act for the player whose turn it is.
+    """
+
+    def __init__(self, profiler=None):
+        self.games = {}
+        self.layouts = {}
+        self.ids = count(1)
+        self.profiler = profiler
+
+    def new_game(self, layout, players, seed=None, **options):
+        """
+        Starts a game (see :class:`SimulatedGame`) and returns its id.
+        """
+        game_id = next(self.ids)
+        self.games[game_id] = SimulatedGame(
+            layout, players, seed, game_id, **options)
+        self.layouts[layout.get('id')] = layout
+        return game_id
+
+    def _game(self, game_id):
+        try:
+            return self.games[game_id]
+        except KeyError:
+            raise GameNotFound(game_id)
+
+    def game_state(self, id_):
+        return self._game(id_).to_state()
+
+    def map_layout(self, id_):
+        try:
+            return self.layouts[id_]
+        except KeyError:
+            raise MapNotFound(id_)
+
+    def map_grid(self, id_):
+        return map_grid(self.map_layout(id_))
+
+    def finish_turn(self, game_id):
+        return self._game(game_id).finish_turn()
+
+    def build(self, game_id, position, type_):
+        return self._game(game_id).build(position, type_)
+
+    def move_options(self, game_id, position, type_=None):
+        return self._game(game_id).moves(tuple(position))
+
+    def move(self, game_id, from_, to):
+        return self._game(game_id).move(from_, to)
+
+    def attack(self, game_id, from_, target):
+        return self._game(game_id).attack(from_, target)
+
+    def capture(self, game_id, at):
+        return self._game(game_id).capture(at)
+
+    def repair(self, game_id, at):
+        return self._game(game_id).repair(at)
+
+
+def play_game(layout, bots, seed=None, max_rounds=100, **options):
+    """
+    Plays a game on ``layout`` between ``bots`` and returns its final state.
+    Each bot is called as ``bot(api, game_id, player)`` with a
+    :class:`Simulator` to play one turn; the turn is finished afterwards
+    unless the bot did so. Players are named ``player1``, ``player2``, ...
+    The game ends as a draw after ``max_rounds`` rounds (``None`` for no
+    limit, which never ends if no bot attacks).
+    """
+    players = ['player%d' % (n + 1) for n in range(len(bots))]
+    api = Simulator()
+    game_id = api.new_game(layout, players, seed, max_rounds=max_rounds,
+                           **options)
+    game = api.games[game_id]
+    while game.state['state'] != 'finished':
+        player = game.player
+        bots[players.index(player)](api, game_id, player)
+        if game.player == player and game.state['state'] != 'finished':
+            game.finish_turn()
+    return game.to_state()
+
+
+def _play_game(job):
+    layout, bots, seed, options = job
+    return play_game(layout, bots, seed, **options)
+
+
+def simulate(layout, bots, seeds, workers=None, max_rounds=100, **options):
+    """
+    Plays one game (see :func:`play_game`) for each of ``seeds`` in
+    ``workers`` processes (one per CPU by default, none if ``0``) and returns
+    the final states in order. Bots have to be picklable, i.e. defined at
+    module level.
+    """
+    options['max_rounds'] = max_rounds
+    jobs = [(layout, bots, seed, options) for seed in seeds]
+    if workers == 0:
+        return [_play_game(job) for job in jobs]
+    with futures.ProcessPoolExecutor(workers) as executor:
+        chunksize = max(1, len(jobs) // 100)
+        return list(executor.map(_play_game, jobs, chunksize=chunksize))
+
+
+#{ interning
+try:
+    _intern = sys.intern
+except AttributeError:
+    _intern = intern  # Python 2
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError('Catalog records are shared and cannot be modified '
+                    '(copy them with dict(record)).')
+
+
+class _Record (dict):
+
+    """
+    Read-only dictionary which can be referenced weakly.
+    """
+
+    __slots__ = ('__weakref__', )
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        # copies and pickles are plain (modifiable) dicts
+        return dict, (dict(self), )
+
+
+class Catalog (object):
+
+    """
+    Shares equal players, maps and strings between API responses. Strings
+    are interned and flat dicts (such as ``{'id': 1909, 'name': 'ironcamel',
+    'rating': 2104}`` or a map from :meth:`ReadOnlyAPI.latest_maps`) are
+    replaced by one canonical copy. The catalog only keeps weak references,
+    so records nobody uses any more are dropped::
+
+        >>> catalog = Catalog()
+        >>> api = ReadOnlyAPI(catalog=catalog)
+        >>> api.all_users()[0] is api.all_users()[0]
+        True
+
+    Canonical records are shared and cannot be modified; copy them with
+    ``dict(record)`` first.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self.records)
+
+    def intern(self, value):
+        if type(value) is str:
+            return _intern(value)
+        return value
+
+    def record(self, values):
+        """
+        Returns the canonical record for flat dict ``values``.
+        """
+        values = dict((self.intern(key), self.intern(value))
+                      for key, value in values.items())
+        # True == 1 == 1.0, but they must not share a record
+        key = tuple(sorted((name, type(value), value)
+                           for name, value in values.items()))
+        with self.lock:
+            record = self.records.get(key)
+            if record is None:
+                record = self.records[key] = _Record(values)
+        return record
+
+    def canonical(self, value):
+        """
+        Returns ``value`` with all strings interned and all flat dicts (at
+        any depth) replaced by their canonical records.
+        """
+        if isinstance(value, dict):
+            if not any(isinstance(item, (dict, list))
+                       for item in value.values()):
+                try:
+                    return self.record(value)
+                except TypeError:  # unhashable values
+                    pass
+            return dict((self.intern(key), self.canonical(item))
+                        for key, item in value.items())
+        if isinstance(value, list):
+            return [self.canonical(item) for item in value]
+        return self.intern(value)
+
+
+#{ rankings
+class RankingIndex (object):
+
+    """
+    Users of :meth:`ReadOnlyAPI.all_users` ordered by rating, kept up to date
+    from successive snapshots. Users are stored in one sorted
+    ``array('q')`` of keys (higher ratings first, ties by id), so rank,
+    percentile and range queries are binary searches::
+
+        >>> ranking = RankingIndex()
+        >>> ranking.update(api.all_users())
+        {'added': 13, 'changed': 0, 'removed': 0}
+        >>> ranking.rank(1909)
+        3
+        >>> ranking.top(2)
+        [{'id': 47874, 'name': 'Watyousay', 'rating': 2213}, ...]
+
+    Ranks count users with a higher rating, so users with equal ratings share
+    a rank.
+    """
+
+    #: rebuild the index if more than this share of users changed
+    REBUILD_RATIO = 0.25
+
+    def __init__(self, users=()):
+        self.keys = array('q')
+        self.ratings = {}  # user id -> rating
+        self.names = {}  # user id -> name
+        if users:
+            self.update(users)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, user_id):
+        return user_id in self.ratings
+
+    @staticmethod
+    def _key(rating, user_id=0):
+        return (-rating << 32) + user_id
+
+    def update(self, users):
+        """
+        Replaces the index with snapshot ``users`` (as returned by
+        :meth:`ReadOnlyAPI.all_users`), changing only users which were added,
+        changed their rating or dropped out. Returns the number of each.
+        """
+        ratings = dict((user['id'], user['rating']) for user in users)
+        for user in users:
+            self.names[user['id']] = user['name']
+        removed = [id_ for id_ in self.ratings if id_ not in ratings]
+        changed = [id_ for id_, rating in ratings.items()
+                   if self.ratings.get(id_, rating) != rating]
+        added = [id_ for id_ in ratings if id_ not in self.ratings]
+        changes = len(removed) + len(changed) + len(added)
+        if changes > self.REBUILD_RATIO * max(len(self.keys), 1):
+            self.keys = array('q', sorted(
+                self._key(rating, id_) for id_, rating in ratings.items()))
+        else:
+            for id_ in removed + changed:
+                self._remove(self._key(self.ratings[id_], id_))
+            for id_ in changed + added:
+                key = self._key(ratings[id_], id_)
+                self.keys.insert(bisect.bisect_left(self.keys, key), key)
+        for id_ in removed:
+            del self.names[id_]
+        self.ratings = ratings
+        return {'added': len(added), 'changed': len(changed),
+                'removed': len(removed)}
+
+    def _remove(self, key):
+        del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def _user(self, key):
+        user_id = key & 0xffffffff
+        return {'id': user_id, 'name': self.names.get(user_id),
+                'rating': self.ratings[user_id]}
+
+    def rank(self, user_id):
+        """
+        Rank of a user (starting with 1).
+        """
+        return bisect.bisect_left(
+            self.keys, self._key(self.ratings[user_id])) + 1
+
+    def percentile(self, user_id):
+        """
+        Percentage of users with a lower rating than the user.
+        """
+        below = len(self.keys) - bisect.bisect_left(
+            self.keys, self._key(self.ratings[user_id] - 1))
+        return 100.0 * below / len(self.keys)
+
+    def top(self, count=10):
+        """
+        The ``count`` best rated users.
+        """
+        return [self._user(key) for key in self.keys[:count]]
+
+    def between(self, low, high):
+        """
+        Users rated from ``low`` to ``high`` (inclusive), best first.
+        """
+        start = bisect.bisect_left(self.keys, self._key(high))
+        end = bisect.bisect_left(self.keys, self._key(low - 1))
+        return [self._user(key) for key in self.keys[start:end]]
+
+    def count_between(self, low, high):
+        """
+        Number of users rated from ``low`` to ``high`` (inclusive).
+        """
+        return (bisect.bisect_left(self.keys, self._key(low - 1)) -
+                bisect.bisect_left(self.keys, self._key(high)))
+
+
+#{ profiling
+class _NullSpan (object):
+
+    """
+    Span which records nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+_SKIPPED = object()  # marks threads whose current trace is not sampled
+
+
+class _Span (object):
+
+    __slots__ = ('local', 'name', 'args', 'start', 'path')
+
+    def __init__(self, local, name, args):
+        self.local = local
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.local.path.append(self.name)
+        self.path = tuple(self.local.path)
+        self.start = _clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = _clock()
+        local = self.local
+        local.path.pop()
+        local.spans.append((self.path, self.start, end, self.args))
+        return False
+
+
+class _Trace (_Span):
+
+    """
+    Root span, which hands its spans to the profiler when it ends.
+    """
+
+    __slots__ = ('profiler', )
+
+    def __init__(self, profiler, name, args):
+        _Span.__init__(self, profiler.local, name, args)
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.local.path = []
+        self.local.spans = []
+        return _Span.__enter__(self)
+
+    def __exit__(self, *exc_info):
+        _Span.__exit__(self, *exc_info)
+        spans, self.local.spans = self.local.spans, None
+        with self.profiler.lock:
+            self.profiler.traces.append(
+                (threading.current_thread().ident, spans))
+        return False
+
+
+class _Unsampled (object):
+
+    """
+    Root span of a trace which is not recorded.
+    """
+
+    def __init__(self, local):
+        self.local = local
+
+    def __enter__(self):
+        self.local.spans = _SKIPPED
+        return self
+
+    def __exit__(self, *exc_info):
+        self.local.spans = None
+        return False
+
+
+class Profiler (object):
+
+    """
+    Records which sections (:meth:`span`) an API instance spent its time in.
+    The outermost span of a thread starts a trace, e.g. a bot's turn
+    (:meth:`ReadOnlyAPI.turn`); API calls record their throttle wait,
+    request and parse times, ELIZA commands their round trip. Only a share
+    ``sample`` of traces is recorded, the others cost a single random draw;
+    the last ``keep`` traces are kept::
+
+        >>> profiler = Profiler(sample=0.01)
+        >>> api = ELIZA('ai_bot', '...', profiler=profiler)
+        ...
+        >>> profiler.write_chrome_trace('turns.json')
+        >>> open('turns.folded', 'w').write(profiler.collapsed())
+
+    Chrome traces can be viewed with ``chrome://tracing`` or Perfetto,
+    collapsed stacks with ``flamegraph.pl``.
+    """
+
+    def __init__(self, sample=1.0, keep=1000, seed=None):
+        self.sample = sample
+        self.traces = deque(maxlen=keep)  # (thread id, spans)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.random = random.Random(seed)
+        self.origin = _clock()
+
+    def span(self, name, **args):
+        """
+        Context manager which records a section named ``name``.
+        """
+        spans = getattr(self.local, 'spans', None)
+        if spans is None:
+            if self.sample < 1 and self.random.random() >= self.sample:
+                return _Unsampled(self.local)
+            return _Trace(self, name, args)
+        if spans is _SKIPPED:
+            return _NULL_SPAN
+        return _Span(self.local, name, args)
+
+    def chrome_trace(self):
+        """
+        Returns the recorded traces in Chrome's trace event format.
+        """
+        pid = os.getpid()
+        with self.lock:
+            traces = list(self.traces)
+        events = []
+        for thread, spans in traces:
+            for path, start, end, args in spans:
+                events.append({
+                    'name': path[-1], 'ph': 'X', 'pid': pid, 'tid': thread,
+                    'ts': (start - self.origin) * 1e6,
+                    'dur': (end - start) * 1e6,
+                    'args': args,
+                })
+        events.sort(key=lambda event: (event['tid'], event['ts']))
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, filename):
+        with open(filename, 'w') as fp:
+            json.dump(self.chrome_trace(), fp, default=str)
+
+    def collapsed(self):
+        """
+        Returns the recorded traces as collapsed stacks (one line of
+        ``turn;call_api;parse <microseconds>`` per stack, counting only the
+        time spent in the innermost section).
+        """
+        totals = {}
+        with self.lock:
+            traces = list(self.traces)
+        for thread, spans in traces:
+            for path, start, end, args in spans:
+                duration = end - start
+                totals[path] = totals.get(path, 0.0) + duration
+                if len(path) > 1:
+                    totals[path[:-1]] = totals.get(path[:-1], 0.0) - duration
+        return ''.join(
+            '%s %d\n' % (';'.join(path), round(total * 1e6))
+            for path, total in sorted(totals.items()) if total > 0)
+
+
+#{ prefetching
+def _turns_until(state, username):
+    """
+    Returns the number of players moving before ``username`` in a game
+    state (``0`` if it is their turn), or ``None`` if they do not play in it.
+    """
+    players = [player for player in sorted(
+        state.get('players', []), key=lambda player: player.get('index', 0))
+        if player.get('current') or
+        player.get('result', 'playing') == 'playing']
+    names = [player.get('username') for player in players]
+    current = [i for i, player in enumerate(players) if player.get('current')]
+    if username not in names or not current:
+        return None
+    return (names.index(username) - current[0]) % len(players)
+
+
+class Prefetcher (object):
+
+    """
+    Fetches map layouts and game states before they are asked for, using
+    only request slots nobody else needs: a request is only made while the
+    rate limiter is idle, and at :data:`PRIORITY_PREFETCH`, so any other
+    request waiting at the same time goes first.
+
+    Feed it headquarter games (:meth:`schedule`), or let it follow a
+    :class:`HeadquarterWatcher`, and take the results from
+    :meth:`game_state` and :meth:`map_layout`::
+
+        >>> prefetcher = Prefetcher(api)
+        >>> prefetcher.follow(watcher)
+        >>> prefetcher.start()
+        ...
+        >>> state = prefetcher.game_state(game_id)  # usually no request
+
+    The maps of all running games are fetched. Game states are fetched in
+    order of how soon the game needs attention: games in need of attention
+    first, then by the number of players moving before you (learnt from
+    the first state fetched) and by turn deadline. Games where at most
+    ``lookahead`` players move before you are fetched again every
+    ``refresh`` seconds, so the state is often at hand before the
+    headquarters show that it is your turn. States are handed out once, and
+    only if it is your turn in them and they are younger than ``max_age``
+    seconds; older ones are dropped. Finished games are forgotten, and only
+    the :attr:`MAX_LAYOUTS` most recently used map layouts are kept.
+    """
+
+    MAX_LAYOUTS = 64  #: map layouts kept
+
+    def __init__(self, api, max_age=60.0, interval=0.05, fetcher=None,
+                 lookahead=1, refresh=30.0):
+        """
+        :param api: API used when nothing was prefetched.
+        :param fetcher: API used for prefetching (by default a copy of
+            ``api`` sharing its limiter, cache and catalog).
+        """
+        self.api = api
+        if fetcher is None:
+            fetcher = ELIZA(api.username, api.key, api.limiter, api.cache,
+                            catalog=api.catalog)
+            fetcher.HOST = api.HOST
+        fetcher.priority = PRIORITY_PREFETCH
+        self.fetcher = fetcher
+        self.max_age = max_age
+        self.interval = interval
+        self.lookahead = lookahead
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.pending = []  # heap of (rank, deadline, seq, job)
+        self.queued = {}  # job -> rank
+        self.counter = count()
+        self.games = {}  # game id -> headquarter entry of running games
+        self.turns = {}  # game id -> players moving before us
+        self.fetched = {}  # game id -> time of last state fetch
+        self.states = {}  # game id -> (time fetched, state)
+        self.layouts = OrderedDict()  # map id -> layout, LRU first
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _enqueue(self, job, rank, deadline=None):
+        if self.queued.get(job, _INF) <= rank:
+            return
+        self.queued[job] = rank
+        heapq.heappush(self.pending, (
+            rank, deadline if deadline is not None else _INF,
+            next(self.counter), job))
+
+    def _schedule_state(self, game, now):
+        id_ = game['id']
+        fetched = self.fetched.get(id_)
+        turns = self.turns.get(id_)
+        if game.get('inNeedOfAttention'):
+            if id_ in self.states and turns == 0:
+                return  # already at hand
+            rank = 0
+        else:
+            if turns == 0 or (turns is not None and turns > self.lookahead):
+                return
+            if fetched is not None and now - fetched < self.refresh:
+                return
+            # unknown turn order ranks last, but is fetched once to learn it
+            rank = 1 + (turns if turns is not None else self.lookahead + 1)
+        deadlines = getattr(self.api, 'deadlines', {})
+        self._enqueue(('state', id_), rank, deadlines.get(id_))
+
+    def schedule(self, games):
+        """
+        Queues prefetches for headquarter games (see
+        :meth:`ReadOnlyAPI.headquarter`).
+        """
+        now = _clock()
+        with self.lock:
+            for game in games:
+                if game.get('state') == 'finished':
+                    self._forget(game['id'])
+                    continue
+                self.games[game['id']] = game
+                self._schedule_state(game, now)
+                map_id = game.get('map')
+                if map_id is not None and map_id not in self.layouts:
+                    self._enqueue(('map', map_id), 1)
+
+    def _forget(self, game_id):
+        for known in (self.games, self.turns, self.fetched, self.states):
+            known.pop(game_id, None)
+        self.queued.pop(('state', game_id), None)  # skipped in the heap
+
+    def _keep_layout(self, map_id, layout):
+        self.layouts.pop(map_id, None)
+        self.layouts[map_id] = layout  # most recently used
+        while len(self.layouts) > self.MAX_LAYOUTS:
+            self.layouts.popitem(last=False)
+
+    def follow(self, watcher):
+        """
+        Schedules the games of every event of a :class:`HeadquarterWatcher`.
+        """
+        def _schedule(event):
+            self.schedule([event['data']])
+        return watcher.subscribe(_schedule)
+
+    def _next_job(self):
+        while self.pending:
+            rank, _, _, job = heapq.heappop(self.pending)
+            if self.queued.get(job) == rank:
+                del self.queued[job]
+                return job
+        # nothing to do: look for games due for a refresh
+        now = _clock()
+        for game in self.games.values():
+            if not game.get('inNeedOfAttention'):
+                self._schedule_state(game, now)
+        if self.pending:
+            rank, _, _, job = heapq.heappop(self.pending)
+            del self.queued[job]
+            return job
+        return None
+
+    def _keep_state(self, game_id, state, fetched):
+        turns = _turns_until(state, self.api.username)
+        with self.lock:
+            self.fetched[game_id] = fetched
+            if turns is not None:
+                self.turns[game_id] = turns
+
+    def step(self):
+        """
+        Makes one prefetch if there is one and the limiter is idle. Returns
+        ``True`` if a request was made.
+        """
+        if not self.fetcher.limiter.idle():
+            return False
+        with self.lock:
+            job = self._next_job()
+        if job is None:
+            return False
+        kind, id_ = job
+        try:
+            if kind == 'map':
+                layout = self.fetcher.map_layout(id_)
+                with self.lock:
+                    self._keep_layout(id_, layout)
+            else:
+                fetched = _clock()
+                state = self.fetcher.game_state(id_)
+                self._keep_state(id_, state, fetched)
+                with self.lock:
+                    for game_id, (since, _) in list(self.states.items()):
+                        if fetched - since > self.max_age:
+                            del self.states[game_id]
+                    if state.get('state') == 'finished':
+                        self._forget(id_)
+                    elif self.turns.get(id_) == 0:
+                        self.states[id_] = (fetched, state)
+        except Exception:
+            pass  # it will be fetched when it is needed
+        return True
+
+    def game_state(self, game_id):
+        """
+        Returns the prefetched state of a game if it is your turn in it and
+        it is recent enough, or fetches it. Either way the API keeps the
+        board and turn deadline of the game (see :meth:`ELIZA.game_state`).
+        """
+        with self.lock:
+            fetched, state = self.states.pop(game_id, (None, None))
+            turns = self.turns.get(game_id)
+        if (state is not None and turns == 0 and
+                _clock() - fetched <= self.max_age):
+            track = getattr(self.api, '_track_state', None)
+            if track is not None:
+                track(game_id, state, fetched)
+            return state
+        fetched = _clock()
+        state = self.api.game_state(game_id)
+        self._keep_state(game_id, state, fetched)
+        return state
+
+    def map_layout(self, map_id):
+        with self.lock:
+            layout = self.layouts.get(map_id)
+            if layout is not None:
+                self._keep_layout(map_id, layout)
+        if layout is not None:
+            return layout
+        layout = self.api.map_layout(map_id)
+        with self.lock:
+            self._keep_layout(map_id, layout)
+        return layout
+
+    def run(self):
+        while not self.stopped.is_set():
+            if not self.step():
+                self.stopped.wait(self.interval)
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, wait=True):
+        self.stopped.set()
+        if wait and self.thread is not None:
+            self.thread.join()
+
+
+#{ clustering
+# cluster protocol: header + JSON message, in both directions
+_CLUSTER_HEADER = struct.Struct('<I')  # message size
+
+
+def _send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(_CLUSTER_HEADER.pack(len(data)) + data)
+
+
+def _recv_message(sock):
+    size, = _CLUSTER_HEADER.unpack(_recv_exactly(sock, _CLUSTER_HEADER.size))
+    return json.loads(_recv_exactly(sock, size).decode('utf-8'))
+
+
+def _connect(address, timeout):
+    """
+    Connects to a ``(host, port)`` tuple over TCP or to a path over a Unix
+    socket.
+    """
+    if isinstance(address, (tuple, list)):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        address = tuple(address)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+
+class ClusterCoordinator (object):
+
+    """
+    Coordinator of a bot fleet spread over several processes and hosts.
+    It shards ``items`` (e.g. account names or game ids) across the
+    :class:`ClusterWorker` processes connected to it and hands out request
+    tokens from one rate limiter, so all workers together stay within the
+    server's limits::
+
+        $ python -c "import weewar; weewar.ClusterCoordinator(('0.0.0.0', 7531), ['ai_bot', 'ai_bot2']).serve_forever()"
+
+    ``address`` is a ``(host, port)`` tuple or the path of a Unix socket.
+    Workers send a heartbeat every ``heartbeat`` seconds; a worker not
+    heard of for ``timeout`` seconds is considered dead and its items go to
+    the others. Items are spread evenly: when a worker joins, items are
+    taken away from the busiest ones, but they are only given to another
+    worker once their old worker has reported to have let go of them, so no
+    item is ever handled twice at the same time.
+    """
+
+    def __init__(self, address, items=(), rate=None, limiter=None,
+                 heartbeat=2.0, timeout=10.0):
+        """
+        :param rate: Requests per second for the whole cluster (defaults to
+            :attr:`ReadOnlyAPI.REQUESTS_PER_SECOND`).
+        :param limiter: Rate limiter handing out the tokens, e.g. an
+            :class:`AdaptiveRateLimiter` (created from ``rate`` if omitted).
+        """
+        self.address = address
+        if limiter is None:
+            limiter = RateLimiter(
+                rate if rate is not None else ReadOnlyAPI.REQUESTS_PER_SECOND)
+        self.limiter = limiter
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.items = list(items)
+        self.workers = {}  # id -> {'name', 'seen', 'assigned', 'held'}
+        self.ids = count(1)
+        self.lost = 0
+        self.server = None
+        self.ready = threading.Event()
+
+    def add(self, item):
+        """
+        Adds an item, which is handed to a worker with its next heartbeat.
+        """
+        with self.lock:
+            if item not in self.items:
+                self.items.append(item)
+                self._rebalance(_clock())
+
+    def remove(self, item):
+        """
+        Removes an item; its worker lets go of it with its next heartbeat.
+        """
+        with self.lock:
+            if item in self.items:
+                self.items.remove(item)
+                for worker in self.workers.values():
+                    worker['assigned'].discard(item)
+                self._rebalance(_clock())
+
+    def _rebalance(self, now):
+        for worker_id, worker in list(self.workers.items()):
+            if now - worker['seen'] > self.timeout:
+                del self.workers[worker_id]
+                self.lost += 1
+        if not self.workers:
+            return
+        workers = sorted(self.workers.items())
+        target = -(-len(self.items) // len(workers))
+        for worker_id, worker in workers:
+            assigned = worker['assigned']
+            for item in self.items[::-1]:
+                if len(assigned) <= target:
+                    break
+                assigned.discard(item)
+        taken = set()
+        for worker_id, worker in workers:
+            taken.update(worker['assigned'], worker['held'])
+        for item in self.items:
+            if item not in taken:
+                worker_id, worker = min(
+                    workers, key=lambda entry: len(entry[1]['assigned']))
+                worker['assigned'].add(item)
+
+    def status(self):
+        """
+        Returns the state of the cluster::
+
+            {'workers': {'1': {'name': 'host-a', 'items': ['ai_bot'],
+                               'age': 0.4}, ...},
+             'unassigned': [], 'lost': 0, 'limiter': {...}}
+
+        """
+        with self.lock:
+            now = _clock()
+            self._rebalance(now)
+            assigned = set()
+            workers = {}
+            for worker_id, worker in self.workers.items():
+                assigned.update(worker['assigned'])
+                workers[worker_id] = {
+                    'name': worker['name'],
+                    'items': [item for item in self.items
+                              if item in worker['assigned']],
+                    'age': now - worker['seen'],
+                }
+            unassigned = [item for item in self.items if item not in assigned]
+            lost = self.lost
+        return {'workers': workers, 'unassigned': unassigned, 'lost': lost,
+                'limiter': self.limiter.metrics()}
+
+    def dispatch(self, message):
+        """
+        Answers one message of a worker or client.
+        """
+        op = message.get('op')
+        if op == 'token':
+            for ok, latency in message.get('reports', ()):
+                self.limiter.report(ok, latency)
+            within = message.get('within')
+            deadline = _clock() + within if within is not None else None
+            wait = self.limiter.acquire(
+                message.get('priority', PRIORITY_POLL), deadline)
+            return {'wait': wait}
+        if op == 'idle':
+            return {'idle': self.limiter.idle()}
+        if op == 'status':
+            return self.status()
+        with self.lock:
+            now = _clock()
+            if op == 'register':
+                worker_id = str(next(self.ids))
+                self.workers[worker_id] = {
+                    'name': message.get('name'), 'seen': now,
+                    'assigned': set(), 'held': set()}
+                self._rebalance(now)
+                return {'worker': worker_id, 'heartbeat': self.heartbeat,
+                        'timeout': self.timeout}
+            worker = self.workers.get(message.get('worker'))
+            if worker is None or now - worker['seen'] > self.timeout:
+                return {'error': 'unknown worker'}
+            if op == 'heartbeat':
+                worker['seen'] = now
+                worker['held'] = set(message.get('held', ()))
+                self._rebalance(now)
+                # held from now on, until the worker reports otherwise
+                worker['held'].update(worker['assigned'])
+                return {'items': [item for item in self.items
+                                  if item in worker['assigned']]}
+            if op == 'leave':
+                del self.workers[message['worker']]
+                self._rebalance(now)
+                return {}
+        return {'error': 'unknown operation'}
+
+    def handle(self, sock):
+        """
+        Answers messages on one connection until it is closed.
+        """
+        while True:
+            try:
+                message = _recv_message(sock)
+            except (EOFError, ValueError, socket.error):
+                return
+            _send_message(sock, self.dispatch(message))
+
+    def serve_forever(self):
+        try:
+            import socketserver
+        except ImportError: # Python 2
+            import SocketServer as socketserver
+        coordinator = self
+
+        class Handler (socketserver.BaseRequestHandler):
+            def handle(self):
+                coordinator.handle(self.request)
+
+        class TCPServer (socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+
+        if isinstance(self.address, (tuple, list)):
+            server_class = TCPServer
+            unix = False
+        else:
+            server_class = socketserver.ThreadingUnixStreamServer
+            unix = True
+            _remove_socket(self.address)
+        self.server = server_class(
+            tuple(self.address) if not unix else self.address, Handler)
+        self.server.daemon_threads = True
+        if not unix:
+            self.address = self.server.server_address  # if port was 0
+        self.ready.set()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if unix:
+                os.unlink(self.address)
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class ClusterLimiter (RateLimiter):
+
+    """
+    Rate limiter taking its tokens from a :class:`ClusterCoordinator`, so
+    that API instances in all worker processes share one request budget.
+    Outcomes reported by the API are passed on with the next token request
+    (for an :class:`AdaptiveRateLimiter` on the coordinator). Each thread
+    uses its own connection.
+
+    If the coordinator cannot be reached, requests are spaced out locally
+    at the ``fallback`` rate, which should be the budget divided by the
+    number of workers.
+    """
+
+    RETRY_INTERVAL = 10.0  #: seconds to wait before reconnecting
+
+    def __init__(self, address, fallback=0.5, timeout=5.0):
+        super(ClusterLimiter, self).__init__(fallback)
+        self.address = address
+        self.timeout = timeout
+        self.local = threading.local()
+        self.down_since = None
+        self.reports = []
+
+    def _request(self, message):
+        if (self.down_since is not None and
+                _clock() - self.down_since < self.RETRY_INTERVAL):
+            return None
+        sock = getattr(self.local, 'sock', None)
+        try:
+            if sock is None:
+                sock = _connect(self.address, self.timeout)
+                sock.settimeout(None)  # tokens may take a while
+                self.local.sock = sock
+            _send_message(sock, message)
+            reply = _recv_message(sock)
+            self.down_since = None
+            return reply
+        except (EOFError, ValueError, socket.error):
+            if sock is not None:
+                sock.close()
+            self.local.sock = None
+            self.down_since = _clock()
+            return None
+
+    def acquire(self, priority=PRIORITY_POLL, deadline=None):
+        start = _clock()
+        with self.lock:
+            reports, self.reports = self.reports, []
+            stats = self.stats.setdefault(priority, [0, 0, 0.0, 0.0])
+            stats[0] += 1
+        reply = self._request({
+            'op': 'token', 'priority': priority, 'reports': reports,
+            'within': deadline - start if deadline is not None else None})
+        with self.lock:
+            stats[0] -= 1
+        if reply is None:
+            return super(ClusterLimiter, self).acquire(priority, deadline)
+        wait = _clock() - start
+        with self.lock:
+            stats[1] += 1
+            stats[2] += wait
+            stats[3] = max(stats[3], wait)
+        return wait
+
+    def idle(self):
+        reply = self._request({'op': 'idle'})
+        if reply is None:
+            return super(ClusterLimiter, self).idle()
+        return reply['idle']
+
+    def report(self, ok, latency):
+        with self.lock:
+            self.reports.append((ok, latency))
+
+
+class ClusterWorker (object):
+
+    """
+    Worker process of a :class:`ClusterCoordinator`. It keeps nothing in
+    common with other workers but the coordinator: ``assign(item)`` is
+    called for every item handed to this worker and ``release(item)`` when
+    it is taken away again, e.g. to start and stop a bot for an account::
+
+        >>> bots = {}
+        >>> def assign(username):
+        ...     api = worker.api(username, KEYS[username])
+        ...     bots[username] = start_bot(api)
+        >>> def release(username):
+        ...     bots.pop(username).stop()
+        >>> worker = ClusterWorker(('coordinator', 7531), assign, release)
+        >>> worker.run()
+
+    Both are called from the heartbeat thread and should return quickly.
+    If the coordinator cannot be reached for longer than its ``timeout``
+    less one heartbeat, all items are released, since by then the
+    coordinator may have given them to another worker.
+    """
+
+    def __init__(self, address, assign, release=None, name=None,
+                 timeout=5.0, fallback=0.5):
+        """
+        :param name: Shown in :meth:`ClusterCoordinator.status` (defaults to
+            host name and process id).
+        :param fallback: Rate of :attr:`limiter` while the coordinator
+            cannot be reached.
+        """
+        self.address = address
+        self.assign = assign
+        self.release = release
+        if name is None:
+            name = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.name = name
+        self.timeout = timeout
+        self.limiter = ClusterLimiter(address, fallback, timeout)
+        self.items = []
+        self.worker_id = None
+        self.interval = 1.0
+        self.lease = None
+        self.last_ok = None
+        self.sock = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def api(self, username=None, key=None, **options):
+        """
+        Returns an :class:`ELIZA` instance using the cluster's request
+        budget.
+        """
+        return ELIZA(username, key, self.limiter, **options)
+
+    def _request(self, message):
+        if self.sock is None:
+            self.sock = _connect(self.address, self.timeout)
+        try:
+            _send_message(self.sock, message)
+            return _recv_message(self.sock)
+        except (EOFError, ValueError, socket.error):
+            self.sock.close()
+            self.sock = None
+            raise socket.error('Connection to coordinator lost.')
+
+    def _update(self, items):
+        """
+        Takes on and lets go of items. Returns ``True`` if any were let go.
+        """
+        released = [item for item in self.items if item not in items]
+        if self.release is not None:
+            for item in released:
+                self.release(item)
+        for item in items:
+            if item not in self.items:
+                self.assign(item)
+        self.items = list(items)
+        return bool(released)
+
+    def beat(self):
+        """
+        Sends one heartbeat (registering first if needed) and takes on or
+        lets go of items as told by the coordinator.
+        """
+        now = _clock()
+        try:
+            if self.worker_id is None:
+                reply = self._request({'op': 'register', 'name': self.name})
+                self.worker_id = reply['worker']
+                self.interval = reply['heartbeat']
+                self.lease = reply['timeout']
+            reply = self._request({'op': 'heartbeat', 'worker': self.worker_id,
+                                   'held': self.items})
+            if 'error' in reply:  # we were given up for dead
+                self.worker_id = None
+                self._update([])
+                return
+            self.last_ok = now
+            if self._update(reply['items']):
+                # report at once, so the items can go to another worker
+                reply = self._request({'op': 'heartbeat',
+                                       'worker': self.worker_id,
+                                       'held': self.items})
+                self._update(reply.get('items', []))
+        except socket.error:
+            if (self.last_ok is not None and
+                    now - self.last_ok >= self.lease - self.interval):
+                self._update([])
+
+    def leave(self):
+        """
+        Releases all items and tells the coordinator, which hands them to
+        the other workers at once.
+        """
+        self._update([])
+        if self.worker_id is not None:
+            try:
+                self._request({'op': 'leave', 'worker': self.worker_id})
+            except socket.error:
+                pass
+            self.worker_id = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.beat()
+            self.stopped.wait(self.interval)
+        self.leave()
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, wait=True):
+        self.stopped.set()
+        if wait and self.thread is not None:
+            self.thread.join()
+
+
+def game(game_id):
+    """
+    Returns the status of a game and gives information about the participating
+    players.
+
+    :param game_id: Unique ID of weewar game.
+    :type game_id: int
+    :rtype: dict
+    """
+    return ReadOnlyAPI().game(game_id)
+    
+
+def open_games():
+    """
+    Returns all currently available open games as a list of IDs.
+
+    :rtype: [int]
+    """
+    return ReadOnlyAPI().open_games()
+    
+
+def all_users():
+    """
+    Returns a list of all users who have been online in the last 7 days,
+    including their current ranking.
+
+    :rtype: dict
+    """
+    return ReadOnlyAPI().all_users()
+    
+
+def user(username):
+    """
+    Returns detailed information about a single user, including everything that
+    is visible on the profile page and the games the user is participating in.
+
+    :param username: Unique username of weewar player.
+    :rtype: dict
+    """
+    return ReadOnlyAPI().user(username)
+
+
+def latest_maps():
     """
     Returns the latest published maps including urls for previews, images, and
     other details.
@@ -908,11 +5438,8 @@ def accept_invitation(username, key, game_id):
         api = ELIZA(username, key)
         node = api._simple_game_command(game_id, api.ACCEPT_INVITATION)
         return node.tag == 'ok'
-    except ELIZAError as e:
-        if e.node.text == 'You have already accepted the invitation.':
-            return False
-        else:
-            raise
+    except InvitationAlreadyAccepted:
+        return False
 
 
 def decline_invitation(username, key, game_id):
@@ -931,11 +5458,8 @@ def decline_invitation(username, key, game_id):
         api = ELIZA(username, key)
         node = api._simple_game_command(game_id, api.DECLINE_INVITATION)
         return node.tag == 'ok'
-    except ELIZAError as e:
-        if e.node.text == 'Cannot decline an invitation.':
-            return False
-        else:
-            raise
+    except CannotDeclineInvitation:
+        return False
 
 
 def send_reminder(username, key, game_id):
@@ -954,11 +5478,8 @@ def send_reminder(username, key, game_id):
         api = ELIZA(username, key)
         node = api._simple_game_command(game_id, api.SEND_REMINDER)
         return node.tag == 'ok'
-    except ELIZAError as e:
-        if e.node.text == 'Can not remind current player.':
-            return False
-        else:
-            raise
+    except CannotRemind:
+        return False
 
 
 def surrender_game(username, key, game_id):
@@ -977,12 +5498,8 @@ def surrender_game(username, key, game_id):
         api = ELIZA(username, key)
         node = api._simple_game_command(game_id, api.SURRENDER)
         return node.tag == 'ok'
-    except ELIZAError as e:
-        if e.node.text in ['Can not surrender.',
-                           'Game is not running.']:
-            return False
-        else:
-            raise
+    except (CannotSurrender, GameNotRunning):
+        return False
 
 
 def abandon_game(username, key, game_id):
@@ -1001,11 +5518,8 @@ def abandon_game(username, key, game_id):
         api = ELIZA(username, key)
         node = api._simple_game_command(game_id, api.ABANDON)
         return node.tag == 'ok'
-    except ELIZAError as e:
-        if e.node.text == 'Game is not running.':
-            return False
-        else:
-            raise
+    except GameNotRunning:
+        return False
 
 
 def remove_game(username, key, game_id):
@@ -1024,11 +5538,8 @@ def remove_game(username, key, game_id):
         api = ELIZA(username, key)
         node = api._simple_game_command(game_id, api.REMOVE_GAME)
         return node.tag == 'ok'
-    except ELIZAError as e:
-        if e.node.text == 'Game has already been deleted.':
-            return False
-        else:
-            raise
+    except GameAlreadyDeleted:
+        return False
 
 
 def chat(username, key, game_id, msg):
@@ -1186,3 +5697,247 @@ def repair_unit(username, key, game_id, unit, at):
     """
     api = ELIZA(username, key)
     return api._unit_command(game_id, at, 'repair')
+
+
+#{ command line interface
+def _game_command(cmd):
+    def _run(api, game_id):
+        return api._simple_game_command(game_id, cmd).tag == 'ok'
+    return _run
+
+
+#: sub-command -> (function(api, id), type of ids)
+CLI_ID_COMMANDS = {
+    'game': (lambda api, id_: api.game(id_), int),
+    'user': (lambda api, name: api.user(name), str),
+    'game-state': (lambda api, id_: api.game_state(id_), int),
+    'map-layout': (lambda api, id_: api.map_layout(id_), int),
+    'finish-turn': (_game_command(ELIZA.FINISH_TURN), int),
+    'accept-invitation': (_game_command(ELIZA.ACCEPT_INVITATION), int),
+    'decline-invitation': (_game_command(ELIZA.DECLINE_INVITATION), int),
+    'send-reminder': (_game_command(ELIZA.SEND_REMINDER), int),
+    'surrender': (_game_command(ELIZA.SURRENDER), int),
+    'abandon': (_game_command(ELIZA.ABANDON), int),
+    'remove-game': (_game_command(ELIZA.REMOVE_GAME), int),
+}
+
+def _coordinates(*fields):
+    return tuple((int(x), int(y)) for x, y in zip(fields[::2], fields[1::2]))
+
+
+#: sub-command -> (ELIZA method, fields after the game id, function turning
+#: them into the method's arguments)
+CLI_RECORD_COMMANDS = {
+    'move': ('move', 4, _coordinates),
+    'attack': ('attack', 4, _coordinates),
+    'build': ('build', 3, lambda x, y, type_: (
+        _coordinates(x, y)[0], type_)),
+    'capture': ('capture', 2, _coordinates),
+    'repair': ('repair', 2, _coordinates),
+    'chat': ('chat', 1, lambda msg: (msg, )),
+}
+
+#: sub-command -> function(api) returning a list
+CLI_LIST_COMMANDS = {
+    'open-games': lambda api: api.open_games(),
+    'all-users': lambda api: api.all_users(),
+    'latest-maps': lambda api: api.latest_maps(),
+    'headquarter': lambda api: api.headquarter()['games'],
+}
+
+
+def _read_ids(ids, stream):
+    """
+    Yields ids from the command line or, if there are none (or ``-``), the
+    whitespace separated ids read from ``stream``.
+    """
+    if ids and ids != ['-']:
+        for id_ in ids:
+            yield id_
+        return
+    for line in stream:
+        for id_ in line.split():
+            yield id_
+
+
+def _read_records(fields, stream):
+    """
+    Yields the record given on the command line or, if there is none (or
+    ``-``), each non-empty line of ``stream``.
+    """
+    if fields and fields != ['-']:
+        yield ' '.join(fields)
+        return
+    for line in stream:
+        if line.strip():
+            yield line.strip()
+
+
+def _parse_record(command, record):
+    """
+    Splits a record of a :data:`CLI_RECORD_COMMANDS` command into the game id
+    and the arguments of the method. The last field takes the rest of the
+    line (e.g. a unit type with spaces or a chat message).
+    """
+    method, count, convert = CLI_RECORD_COMMANDS[command]
+    fields = record.split(None, count)
+    if len(fields) != count + 1:
+        raise ValueError(
+            'expected game id and %d fields: %r' % (count, record))
+    return int(fields[0]), convert(*fields[1:])
+
+
+def _run_many(submit, items, limit):
+    """
+    Calls ``submit`` for each item (which returns a future), keeping at most
+    ``limit`` calls pending. Yields ``(item, future)`` as calls finish.
+    """
+    pending = {}
+    for item in items:
+        pending[submit(item)] = item
+        if len(pending) >= limit:
+            done, _ = futures.wait(
+                pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+    for future in futures.as_completed(list(pending)):
+        yield pending.pop(future), future
+
+
+def main(argv=None, stdin=None, stdout=None):
+    """
+    Entry point of the ``weewar`` command. Results are written as one JSON
+    object per line::
+
+        $ echo 18682 21885 | weewar game
+        {"id": 18682, "result": {"id": 18682, "name": "Twins, Basil!", ...}}
+        {"id": 21885, "error": "GameNotFound: 21885"}
+
+    Commands for units (see :data:`CLI_RECORD_COMMANDS`) read one record
+    per line, the game id followed by coordinates (and the unit type or
+    message). Commands for the same game are sent in order::
+
+        $ printf '18682 3 4 4 4\n18682 4 4 5 4\n' | weewar attack
+        {"record": "18682 3 4 4 4", "result": {"command": "attack", ...}}
+
+    Returns exit code 1 if any call failed.
+    """
+    import argparse
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+
+    parser = argparse.ArgumentParser(
+        prog='weewar', description='Command line client for the Weewar API.')
+    parser.add_argument('--username', default=os.environ.get('WEEWAR_USERNAME'),
+                        help='weewar username (or $WEEWAR_USERNAME)')
+    parser.add_argument('--key', default=os.environ.get('WEEWAR_KEY'),
+                        help='API key (or $WEEWAR_KEY)')
+    parser.add_argument('--host', default=ReadOnlyAPI.HOST,
+                        help='API server (default: %(default)s)')
+    parser.add_argument('--rate', type=float,
+                        default=ReadOnlyAPI.REQUESTS_PER_SECOND,
+                        help='max requests per second (default: %(default)s)')
+    parser.add_argument('--max-rate', type=float, metavar='RATE',
+                        help='adapt the rate to the server, starting at '
+                             '--rate: up to RATE requests per second and '
+                             'down to 0.5 (or --rate if lower)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='concurrent requests (default: %(default)s)')
+    parser.add_argument('--cache', metavar='SOCKET',
+                        help='use cache daemon listening on SOCKET')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+    for name in sorted(CLI_ID_COMMANDS):
+        sub = commands.add_parser(name, help='%s for each id' % name)
+        sub.add_argument('ids', nargs='*',
+                         help='ids (read from stdin if omitted or -)')
+    for name in sorted(CLI_RECORD_COMMANDS):
+        sub = commands.add_parser(name, help='%s for each record' % name)
+        sub.add_argument('record', nargs='*',
+                         help='game id and arguments (lines of stdin if '
+                              'omitted or -)')
+    for name in sorted(CLI_LIST_COMMANDS):
+        commands.add_parser(name, help=name)
+    sub = commands.add_parser('cache-server', help='run cache daemon')
+    sub.add_argument('socket', help='path of Unix socket')
+    args = parser.parse_args(argv)
+
+    if args.command == 'cache-server':
+        CacheServer(args.socket).serve_forever()
+        return 0
+
+    cache = SocketCache(args.cache) if args.cache else None
+    if args.max_rate:
+        limiter = AdaptiveRateLimiter(
+            args.rate, floor=min(args.rate, 0.5),
+            ceiling=args.max_rate)
+    else:
+        limiter = RateLimiter(args.rate)
+    api = ELIZA(args.username, args.key, limiter, cache)
+    api.HOST = args.host
+
+    def _write(record):
+        stdout.write(json.dumps(record) + '\n')
+        stdout.flush()
+
+    def _error(e):
+        return '%s: %s' % (type(e).__name__, e)
+
+    if args.command in CLI_LIST_COMMANDS:
+        try:
+            for item in CLI_LIST_COMMANDS[args.command](api):
+                _write(item)
+        except Exception as e:
+            _write({'error': _error(e)})
+            return 1
+        return 0
+
+    failed = False
+    if args.command in CLI_RECORD_COMMANDS:
+        method = CLI_RECORD_COMMANDS[args.command][0]
+
+        def _submit(record):
+            try:
+                game_id, arguments = _parse_record(args.command, record)
+            except (TypeError, ValueError) as e:
+                future = futures.Future()
+                future.set_exception(e)
+                return future
+            return mux.submit(game_id, method, *arguments)
+
+        with CommandMultiplexer(api, args.workers) as mux:
+            for record, future in _run_many(
+                    _submit, _read_records(args.record, stdin),
+                    2 * args.workers):
+                try:
+                    _write({'record': record, 'result': future.result()})
+                except Exception as e:
+                    failed = True
+                    _write({'record': record, 'error': _error(e)})
+        return 1 if failed else 0
+
+    func, type_ = CLI_ID_COMMANDS[args.command]
+
+    def _id(id_):
+        try:
+            return type_(id_)
+        except ValueError:
+            return id_  # reported as error by the call
+
+    def _call(id_):
+        return func(api, type_(id_))
+
+    with futures.ThreadPoolExecutor(args.workers) as executor:
+        for id_, future in _run_many(
+                lambda id_: executor.submit(_call, id_),
+                _read_ids(args.ids, stdin), 2 * args.workers):
+            try:
+                _write({'id': _id(id_), 'result': future.result()})
+            except Exception as e:
+                failed = True
+                _write({'id': _id(id_), 'error': _error(e)})
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())